@@ -19,5 +19,10 @@
 
 # Dependencies: Python 2.6, wxPython 2.8.9.1
 
-import controller
+# the guard keeps worker processes (see PROCESSES in DirCompare.rc) from
+# bringing up the GUI on Windows
+if __name__ == '__main__':
+    import multiprocessing
+    multiprocessing.freeze_support()
+    import controller
 
@@ -0,0 +1,571 @@
+#    -*- coding: utf-8 -*-
+#    Advanced directory compare tool in Python.
+#
+#    Copyright (C) 2008, 2009  Pan Xingzhi
+#    http://code.google.com/p/dircompare/
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Benchmarks of the comparison engine.
+
+Usage:
+    python benchmark.py [workers ...]
+        times comparisons with the given numbers of workers
+    python benchmark.py memory
+        estimates the memory taken per DataItem, and per node of the same
+        tree laid out as DataItems used to be
+    python benchmark.py ignore [patterns [paths]]
+        times matching paths against ignore patterns, 1000 against 1000000
+        by default
+    python benchmark.py syscalls
+        checks that a comparison lists every folder once on each side and
+        stats every entry once; exit status is 1 if not
+    python benchmark.py suite [options] [shape ...]
+        times comparing, copying, deleting and loading a snapshot on trees
+        of every shape in SHAPES, and tells the regressions from a baseline
+        saved before; see suiteMain"""
+
+from __future__ import print_function
+import os
+import os.path as path
+import sys
+import shutil
+import tempfile
+import time
+import random
+import re
+import json
+import platform
+import resource
+import optparse
+import multiprocessing
+import threading
+
+import configuration as conf
+import model
+import hashcache
+import ignorerules
+import snapshot
+model.DataItem.updateUI = lambda self: None
+
+def makeTrees(root, width=8, depth=3, files=20, size=4096, diffRatio=0.01, seed=0,
+              oneSideRatio=0.0):
+    """Generates two mostly identical trees under <root>.
+    Every folder has <width> sub folders and <files> files of <size> bytes,
+    down to <depth> levels. About <diffRatio> of the files differ, and about
+    <oneSideRatio> are only on one side, either.
+    Returns (leftPath, rightPath)."""
+    rnd = random.Random(seed)
+    left, right = path.join(root, 'left'), path.join(root, 'right')
+    def fill(rel, level):
+        for side in (left, right):
+            os.makedirs(path.join(side, rel))
+        for i in range(files):
+            content = ''.join(chr(rnd.randint(0, 255)) for j in range(16)) * (size // 16)
+            name = path.join(rel, 'f%d' % i)
+            sides = (left, right)
+            if oneSideRatio and rnd.random() < oneSideRatio:
+                sides = (rnd.choice(sides), )
+            for side in sides:
+                fp = open(path.join(side, name), 'wb')
+                fp.write(content if side is left or rnd.random() >= diffRatio else content[::-1])
+                fp.close()
+        if level < depth:
+            for i in range(width):
+                fill(path.join(rel, 'd%d' % i), level + 1)
+    fill('', 1)
+    return left, right
+
+def timeCompare(leftPath, rightPath, workers):
+    """Returns (seconds, number of entries) of one comparison."""
+    start = time.time()
+    rootDataItem = model.DirectoryDataItem('', leftPath, rightPath)
+    rootDataItem.compare(workers=workers)
+    elapsed = time.time() - start
+    def count(itm):
+        return 1 + sum(count(c) for c in itm.children) if itm.isDir() else 1
+    return elapsed, count(rootDataItem)
+
+def nodeBytes(rootDataItem):
+    """Estimates the memory taken by a DataItem tree.
+    Returns (bytes, number of nodes). Objects shared by many nodes,
+    like interned names, are counted once."""
+    seen = set(id(status) for status in model._STATUSES)
+    total = [0]
+    def add(obj):
+        if id(obj) in seen:
+            return
+        seen.add(id(obj))
+        total[0] += sys.getsizeof(obj)
+        if isinstance(obj, tuple):
+            map(add, obj)
+    nodes = 0
+    stack = [rootDataItem]
+    while stack:
+        itm = stack.pop()
+        nodes += 1
+        add(itm)
+        values = []
+        if hasattr(itm, '__dict__'):
+            add(itm.__dict__)
+            values.extend(itm.__dict__.values())
+        for cls in type(itm).__mro__:
+            for slot in getattr(cls, '__slots__', ()):
+                if slot.startswith('__'):
+                    slot = '_' + cls.__name__ + slot
+                values.append(getattr(itm, slot, None))
+        for value in values:
+            # other nodes are counted on their own
+            if not isinstance(value, (model.DataItem, DictNode)):
+                add(value)
+        if itm.isDir():
+            stack.extend(itm.children)
+    return total[0], nodes
+
+class DictNode(object):
+    """A DataItem laid out as before it had __slots__, to tell what they
+    save: attributes in a __dict__, both locations joined again for every
+    item, names not interned and stat signatures as tuples."""
+
+    def __init__(self, name, leftLocation, rightLocation, parent, status, isDir):
+        # a copy, as every listing gave its own
+        self.name = name[:1] + name[1:]
+        self.leftLocation = leftLocation
+        self.rightLocation = rightLocation
+        self.parent = parent
+        self._DataItem__status = status
+        if isDir:
+            self.children = []
+
+    def isDir(self):
+        return hasattr(self, 'children')
+
+def dictTree(rootDataItem):
+    """Returns a copy of a compared tree made of DictNodes."""
+    def copy(itm, parent):
+        if parent is None:
+            locations = itm.leftLocation, itm.rightLocation
+        else:
+            locations = (path.join(parent.leftLocation, parent.name),
+                         path.join(parent.rightLocation, parent.name))
+        node = DictNode(itm.name, locations[0], locations[1], parent, itm.status, itm.isDir())
+        for side in ('left', 'right'):
+            sig = getattr(itm, side + 'Sig')
+            if sig is not None:
+                # (size, mtime, inode)
+                setattr(node, side + 'Sig', model._SIGNATURE.unpack(sig))
+        if itm.isDir():
+            for child in itm.children:
+                node.children.append(copy(child, node))
+        return node
+    return copy(rootDataItem, None)
+
+def benchmarkWorkers(workersList):
+    # read the files, otherwise there's little work for the workers
+    conf.shallow = '0'
+    root = tempfile.mkdtemp(prefix='dircompare-bench-')
+    try:
+        leftPath, rightPath = makeTrees(root)
+        for workers in workersList:
+            elapsed, entries = timeCompare(leftPath, rightPath, workers)
+            print('workers: %3d, entries: %d, seconds: %.3f, entries/sec: %.0f'
+                    % (workers, entries, elapsed, entries / elapsed))
+    finally:
+        shutil.rmtree(root)
+
+def benchmarkMemory():
+    root = tempfile.mkdtemp(prefix='dircompare-bench-')
+    try:
+        leftPath, rightPath = makeTrees(root, width=10, depth=3, files=50, size=16)
+        rootDataItem = model.DirectoryDataItem('', leftPath, rightPath)
+        rootDataItem.compare()
+        for label, tree in (('DataItems', rootDataItem),
+                            ('__dict__ nodes', dictTree(rootDataItem))):
+            total, nodes = nodeBytes(tree)
+            print('%-15s nodes: %d, bytes: %d, bytes/node: %.0f'
+                    % (label + ':', nodes, total, total / float(nodes)))
+    finally:
+        shutil.rmtree(root)
+
+def makeIgnorePatterns(count, seed=0):
+    """Generates <count> ignore patterns of all kinds: mostly names and
+    '*.ext', some name globs, folder and path patterns, and a few '!'."""
+    rnd = random.Random(seed)
+    patterns = []
+    for i in range(count):
+        kind = rnd.random()
+        if kind < 0.4:
+            patterns.append('name%d' % i)
+        elif kind < 0.7:
+            patterns.append('*.ext%d' % i)
+        elif kind < 0.8:
+            patterns.append('tmp%d_*' % i)
+        elif kind < 0.85:
+            patterns.append('build%d/' % i)
+        elif kind < 0.9:
+            patterns.append('dir%d/*.log' % rnd.randrange(100))
+        elif kind < 0.95:
+            patterns.append('**/cache%d' % i)
+        else:
+            patterns.append('!keep%d.ext%d' % (i, rnd.randrange(count)))
+    return patterns
+
+def makeIgnorePaths(count, patterns, seed=0):
+    """Generates <count> (relDir, name, isDir), about a tenth of them
+    ignored by <patterns>."""
+    rnd = random.Random(seed)
+    words = ['src', 'lib', 'doc', 'test', 'data'] + ['dir%d' % i for i in range(100)]
+    dirs = ['/'.join(rnd.choice(words) for j in range(rnd.randint(0, 6)))
+            for i in range(1000)]
+    names = ['file%d.py' % i for i in range(1000)]
+    for pattern in patterns[:100]:
+        names.append(pattern.lstrip('!*/').replace('*', 'x').split('/')[-1])
+    paths = []
+    for i in range(count):
+        name = rnd.choice(names) if rnd.random() < 0.9 else rnd.choice(names[1000:])
+        paths.append((rnd.choice(dirs), name, rnd.random() < 0.1))
+    return paths
+
+def benchmarkIgnore(patternCount=1000, pathCount=1000000):
+    patterns = makeIgnorePatterns(patternCount)
+    start = time.time()
+    rules = ignorerules.IgnoreRules(patterns)
+    print('patterns: %d, compiled in %.3f seconds' % (patternCount, time.time() - start))
+    # paths are matched in rounds, so that they don't take all the memory
+    sample = makeIgnorePaths(min(pathCount, 100000), patterns)
+    ignores = rules.ignores
+    ignored, done = 0, 0
+    start = time.time()
+    while done < pathCount:
+        for relDir, name, isDir in sample[:pathCount - done]:
+            if ignores(relDir, name, isDir):
+                ignored += 1
+        done += min(len(sample), pathCount - done)
+    elapsed = time.time() - start
+    print('paths: %d, ignored: %d, seconds: %.3f, paths/sec: %.0f'
+            % (done, ignored, elapsed, done / elapsed))
+
+    # the same patterns matched one by one, on a few paths
+    import fnmatch
+    oneByOne = [(pattern.startswith('!'), re.compile(fnmatch.translate(pattern.lstrip('!'))).match)
+                for pattern in patterns]
+    few = sample[:1000]
+    start = time.time()
+    for relDir, name, isDir in few:
+        for negate, match in reversed(oneByOne):
+            if match(name):
+                break
+    elapsed = time.time() - start
+    print('one pattern at a time: paths: %d, seconds: %.3f, paths/sec: %.0f'
+            % (len(few), elapsed, len(few) / elapsed))
+
+class _CountedEntry(object):
+    """A scandir entry whose stat calls are counted."""
+
+    def __init__(self, entry, count):
+        self.name, self.path = entry.name, entry.path
+        self.__entry, self.__count = entry, count
+
+    def is_dir(self):
+        return self.__entry.is_dir()
+
+    def stat(self):
+        self.__count('stat', self.path)
+        return self.__entry.stat()
+
+def countSyscalls(leftPath, rightPath):
+    """Compares two trees with os.listdir, os.stat, os.lstat and scandir
+    counted, in this process. Returns {('list' or 'stat', full name):
+    number of calls}. The hash cache is opened first, and not counted."""
+    hashcache.getCache()
+    counts = {}
+    lock = threading.Lock()
+    def count(kind, fullName):
+        key = (kind, path.normpath(fullName))
+        with lock:
+            counts[key] = counts.get(key, 0) + 1
+    def counted(kind, func):
+        def call(fullName, *args, **kwargs):
+            count(kind, fullName)
+            return func(fullName, *args, **kwargs)
+        return call
+    saved = os.listdir, os.stat, os.lstat, model.scandir
+    # os.path calls these too, so what it does is counted along
+    os.listdir = counted('list', os.listdir)
+    os.stat, os.lstat = counted('stat', os.stat), counted('stat', os.lstat)
+    if model.scandir:
+        scandir = model.scandir
+        def countedScandir(dirName):
+            count('list', dirName)
+            return [_CountedEntry(entry, count) for entry in scandir(dirName)]
+        model.scandir = countedScandir
+    try:
+        rootDataItem = model.DirectoryDataItem('', leftPath, rightPath)
+        rootDataItem.compare(processes=1, detectMoves=False)
+    finally:
+        os.listdir, os.stat, os.lstat, model.scandir = saved
+    return counts
+
+def checkSyscalls():
+    """Checks that comparing lists every folder exactly once on each side,
+    and stats every entry in them exactly once. The roots are stat'ed on
+    their own, and not checked. Returns the number of failures."""
+    root = tempfile.mkdtemp(prefix='dircompare-bench-', dir=scratchRoot())
+    try:
+        leftPath, rightPath = makeTrees(root, width=3, depth=3, files=5, size=64,
+                                        oneSideRatio=0.2)
+        # one side folders are listed too
+        os.makedirs(path.join(leftPath, 'leftOnly', 'sub'))
+        open(path.join(leftPath, 'leftOnly', 'sub', 'f'), 'wb').close()
+        counts = countSyscalls(leftPath, rightPath)
+        expected = {}
+        for top in (leftPath, rightPath):
+            for dirName, folders, files in os.walk(top):
+                expected[('list', path.normpath(dirName))] = 1
+                for name in folders + files:
+                    expected[('stat', path.normpath(path.join(dirName, name)))] = 1
+        roots = (path.normpath(leftPath), path.normpath(rightPath))
+        failures = 0
+        for key in sorted(set(expected).union(counts)):
+            kind, fullName = key
+            if kind == 'stat' and fullName in roots:
+                continue
+            if counts.get(key, 0) != expected.get(key, 0):
+                print('%s %s: %d call(s), %d expected'
+                        % (kind, fullName, counts.get(key, 0), expected.get(key, 0)))
+                failures += 1
+        print('folders: %d, entries: %d, listings: %d, stats: %d, failures: %d'
+                % (sum(1 for kind, fullName in expected if kind == 'list'),
+                   sum(1 for kind, fullName in expected if kind == 'stat'),
+                   sum(n for (kind, fullName), n in counts.iteritems() if kind == 'list'),
+                   sum(n for (kind, fullName), n in counts.iteritems() if kind == 'stat'),
+                   failures))
+        return failures
+    finally:
+        shutil.rmtree(root)
+
+# the trees of the suite, by name: makeTrees arguments
+SHAPES = {
+    # one folder of many files
+    'wide': dict(width=0, depth=1, files=20000, size=256),
+    # a long chain of folders with a few files each, deeper than anything
+    # recursing a few calls a level could go; shutil.rmtree, which cleans
+    # up, recurses one call a level
+    'deep': dict(width=1, depth=900, files=4, size=256),
+    'small': dict(width=8, depth=3, files=50, size=64),
+    'huge': dict(width=0, depth=1, files=4, size=32 * 1024 * 1024),
+    # mostly identical, with differences and one side files here and there
+    'scattered': dict(width=8, depth=3, files=40, size=4096, diffRatio=0.02, oneSideRatio=0.02),
+}
+# what's checked against the baseline: seconds taken, and peak RSS
+MEASURES = ('compare', 'copy', 'delete', 'save', 'load', 'peakRss')
+BASELINE_FILE = 'benchmark-baseline.json'
+
+def scratchRoot():
+    """Returns where the suite's trees are generated: a tmpfs if there's
+    one, so that disks don't get measured."""
+    for each in ('/dev/shm', ):
+        if path.isdir(each) and os.access(each, os.W_OK):
+            return each
+    return None
+
+def shapeArgs(shape, scale=1.0):
+    """Returns the makeTrees arguments of <shape>, with <scale> times
+    the files."""
+    args = dict(SHAPES[shape])
+    args['files'] = max(1, int(args['files'] * scale))
+    return args
+
+def _makeShape(args):
+    shape, scale, root = args
+    return makeTrees(root, **shapeArgs(shape, scale))
+
+def _countItems(rootDataItem):
+    return 1 + sum(1 for itm in rootDataItem.iterSubItems())
+
+def _runShape(args):
+    """Measures a shape generated under <root>, in a process of its own so
+    that its peak RSS is its own. Returns {measure: value}."""
+    leftPath, rightPath, root, repeat = args
+    result = {}
+    # read the files, so that they get compared, not only stat'ed
+    conf.shallow = '0'
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        rootDataItem = model.DirectoryDataItem('', leftPath, rightPath)
+        rootDataItem.compare(detectMoves=False)
+        times.append(time.time() - start)
+    result['compare'] = min(times)
+    result['entries'] = entries = _countItems(rootDataItem)
+    result['entriesPerSec'] = entries / max(result['compare'], 1e-9)
+
+    fileName = path.join(root, 'session.dcs')
+    start = time.time()
+    snapshot.save(rootDataItem, fileName)
+    result['save'] = time.time() - start
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        loaded, session = snapshot.load(fileName)
+        # everything decoded, as when the whole tree is walked
+        _countItems(loaded)
+        times.append(time.time() - start)
+    result['load'] = min(times)
+
+    # makes the right side the same as the left, one item at a time: one
+    # side folders as a whole, and files
+    copies, deletes = [], []
+    stack = [rootDataItem]
+    while stack:
+        itm = stack.pop()
+        if itm.status is model.STATUS_LEFT_ONLY:
+            copies.append(itm)
+        elif itm.status is model.STATUS_RIGHT_ONLY:
+            deletes.append(itm)
+        elif itm.isDir():
+            stack.extend(itm.children)
+        elif itm.status is model.STATUS_COMMON_DIFF:
+            copies.append(itm)
+    start = time.time()
+    for itm in copies:
+        itm.copyTo('left', 'right')
+    result['copy'] = time.time() - start
+    start = time.time()
+    for itm in deletes:
+        itm.delete('right')
+    result['delete'] = time.time() - start
+    result['copied'], result['deleted'] = len(copies), len(deletes)
+
+    # kilobytes on Linux
+    result['peakRss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return result
+
+def runSuite(shapes, scale=1.0, repeat=3):
+    """Runs the suite on <shapes>. Returns {shape: {measure: value}}."""
+    results = {}
+    for shape in shapes:
+        root = tempfile.mkdtemp(prefix='dircompare-bench-', dir=scratchRoot())
+        try:
+            # every job in a new process
+            pool = multiprocessing.Pool(1, maxtasksperchild=1)
+            try:
+                leftPath, rightPath = pool.apply(_makeShape, ((shape, scale, root), ))
+                results[shape] = pool.apply(_runShape, ((leftPath, rightPath, root, repeat), ))
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            shutil.rmtree(root)
+    return results
+
+def regressions(results, baseline, tolerance):
+    """Returns [(shape, measure, baseline value, value)] of the measures
+    more than <tolerance>, a fraction, above their baseline. Times too
+    short to tell are left out."""
+    found = []
+    for shape, measures in sorted(results.iteritems()):
+        old = baseline.get(shape, {})
+        for measure in MEASURES:
+            if measure not in old or measure not in measures:
+                continue
+            if measure != 'peakRss' and max(old[measure], measures[measure]) < 0.01:
+                continue
+            if measures[measure] > old[measure] * (1 + tolerance):
+                found.append((shape, measure, old[measure], measures[measure]))
+    return found
+
+def loadBaseline(fileName):
+    """Returns the baseline saved in <fileName>: (environment, results)."""
+    fp = open(fileName, 'rb')
+    try:
+        saved = json.load(fp)
+    finally:
+        fp.close()
+    return saved['environment'], saved['results']
+
+def saveBaseline(fileName, environment, results):
+    fp = open(fileName, 'wb')
+    try:
+        json.dump({'environment': environment, 'results': results}, fp,
+                  indent=1, sort_keys=True)
+    finally:
+        fp.close()
+
+def suiteMain(args=None):
+    """Runs the suite, prints the results and compares them with the
+    baseline if there's one. Exit status is 1 if anything regressed."""
+    parser = optparse.OptionParser(usage='python benchmark.py suite [options] [shape ...]',
+            description='Shapes: %s, all by default.' % ', '.join(sorted(SHAPES)))
+    parser.add_option('-b', '--baseline', default=BASELINE_FILE, metavar='FILE',
+            help='the baseline to compare with, or to save [default: %default]')
+    parser.add_option('-s', '--save', action='store_true', default=False,
+            help='save the results as the baseline')
+    parser.add_option('-t', '--tolerance', type='float', default=20, metavar='PERCENT',
+            help='how much slower or bigger is a regression [default: %default]')
+    parser.add_option('-r', '--repeat', type='int', default=3,
+            help='times a comparison and a load are repeated, the best kept '
+                 '[default: %default]')
+    parser.add_option('--scale', type='float', default=1.0,
+            help='generate that many times the files [default: %default]')
+    options, shapes = parser.parse_args(args)
+    unknown = set(shapes).difference(SHAPES)
+    if unknown:
+        parser.error('unknown shape(s): %s' % ', '.join(sorted(unknown)))
+    environment = {'python': platform.python_version(), 'machine': platform.machine(),
+                   'system': platform.system(), 'scale': options.scale,
+                   'workers': int(conf.workers), 'processes': int(conf.processes),
+                   'tmpfs': scratchRoot() is not None}
+
+    results = runSuite(shapes or sorted(SHAPES), options.scale, options.repeat)
+    for shape, measures in sorted(results.iteritems()):
+        print('%-10s entries: %6d, compare: %.3f s, entries/sec: %.0f, save: %.3f s, '
+              'load: %.3f s, copy: %.3f s (%d), delete: %.3f s (%d), peak RSS: %.1f MB'
+                % (shape, measures['entries'], measures['compare'], measures['entriesPerSec'],
+                   measures['save'], measures['load'], measures['copy'], measures['copied'],
+                   measures['delete'], measures['deleted'], measures['peakRss'] / 1048576.0))
+
+    if options.save:
+        if path.exists(options.baseline):
+            # shapes not run this time are kept
+            results = dict(loadBaseline(options.baseline)[1], **results)
+        saveBaseline(options.baseline, environment, results)
+        print('baseline saved to %s' % options.baseline)
+        return 0
+    if not path.exists(options.baseline):
+        print('no baseline to compare with, see --save')
+        return 0
+    oldEnvironment, baseline = loadBaseline(options.baseline)
+    if oldEnvironment != environment:
+        print('warning: the baseline was taken in another environment: %s' % oldEnvironment)
+    found = regressions(results, baseline, options.tolerance / 100.0)
+    for shape, measure, old, new in found:
+        print('regression: %s %s: %.3f -> %.3f (%+.0f%%)'
+                % (shape, measure, old, new, (new / old - 1) * 100 if old else 100))
+    if not found:
+        print('no regression against %s' % options.baseline)
+    return 1 if found else 0
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['memory']:
+        benchmarkMemory()
+    elif sys.argv[1:2] == ['ignore']:
+        benchmarkIgnore(*map(int, sys.argv[2:4]))
+    elif sys.argv[1:2] == ['syscalls']:
+        sys.exit(1 if checkSyscalls() else 0)
+    elif sys.argv[1:2] == ['suite']:
+        sys.exit(suiteMain(sys.argv[2:]))
+    else:
+        benchmarkWorkers(map(int, sys.argv[1:]) or [1, 4, 16])
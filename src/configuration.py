@@ -21,7 +21,11 @@ from __future__ import print_function
 import ConfigParser as cp
 config=cp.ConfigParser()
 try:
-    config.read(['DirCompare.rc'])
+    # the one in the current folder overrides the one next to this module,
+    # so that command line tools work from anywhere
+    import os.path as path
+    config.read([path.join(path.dirname(path.abspath(__file__)), 'DirCompare.rc'),
+                 'DirCompare.rc'])
     def get(key):
         return config.get('default', key)
     defaultFrameSize = get('DEFAULT_FRAME_SIZE')
@@ -31,10 +35,25 @@ try:
     oneSideBgColor = get('ONE_SIDE_BG_COLOR')
     diffTextColor = get('DIFF_TEXT_COLOR')
     diffBgColor = get('DIFF_BG_COLOR')
+    pendingTextColor = get('PENDING_TEXT_COLOR')
+    movedTextColor = get('MOVED_TEXT_COLOR')
     loggingLevel = get('LOGGING_LEVEL')
     logFile = get('LOG_FILE')
     fileCmpCommand = get('FILE_CMP_COMMAND')
     shallow = get('SHALLOW')
+    workers = get('WORKERS')
+    blockSize = get('BLOCK_SIZE')
+    processes = get('PROCESSES')
+    hashCache = get('HASH_CACHE')
+    hashCacheSize = get('HASH_CACHE_SIZE')
+    watchDelay = get('WATCH_DELAY')
+    watchMaxDelay = get('WATCH_MAX_DELAY')
+    watchInterval = get('WATCH_INTERVAL')
+    lazy = get('LAZY')
+    prefetchLevels = get('PREFETCH_LEVELS')
+    detectMoves = get('DETECT_MOVES')
+    profile = get('PROFILE')
+    profileFile = get('PROFILE_FILE')
 except (cp.ParsingError, cp.NoSectionError) as e:
     # error(s) in the config file
     import sys
@@ -28,6 +28,9 @@ except ImportError as e:
 import os
 import os.path as path
 import cPickle
+import threading
+import bisect
+import time
 
 ##############################
 # event handlers             #
@@ -36,19 +39,15 @@ def genOnItemActivated(srcTree, otherTree):
     """Generates closures as handlers on tree item activated."""
     def onItemActivated(event):
         event.Skip()
-        srcTreeItem = event.GetItem()
-        pyData = srcTree.GetPyData(srcTreeItem)
-        dataItem, otherTreeItem = pyData.data, pyData.getOtherTreeItem(srcTreeItem)
-        if not srcTree.IsExpanded(srcTreeItem):
-            if dataItem.isDir() and not srcTree.ItemHasChildren(srcTreeItem):
-                drawNodes(dataItem.children, pyData.lTreeItem, pyData.rTreeItem)
-            elif dataItem.isFile():
-                onCmp(event)
-            otherTree.Expand(otherTreeItem)
+        row = event.GetIndex()
+        dataItem = rows[row]
+        if dataItem.isFile():
+            onCmp(event)
+        elif isExpanded(dataItem):
+            collapse(row)
         else:
-            otherTree.Collapse(otherTreeItem)
-        srcTree.Refresh()
-        otherTree.Refresh()
+            expand(row)
+        syncScroll(srcTree, otherTree)
     return onItemActivated
 
 def genOnSelChanged(srcTree, otherTree):
@@ -56,7 +55,16 @@ def genOnSelChanged(srcTree, otherTree):
     def onSelChanged(event):
         event.Skip()
         if otherTree:
-            otherTree.UnselectAll()
+            otherTree.selectRows(())
+        dataItem = rows[event.GetIndex()]
+        if dataItem.isDir() and not cmpProgress and not syncProgress:
+            showStats(dataItem)
+        elif dataItem.status in (model.STATUS_LEFT_MOVED, model.STATUS_RIGHT_MOVED):
+            frame.SetStatusText('Moved: the same file is %s on the %s side.' %
+                    (dataItem.counterpart,
+                     'right' if dataItem.status is model.STATUS_LEFT_MOVED else 'left'))
+        elif dataItem.mergeStatus is not None:
+            frame.SetStatusText('Since the base: %s.' % dataItem.mergeStatus)
     return onSelChanged
 
 def genOnCopy(srcSide, destSide):
@@ -68,10 +76,13 @@ def genOnCopy(srcSide, destSide):
             info('Please select one and only one valid item to copy.\nCopying multiple items is not allowed now.',
                     caption='Operation not supported')
         window, selections = getSelections(promptError)
-        for each in selections:
-            dataItem = window.GetPyData(each).data
-            # TODO catch exceptions
-            dataItem.copyTo(srcSide, destSide)
+        with model.batch():
+            for dataItem in selections:
+                try:
+                    dataItem.copyTo(srcSide, destSide)
+                except model.InvalidMethodInvocationError, e:
+                    alert(str(e))
+                    break
     return onCopy
 
 def onDel(event):
@@ -88,10 +99,10 @@ def onDel(event):
     else:
         raise InvalidValueError()
 
-    for each in selections:
-        dataItem = window.GetPyData(each).data
-        # TODO catch exceptions
-        dataItem.delete(side)
+    with model.batch():
+        for dataItem in selections:
+            # TODO catch exceptions
+            dataItem.delete(side)
 
 def onCmp(event):
     # TODO block user actions when comparing files?
@@ -103,11 +114,10 @@ def onCmp(event):
         info('Please select one and only one file item to compare.',
                 caption='Operation not supported')
     window, selections = getSelections(promptError)
-    if not window.GetPyData(selections[0]).data.isFile():
+    if not selections or not selections[0].isFile():
         promptError()
         return
-    for each in selections:
-        dataItem = window.GetPyData(each).data
+    for dataItem in selections:
         # TODO catch exceptions
         dataItem.compare()
 
@@ -118,7 +128,98 @@ def onRefreshAll(event):
     except NameError:
         # can't find cmpSession
        alert('Nothing to refresh.')
-    startCmp(cmpSession)
+       return
+    try:
+        rootDataItem
+    except NameError:
+        startCmp(cmpSession)
+        return
+    if (rootDataItem.leftLocation, rootDataItem.rightLocation) != \
+       (cmpSession.leftPath, cmpSession.rightPath):
+        startCmp(cmpSession)
+        return
+    # only what has changed is compared again
+    rootDataItem.refresh(cmpSession.ignore, filters=cmpSession.filters)
+
+def onWatch(event):
+    """Starts/stops keeping the comparison up to date with the file system."""
+    event.Skip()
+    global fsWatcher
+    if fsWatcher:
+        stopWatching()
+        return
+    try:
+        rootDataItem
+    except NameError:
+        alert('Nothing to watch.')
+        return
+    fsWatcher = watcher.Watcher(rootDataItem, cmpSession.ignore, callAfter=wx.CallAfter,
+                                filters=cmpSession.filters)
+    fsWatcher.start()
+    frame.SetStatusText('Watching for changes. Click W again to stop.')
+
+def genOnSyncAll(srcSide, destSide):
+    """Generates closures as handlers on copying everything that differs
+    from one side to the other."""
+    def onSyncAll(event):
+        event.Skip()
+        try:
+            rootDataItem
+        except NameError:
+            alert('Nothing to copy.')
+            return
+        try:
+            plan = sync.planSync(rootDataItem, srcSide, destSide)
+        except model.InvalidMethodInvocationError, e:
+            alert(str(e))
+            return
+        if not plan.operations:
+            info('Nothing differs on the %s side.' % srcSide, caption='Copy all')
+            return
+        clones = plan.count('clone')
+        answer = wx.MessageBox('Copy %d files (%s) and create %d folders from %s to %s?%s' %
+                (plan.count('copy') + clones, formatBytes(plan.totalBytes()), plan.count('mkdir'),
+                 srcSide, destSide,
+                 '\n%d of them are moved files, copied from where they are on the %s side.' %
+                 (clones, destSide) if clones else ''),
+                'Copy all', style=wx.YES_NO | wx.ICON_QUESTION, parent=frame)
+        if answer == wx.YES:
+            startSync(plan)
+    return onSyncAll
+
+def onCancel(event):
+    """Stops the comparison or the sync running in the background."""
+    event.Skip()
+    for progress in (cmpProgress, syncProgress):
+        if progress:
+            progress.cancel()
+            frame.SetStatusText('Cancelling...')
+
+def onProgressTimer(event):
+    """Shows how far the comparison or the sync running in the background is."""
+    if syncProgress:
+        progress = syncProgress
+        if progress.cancelled:
+            return
+        eta = progress.eta()
+        frame.SetStatusText('%d of %d operations, %s of %s copied, %s/s%s' %
+                (progress.operations, progress.operationsTotal,
+                 formatBytes(progress.bytes), formatBytes(progress.bytesTotal),
+                 formatBytes(progress.rate()),
+                 ', about %s left' % formatSeconds(eta) if eta is not None else ''))
+        frame.gauge.SetValue(100 * progress.operations / max(progress.operationsTotal, 1))
+        return
+    progress = cmpProgress
+    if not progress or progress.cancelled:
+        return
+    eta = progress.eta()
+    frame.SetStatusText('%d of %d top level items, %d entries listed, %s compared%s' %
+            (progress.done, progress.total, progress.entries, formatBytes(progress.bytes),
+             ', about %s left' % formatSeconds(eta) if eta is not None else ''))
+    if progress.total:
+        frame.gauge.SetValue(100 * progress.done / progress.total)
+    else:
+        frame.gauge.Pulse()
 
 def onFocus(event):
     event.Skip()
@@ -126,13 +227,14 @@ def onFocus(event):
         info('Please select a valid folder item to focus.',
                 caption='Operation not supported')
     window, selections = getSelections(promptError)
-    if not window.GetPyData(selections[0]).data.isDir():
+    if not selections or not selections[0].isDir():
         promptError()
         return
-    for each in selections:
-        dataItem = window.GetPyData(each).data
+    for dataItem in selections:
         global cmpSession
-        cmpSession = model.CompareSession(dataItem.leftFullName, dataItem.rightFullName, cmpSession.ignore)
+        cmpSession = model.CompareSession(dataItem.leftFullName, dataItem.rightFullName,
+                                          cmpSession.ignore, cmpSession.filters,
+                                          dataItem.baseFullName if cmpSession.basePath else None)
         startCmp(cmpSession)
 
 def onBrowse(event):
@@ -149,19 +251,18 @@ def onBrowse(event):
         side = 'right'
     else:
         raise InvalidValueError()
-    for each in window.GetSelections():
-        dataItem = window.GetPyData(each).data
-        dataItem.browse(side)
+    for row in window.getSelectedRows():
+        rows[row].browse(side)
 
 def onNew(event):
     event.Skip()
     dlg = view.SessionDialog('New')
     if dlg.ShowModal() == wx.ID_OK:
-        leftPath, rightPath, ignore = \
-                dlg.leftText.GetValue(), dlg.rightText.GetValue(), \
+        leftPath, rightPath, basePath, ignore = \
+                dlg.leftText.GetValue(), dlg.rightText.GetValue(), dlg.baseText.GetValue(), \
                 tuple(ign.strip() for ign in dlg.ignoreText.GetValue().split(','))
         global cmpSession
-        cmpSession = model.CompareSession(leftPath, rightPath, ignore)
+        cmpSession = model.CompareSession(leftPath, rightPath, ignore, basePath=basePath or None)
         startCmp(cmpSession)
     dlg.Destroy()
 
@@ -174,10 +275,21 @@ def onSave(event):
         return
     cfmdlg = view.SessionDialog('Save', cmpSession)
     if cfmdlg.ShowModal() == wx.ID_OK:
-        wildcard = 'DirCompare Session (*.dcs)|*.dcs'
+        wildcard = 'DirCompare Session (*.dcs)|*.dcs|' \
+                   'DirCompare Snapshot, with the result (*.dcsnap)|*.dcsnap'
         savefile = wx.FileSelector('Save a session file as', default_path=os.getcwd(),
                 wildcard=wildcard, flags=wx.SAVE | wx.OVERWRITE_PROMPT)
-        if savefile:
+        if savefile and savefile.endswith('.dcsnap'):
+            try:
+                rootDataItem
+            except NameError:
+                alert('No comparison result to save.')
+            else:
+                try:
+                    snapshot.save(rootDataItem, savefile, cmpSession)
+                except (IOError, OSError), e:
+                    alert('Saving the snapshot failed: %s' % e)
+        elif savefile:
             fp = open(savefile, 'wb')
             # TODO exception handling
             cPickle.dump(cmpSession, fp, 2)
@@ -187,6 +299,7 @@ def onSave(event):
 def onLoad(event):
     event.Skip()
     wildcard = 'DirCompare Session (*.dcs)|*.dcs|' \
+               'DirCompare Snapshot (*.dcsnap)|*.dcsnap|' \
                'All files (*.*)|*.*'
     loadfile = wx.FileSelector('Open a session file', default_path=os.getcwd(),
             wildcard=wildcard, flags=wx.OPEN)
@@ -194,6 +307,9 @@ def onLoad(event):
         loadSessionFromFile(loadfile)
 
 def loadSessionFromFile(loadfile):
+    if snapshot.isSnapshot(loadfile):
+        loadSnapshot(loadfile)
+        return
     try:
         fp = open(loadfile, 'rb')
         session = cPickle.load(fp)
@@ -208,6 +324,23 @@ def loadSessionFromFile(loadfile):
     except (IOError, cPickle.UnpicklingError):
         alert('Invalid session file.')
 
+def loadSnapshot(loadfile):
+    """Shows a saved comparison result as it was; refreshing it compares
+    again only what has changed since."""
+    try:
+        root, session = snapshot.load(loadfile)
+    except (IOError, OSError, ValueError, model.InvalidValueError), e:
+        alert('Invalid snapshot file: %s' % e)
+        return
+    cfmdlg = view.SessionDialog('Load', session)
+    if cfmdlg.ShowModal() == wx.ID_OK:
+        global cmpSession
+        cmpSession = session
+        showRoot(root)
+        frame.SetStatusText('Snapshot loaded: %s.' %
+                (report.formatStats(root.subtreeStats()) or 'empty'))
+    cfmdlg.Destroy()
+
 def onAbout(event):
     event.Skip()
     aboutinfo = wx.AboutDialogInfo()
@@ -228,97 +361,300 @@ def onHelp(event):
 def genOnScroll(srcTree, otherTree, ins):
     def onScroll(event):
         event.Skip()
-        def syncScroll(srcTree, otherTree):
-            srcTreeItem = srcTree.GetFirstVisibleItem()
-            otherTreeItem = srcTree.GetPyData(srcTreeItem).getOtherTreeItem(srcTreeItem)
-            otherTree.ScrollTo(otherTreeItem)
         wx.CallAfter(syncScroll, srcTree, otherTree)
     return onScroll
 
+def syncScroll(srcTree, otherTree):
+    # both sides show the same rows
+    otherTree.scrollTo(srcTree.GetTopItem())
+
 ##############################
-# PyData                     #
+# rows                       #
 ##############################
-
-class PyData(object):
-
-    """PyData objects are used to connect left/right wx tree items
-    with each other and with the data item (the DataItem object).
-    Instances of this class are *attached* to wx tree items.
-
-                tree_items
-                    |^
-                    ||
-                    ||
-                    V|     ------> data_item
-                 py_data  <------
-    """
-
-    def __init__(self, data, lTreeItem, rTreeItem):
-        self.data = data
-        self.lTreeItem = lTreeItem
-        self.rTreeItem = rTreeItem
-
-    def getOtherTreeItem(self, srcTreeItem):
-        try:
-            self.lTreeItem
-            self.rTreeItem
-        except AttributeError, e:
-            raise AttributeError('lTreeItem or rTreeItem not set!')
-
-        # this '==' cannot be replaced by 'is' since the TreeItemId object
-        # returned by event.GetItem() is almost always different from the saved one
-        if srcTreeItem == self.lTreeItem:
-            otherTreeItem = self.rTreeItem
-        elif srcTreeItem == self.rTreeItem:
-            otherTreeItem = self.lTreeItem
-        else:
-            raise ValueError('srcTreeItem is neither lTreeItem nor rTreeItem')
-        return otherTreeItem
-
-    def __repr__(self):
-        return self.__str__()
-
-    def __str__(self):
-        #return ' '.join(('id:', `self.id`, ',', 'data:', `self.data`))
-        return ' '.join(('data:', `self.data`))
+# The data items shown in both trees, in display order. Only items with a
+# status are shown. A folder is expanded when its pyData is True; children
+# of expanded folders follow it in the rows.
+# It's rebuilt from topItems, the items shown at the top level, when the
+# shape of the trees changes.
+rows = []
+topItems = []
+
+def isExpanded(dataItem):
+    return getattr(dataItem, 'pyData', False) is True
+
+def depthOf(dataItem):
+    # top level items are children of the root
+    depth = -1
+    while dataItem.parent:
+        dataItem = dataItem.parent
+        depth += 1
+    return depth
+
+def buildRows(dataItems, out):
+    """Appends the shown data items among <dataItems> and below to <out>."""
+    for dataItem in dataItems:
+        if not dataItem.status:
+            continue
+        out.append(dataItem)
+        if isExpanded(dataItem):
+            buildRows(dataItem.children, out)
+    return out
+
+def expand(row):
+    dataItem = rows[row]
+    dataItem.pyData = True
+    rows[row + 1:row + 1] = buildRows(dataItem.children, [])
+    updateRowCount()
+
+def collapse(row):
+    dataItem = rows[row]
+    dataItem.pyData = False
+    depth, end = depthOf(dataItem), row + 1
+    while end < len(rows) and depthOf(rows[end]) > depth:
+        end += 1
+    del rows[row + 1:end]
+    updateRowCount()
+
+def updateRowCount():
+    for tree in (lTree, rTree):
+        tree.SetItemCount(len(rows))
+        tree.Refresh()
+
+def genDescribe(side):
+    """Generates closures describing the rows on one side."""
+    def describe(dataItem):
+        lText, lTreeItemStyle, rText, rTreeItemStyle = computeTreeItemStyle(dataItem)
+        text, style = (lText, lTreeItemStyle) if side == 'left' else (rText, rTreeItemStyle)
+        icons = style.icons
+        return ('    ' * depthOf(dataItem) + text,
+                icons[isExpanded(dataItem)] if icons else -1,
+                style.attr)
+    return describe
+
+# changes to the model are shown once per event loop iteration
+syncPending = False
+rebuildPending = False
+
+def scheduleSync(rebuild=False):
+    """Shows the changes of the model soon. When <rebuild> is true, the
+    rows themselves are built again."""
+    global syncPending, rebuildPending
+    rebuildPending = rebuildPending or rebuild
+    if not syncPending:
+        syncPending = True
+        wx.CallAfter(syncTrees)
+
+def syncTrees():
+    global syncPending, rebuildPending
+    if rebuildPending:
+        # keep the same data items selected
+        selected = {}
+        for tree in (lTree, rTree):
+            selected[tree] = set(id(rows[row]) for row in tree.getSelectedRows())
+        rows[:] = buildRows(topItems, [])
+        updateRowCount()
+        for tree in (lTree, rTree):
+            if selected[tree]:
+                tree.selectRows([row for row, dataItem in enumerate(rows)
+                                 if id(dataItem) in selected[tree]])
+    else:
+        lTree.refreshVisible()
+        rTree.refreshVisible()
+    syncPending = rebuildPending = False
 
 ##############################
 # Utilities                  #
 ##############################
 def getSelections(promptError):
+    """Returns the focused tree and the data items selected in it."""
     window = wx.Window.FindFocus()
     if window not in (lTree, rTree):
         promptError()
         return window, ()
-    selections = window.GetSelections()
+    selections = window.getSelectedRows()
     if len(selections) != 1:
         promptError()
         return window, ()
     else:
-        return window, selections
+        return window, [rows[row] for row in selections]
 
 def startCmp(session):
-    leftPath, rightPath, ignore = \
-            session.leftPath, session.rightPath, session.ignore
+    """Starts comparing in the background. Top level items are drawn as
+    soon as their subtrees are known; the root is hooked up when the whole
+    comparison is done."""
+    leftPath, rightPath, basePath, ignore = \
+            session.leftPath, session.rightPath, session.basePath, session.ignore
+    # a three-way comparison needs the whole trees
+    lazy = bool(int(conf.lazy)) and not basePath
+    stopWatching()
+    stopPrefetching()
 
     # start comparison
-    global rootDataItem
+    global rootDataItem, cmpProgress, topItems
     msg = 'Invalid given path(s).'
-    if not path.isdir(leftPath) or not path.isdir(rightPath):
+    if not model.isComparable(leftPath) or not model.isComparable(rightPath) \
+       or (basePath and not model.isComparable(basePath)):
         alert(msg)
         return
-    rootDataItem = DirectoryDataItem('', leftPath, rightPath)
-    rootDataItem.compare(ignore)
-
-    drawNodes(rootDataItem.children, lRoot, rRoot)
-    pyData = PyData(rootDataItem, lRoot, rRoot)
-    lTree.SetPyData(lRoot, pyData)
-    rTree.SetPyData(rRoot, pyData)
-    rootDataItem.pyData = pyData
-
+    root = rootDataItem = DirectoryDataItem('', leftPath, rightPath, baseLocation=basePath)
+    # top level items already drawn, sorted like root.children will be
+    drawnItems = topItems = []
+    del rows[:]
+    updateRowCount()
     lTextCtrl.SetValue(path.normpath(leftPath))
     rTextCtrl.SetValue(path.normpath(rightPath))
 
+    # top level items done on the comparing thread, waiting to be drawn;
+    # they are handed over in batches, one wx.CallAfter per batch
+    doneItems, doneLock = [], threading.Lock()
+    def onItemDone(itm):
+        with doneLock:
+            doneItems.append(itm)
+            if len(doneItems) == 1:
+                wx.CallAfter(drawDoneItems)
+    def drawDoneItems():
+        with doneLock:
+            items = doneItems[:]
+            del doneItems[:]
+        for itm in items:
+            bisect.insort(drawnItems, itm)
+        scheduleSync(rebuild=True)
+    def onDone(error):
+        global cmpProgress, rootDataItem, topItems
+        if progress is not cmpProgress:
+            return
+        drawDoneItems()
+        cmpTimer.Stop()
+        frame.gauge.SetValue(0)
+        enableTools(True)
+        cmpProgress = None
+        if error:
+            # what's drawn stays, but the tree can't be refreshed or watched
+            del rootDataItem
+            if isinstance(error, model.CompareCancelledError):
+                frame.SetStatusText('Comparison cancelled.')
+            else:
+                frame.SetStatusText('')
+                alert('Comparison failed: %s' % error)
+            return
+        # from now on, the top level follows the model
+        topItems = root.children
+        if lazy:
+            startPrefetching(root)
+        frame.SetStatusText('Comparison done in %s: %s.' %
+                (formatSeconds(time.time() - progress.started),
+                 report.formatStats(root.subtreeStats()) or 'empty'))
+    def run():
+        try:
+            root.compare(ignore, progress=progress, filters=session.filters, lazy=lazy,
+                         callAfter=wx.CallAfter)
+        except Exception, e:
+            if not isinstance(e, model.CompareCancelledError):
+                logging.exception('comparison failed')
+            wx.CallAfter(onDone, e)
+        else:
+            wx.CallAfter(onDone, None)
+
+    progress = cmpProgress = model.CompareProgress()
+    progress.onItemDone = onItemDone
+    enableTools(False)
+    cmpTimer.Start(250)
+    thread = threading.Thread(target=run, name='compare')
+    # don't keep the application alive after the window is closed
+    thread.setDaemon(True)
+    thread.start()
+
+def showRoot(root):
+    """Shows an already compared tree."""
+    global rootDataItem, topItems
+    stopWatching()
+    stopPrefetching()
+    rootDataItem = root
+    topItems = root.children
+    lTextCtrl.SetValue(path.normpath(root.leftLocation))
+    rTextCtrl.SetValue(path.normpath(root.rightLocation))
+    scheduleSync(rebuild=True)
+
+def startSync(plan):
+    """Runs a sync in the background; the trees are updated when it's done."""
+    global syncProgress
+    def onDone(done, error):
+        global syncProgress
+        cmpTimer.Stop()
+        frame.gauge.SetValue(0)
+        enableTools(True)
+        syncProgress = None
+        # the model is only changed on this thread
+        sync.apply(plan, done)
+        if error:
+            alert('Copying failed: %s' % error)
+        frame.SetStatusText('%d operations done, %d failed, %s copied in %s (%s/s).' %
+                (len(done), progress.errors, formatBytes(progress.bytes),
+                 formatSeconds(time.time() - progress.started), formatBytes(progress.rate())))
+    def run():
+        done, error = [], None
+        try:
+            done = sync.execute(plan, progress=progress)
+        except Exception, e:
+            logging.exception('sync failed')
+            error = e
+        wx.CallAfter(onDone, done, error)
+
+    stopWatching()
+    progress = syncProgress = sync.SyncProgress(plan)
+    enableTools(False)
+    cmpTimer.Start(250)
+    thread = threading.Thread(target=run, name='sync')
+    thread.setDaemon(True)
+    thread.start()
+
+def showStats(dataItem):
+    """Shows what is found under a folder."""
+    frame.SetStatusText('%s: %s' % (dataItem.name or 'Top level',
+                                     report.formatStats(dataItem.subtreeStats()) or 'empty'))
+
+def enableTools(enable):
+    """Disables the tools that change the trees while comparing, and
+    enables the cancel button; or the other way round."""
+    toolBar = frame.GetToolBar()
+    for tool in (frame.btn_new, frame.btn_save, frame.btn_load,
+                 frame.btn_cplr, frame.btn_cprl, frame.btn_sync_lr, frame.btn_sync_rl,
+                 frame.btn_del, frame.btn_cmp,
+                 frame.btn_rfsh_all, frame.btn_watch, frame.btn_fcs):
+        toolBar.EnableTool(tool.GetId(), enable)
+    toolBar.EnableTool(frame.btn_cancel.GetId(), not enable)
+
+def formatBytes(n):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if n < 1024:
+            return '%d %s' % (n, unit)
+        n /= 1024.0
+    return '%.1f TB' % n
+
+def formatSeconds(seconds):
+    seconds = int(seconds)
+    return '%d:%02d:%02d' % (seconds / 3600, seconds / 60 % 60, seconds % 60)
+
+def stopWatching():
+    global fsWatcher
+    if fsWatcher:
+        fsWatcher.stop()
+        fsWatcher = None
+        frame.SetStatusText('')
+
+def startPrefetching(root):
+    """Compares the next levels of a lazily compared tree in the background."""
+    global prefetcher
+    if int(conf.prefetchLevels) > 0:
+        prefetcher = prefetch.Prefetcher(root, callAfter=wx.CallAfter)
+        prefetcher.start()
+
+def stopPrefetching():
+    global prefetcher
+    if prefetcher:
+        prefetcher.stop()
+        prefetcher = None
+
 def computeTreeItemStyle(dataItem):
     # TODO more styles for "unknown"s
     dirFlag = dataItem.isDir()
@@ -342,59 +678,40 @@ def computeTreeItemStyle(dataItem):
         rText = dataItem.name
         lTreeItemStyle = TreeItemStyle.DIR_DIFF if dirFlag else TreeItemStyle.FILE_DIFF
         rTreeItemStyle = TreeItemStyle.DIR_DIFF if dirFlag else TreeItemStyle.FILE_DIFF
+    elif dataItem.status is model.STATUS_LEFT_MOVED:
+        lText = dataItem.name
+        rText = ''
+        lTreeItemStyle = TreeItemStyle.FILE_MOVED
+        rTreeItemStyle = TreeItemStyle.FILE_ABSENT
+    elif dataItem.status is model.STATUS_RIGHT_MOVED:
+        lText = ''
+        rText = dataItem.name
+        lTreeItemStyle = TreeItemStyle.FILE_ABSENT
+        rTreeItemStyle = TreeItemStyle.FILE_MOVED
+    elif dataItem.status is model.STATUS_COMMON_PENDING:
+        # only folders are ever pending
+        lText = dataItem.name
+        rText = dataItem.name
+        lTreeItemStyle = rTreeItemStyle = TreeItemStyle.DIR_PENDING
     else:
-        raise InvalidValueError()
+        # called while painting, so never raises: drawn plain instead
+        logging.debug('no style for status %s of %s' % (dataItem.status, dataItem))
+        lText = rText = dataItem.name
+        lTreeItemStyle = rTreeItemStyle = TreeItemStyle.DIR_SAME if dirFlag else TreeItemStyle.FILE_SAME
     return lText, lTreeItemStyle, rText, rTreeItemStyle
 
-def drawNodes(dataItems, lParent, rParent):
-    """Populates the trees using given dataItems."""
-    lTree.DeleteChildren(lParent)
-    rTree.DeleteChildren(rParent)
-
-    for dataItem in dataItems:
-        lTreeItem = lTree.AppendItem(lParent, '')
-        rTreeItem = rTree.AppendItem(rParent, '')
-
-        pyData = PyData(dataItem, lTreeItem, rTreeItem)
-        dataItem.pyData = pyData
-        lTree.SetPyData(lTreeItem, pyData)
-        rTree.SetPyData(rTreeItem, pyData)
-
-        updateTreeItemPairUI(dataItem, lTreeItem, rTreeItem)
-
-def updateTreeItemPairUI(dataItem, lTreeItem, rTreeItem):
-    if not dataItem.status:
-        lTree.Delete(lTreeItem)
-        rTree.Delete(rTreeItem)
-        return
-
-    lText, lTreeItemStyle, rText, rTreeItemStyle = computeTreeItemStyle(dataItem)
-
-    def updateTreeItemUI(tree, treeItem, text, treeItemStyle):
-        tree.SetItemText(treeItem, text)
-        tree.SetItemTextColour(treeItem, treeItemStyle.color)
-        tree.SetItemBackgroundColour(treeItem, treeItemStyle.bgColor)
-        if treeItemStyle.icons:
-            for icon in treeItemStyle.icons:
-                tree.SetItemImage(treeItem, *icon)
-        else:
-            # remove the item images
-            tree.SetItemImage(treeItem, -1, wx.TreeItemIcon_Normal)
-            tree.SetItemImage(treeItem, -1, wx.TreeItemIcon_Selected)
-            tree.SetItemImage(treeItem, -1, wx.TreeItemIcon_Expanded)
-#            map(tree.SetItemImage((treeItem, ) * 3, (-1, ) * 3,
-#                (wx.TreeItemIcon_Normal, wx.TreeItemIcon_Selected, wx.TreeItemIcon_Expanded)))
-
-    updateTreeItemUI(lTree, lTreeItem, lText, lTreeItemStyle)
-    updateTreeItemUI(rTree, rTreeItem, rText, rTreeItemStyle)
-
 def updateUI(self):
     """Listener on the model."""
-    try:
-        updateTreeItemPairUI(self, self.pyData.lTreeItem, self.pyData.rTreeItem)
-    except AttributeError:
-        # some data items don't have pyDatas yet
-        pass
+    # data items are also changed by comparisons running in the background;
+    # they aren't shown until they are done
+    if wx.Thread_IsMain():
+        # items without status are removed from the rows
+        scheduleSync(rebuild=not self.status)
+
+def updateChildrenUI(self):
+    """Listener on the model, called when children are added to a folder."""
+    if wx.Thread_IsMain() and (not self.parent or isExpanded(self)):
+        scheduleSync(rebuild=True)
 
 def alert(msg, caption='Error'):
     wx.MessageBox(msg, caption, style=wx.OK | wx.ICON_EXCLAMATION, parent=frame)
@@ -413,7 +730,7 @@ logging.basicConfig(level=eval(conf.loggingLevel),
                 filename=conf.logFile,
                 filemode='a')
 
-import model, view
+import model, view, watcher, report, sync, snapshot, prefetch
 # install shortcuts for performance
 DataItem = model.DataItem
 DirectoryDataItem = model.DirectoryDataItem
@@ -423,19 +740,32 @@ lTree = view.lTree
 rTree = view.rTree
 lTextCtrl = view.lTextCtrl
 rTextCtrl = view.rTextCtrl
-lRoot = view.lRoot
-rRoot = view.rRoot
 TreeItemStyle = view.TreeItemStyle
 frame = view.frame
 
-# install listener
+# the watcher.Watcher in watch mode
+fsWatcher = None
+# the prefetch.Prefetcher of a lazily compared tree
+prefetcher = None
+# the model.CompareProgress of the comparison running in the background
+cmpProgress = None
+# the sync.SyncProgress of the sync running in the background
+syncProgress = None
+# shows the progress of either
+cmpTimer = wx.Timer(frame)
+frame.Bind(wx.EVT_TIMER, onProgressTimer, cmpTimer)
+
+# install listeners
 DataItem.updateUI = updateUI
+DataItem.updateChildrenUI = updateChildrenUI
+lTree.rows = rTree.rows = rows
+lTree.describe, rTree.describe = genDescribe('left'), genDescribe('right')
 
 # bind handlers
-lTree.Bind(wx.EVT_TREE_ITEM_ACTIVATED, genOnItemActivated(lTree, rTree))
-rTree.Bind(wx.EVT_TREE_ITEM_ACTIVATED, genOnItemActivated(rTree, lTree))
-lTree.Bind(wx.EVT_TREE_SEL_CHANGED, genOnSelChanged(lTree, rTree))
-rTree.Bind(wx.EVT_TREE_SEL_CHANGED, genOnSelChanged(rTree, lTree))
+lTree.Bind(wx.EVT_LIST_ITEM_ACTIVATED, genOnItemActivated(lTree, rTree))
+rTree.Bind(wx.EVT_LIST_ITEM_ACTIVATED, genOnItemActivated(rTree, lTree))
+lTree.Bind(wx.EVT_LIST_ITEM_SELECTED, genOnSelChanged(lTree, rTree))
+rTree.Bind(wx.EVT_LIST_ITEM_SELECTED, genOnSelChanged(rTree, lTree))
 
 # sync scrolling
 def bindScrollingHandlers(targetTree, otherTree):
@@ -454,17 +784,19 @@ bindScrollingHandlers(lTree, rTree)
 bindScrollingHandlers(rTree, lTree)
 
 # toolbar button handlers
-map(frame.Bind, (wx.EVT_MENU, ) * 12,
+map(frame.Bind, (wx.EVT_MENU, ) * 16,
         # handlers
-        (genOnCopy('left', 'right'), genOnCopy('right', 'left'), onDel,
-         onCmp, onRefreshAll, onFocus, onBrowse,
+        (genOnCopy('left', 'right'), genOnCopy('right', 'left'),
+         genOnSyncAll('left', 'right'), genOnSyncAll('right', 'left'), onDel,
+         onCmp, onRefreshAll, onWatch, onCancel, onFocus, onBrowse,
          onNew, onSave, onLoad,
          onAbout, onHelp),
         # toolbar buttons
-        (frame.btn_cplr, frame.btn_cprl, frame.btn_del,
-         frame.btn_cmp, frame.btn_rfsh_all, frame.btn_fcs, frame.btn_brws,
+        (frame.btn_cplr, frame.btn_cprl, frame.btn_sync_lr, frame.btn_sync_rl, frame.btn_del,
+         frame.btn_cmp, frame.btn_rfsh_all, frame.btn_watch, frame.btn_cancel, frame.btn_fcs, frame.btn_brws,
          frame.btn_new, frame.btn_save, frame.btn_load,
          frame.btn_abt, frame.btn_hlp))
+frame.GetToolBar().EnableTool(frame.btn_cancel.GetId(), False)
 
 if __name__ == '__main__' and len(sys.argv) == 2:
     loadSessionFromFile(sys.argv[1])
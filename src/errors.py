@@ -24,3 +24,6 @@ class InvalidMethodInvocationError(Exception):
 class InvalidValueError(Exception):
     """"""
 
+
+class CompareCancelledError(Exception):
+    """Raised by a comparison when its CompareProgress is cancelled."""
@@ -0,0 +1,219 @@
+#    -*- coding: utf-8 -*-
+#    Advanced directory compare tool in Python.
+#
+#    Copyright (C) 2008, 2009  Pan Xingzhi
+#    http://code.google.com/p/dircompare/
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Persistent cache of file content digests.
+
+A digest is reused as long as the stat signature (size, modified time and
+inode) of the file it was computed for doesn't change.
+
+Command line usage:
+    python hashcache.py prune [maxEntries]"""
+
+from __future__ import print_function
+import os
+import sys
+import hashlib
+import sqlite3
+import threading
+import logging
+
+import configuration as conf
+
+class HashCache(object):
+    """A SQLite backed cache mapping a file's path and stat signature to
+    the digest of its content. Safe to be used from multiple threads;
+    worker processes open their own HashCache on the same file."""
+
+    # number of changes kept in memory before they're written
+    batchSize = 1000
+
+    def __init__(self, fileName, maxEntries):
+        self.maxEntries = maxEntries
+        self.__lock = threading.Lock()
+        self.__pending = {}
+        self.__used = {}
+        self.__clock = 0
+        self.__conn = sqlite3.connect(fileName, timeout=60, check_same_thread=False)
+        # paths are file system encoded bytes, which needn't be UTF-8
+        self.__conn.text_factory = str
+        self.__conn.execute('create table if not exists hashes ('
+                'path text primary key, size integer, mtime real, inode integer, '
+                'digest text, used integer)')
+        self.__conn.execute('create index if not exists hashes_used on hashes (used)')
+        self.__conn.commit()
+        row = self.__conn.execute('select max(used) from hashes').fetchone()
+        self.__clock = row[0] or 0
+
+    def digest(self, fileName, st):
+        """Returns the digest of a file given its os.stat result.
+        The file is only read when there's no digest for its current signature."""
+        digest = self.lookup(fileName, st)
+        if digest is None:
+            digest = _hashFile(fileName)
+            self.store(fileName, st, digest)
+        return digest
+
+    def lookup(self, fileName, st):
+        """Returns the cached digest of a file given its os.stat result,
+        or None if there's no digest for its current signature."""
+        fileName = os.path.abspath(fileName)
+        signature = (st.st_size, st.st_mtime, st.st_ino)
+        self.__lock.acquire()
+        try:
+            self.__clock += 1
+            cached = self.__pending.get(fileName)
+            if not cached:
+                row = self.__conn.execute('select size, mtime, inode, digest from hashes where path = ?',
+                        (fileName, )).fetchone()
+                cached = row and (tuple(row[:3]), row[3])
+            if cached and cached[0] == signature:
+                self.__used[fileName] = self.__clock
+                return cached[1]
+            return None
+        finally:
+            self.__lock.release()
+
+    def store(self, fileName, st, digest):
+        """Caches the digest of a file computed elsewhere."""
+        fileName = os.path.abspath(fileName)
+        self.__lock.acquire()
+        try:
+            self.__pending[fileName] = ((st.st_size, st.st_mtime, st.st_ino), digest)
+            self.__used[fileName] = self.__clock
+            if len(self.__pending) + len(self.__used) >= self.batchSize:
+                self.__flush()
+        finally:
+            self.__lock.release()
+
+    def flush(self):
+        """Writes all changes to the disk and evicts the least recently
+        used digests beyond maxEntries."""
+        self.__lock.acquire()
+        try:
+            self.__flush()
+            self.__evict()
+        finally:
+            self.__lock.release()
+
+    def prune(self):
+        """Drops digests of files that are gone or changed, then evicts."""
+        self.flush()
+        stale = []
+        for fileName, size, mtime, inode in \
+                self.__conn.execute('select path, size, mtime, inode from hashes'):
+            try:
+                st = os.stat(fileName)
+            except OSError:
+                stale.append((fileName, ))
+                continue
+            if (st.st_size, st.st_mtime, st.st_ino) != (size, mtime, inode):
+                stale.append((fileName, ))
+        self.__conn.executemany('delete from hashes where path = ?', stale)
+        self.__conn.commit()
+        return len(stale)
+
+    def close(self):
+        self.flush()
+        self.__conn.close()
+
+    def __flush(self):
+        self.__conn.executemany('insert or replace into hashes values (?, ?, ?, ?, ?, ?)',
+                [(fileName, size, mtime, inode, digest, self.__used.get(fileName, self.__clock))
+                 for fileName, ((size, mtime, inode), digest) in self.__pending.iteritems()])
+        self.__conn.executemany('update hashes set used = ? where path = ?',
+                [(used, fileName) for fileName, used in self.__used.iteritems()
+                 if fileName not in self.__pending])
+        self.__conn.commit()
+        self.__pending.clear()
+        self.__used.clear()
+
+    def __evict(self):
+        count = self.__conn.execute('select count(*) from hashes').fetchone()[0]
+        if count > self.maxEntries:
+            self.__conn.execute('delete from hashes where path in '
+                    '(select path from hashes order by used limit ?)',
+                    (count - self.maxEntries, ))
+            self.__conn.commit()
+            logging.debug('%d digests evicted from the hash cache' % (count - self.maxEntries))
+
+def digestOf(fileName, st):
+    """Returns the digest of a file given its os.stat result, through the
+    configured HashCache if any."""
+    cache = getCache()
+    return cache.digest(fileName, st) if cache else _hashFile(fileName)
+
+def newHash():
+    return hashlib.sha256()
+
+def _hashFile(fileName, bufsize=1024*1024):
+    h = newHash()
+    fp = open(fileName, 'rb')
+    try:
+        while True:
+            buf = fp.read(bufsize)
+            if not buf:
+                return h.hexdigest()
+            h.update(buf)
+    finally:
+        fp.close()
+
+_cache = None
+_cachePid = None
+_cacheLock = threading.Lock()
+def getCache():
+    """Returns the HashCache configured in the config file, opened once
+    per process, or None if HASH_CACHE is empty. Compares open it before
+    they start walking, see DirectoryDataItem.compare."""
+    global _cache, _cachePid
+    if not conf.hashCache:
+        return None
+    if _cache is not None and _cachePid == os.getpid():
+        return _cache
+    with _cacheLock:
+        if _cache is not None and _cachePid == os.getpid():
+            return _cache
+        fileName = os.path.expanduser(conf.hashCache)
+        folder = os.path.dirname(fileName)
+        if folder and not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                # made by another process meanwhile
+                if not os.path.isdir(folder):
+                    raise
+        _cache = HashCache(fileName, int(conf.hashCacheSize))
+        _cachePid = os.getpid()
+        return _cache
+
+def flush():
+    """Flushes the HashCache of this process, if it's ever been used."""
+    if _cache is not None and _cachePid == os.getpid():
+        _cache.flush()
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3) or sys.argv[1] != 'prune' or not conf.hashCache:
+        print('Usage: python hashcache.py prune [maxEntries]\n'
+              'HASH_CACHE must be set in DirCompare.rc.')
+        sys.exit(1)
+    cache = getCache()
+    if len(sys.argv) == 3:
+        cache.maxEntries = int(sys.argv[2])
+    print('%d stale digests removed.' % cache.prune())
+    cache.close()
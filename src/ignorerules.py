@@ -0,0 +1,243 @@
+#    -*- coding: utf-8 -*-
+#    Advanced directory compare tool in Python.
+#
+#    Copyright (C) 2008, 2009  Pan Xingzhi
+#    http://code.google.com/p/dircompare/
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Ignore rules, written like the lines of a .gitignore file:
+    .svn            a name, ignored at any level
+    *.pyc           wildcards: * and ? don't match '/', [...] is a class
+    build/          a trailing '/' only matches folders
+    doc/*.html      a pattern with a '/' is relative to the compared folders
+    /TODO           so is one starting with '/'
+    **/node_modules '**' matches any number of folders
+    !keep.pyc       '!' takes back what the patterns before ignored
+Blank patterns and patterns starting with '#' mean nothing; '\\' takes the
+special meaning off '!', '#' and wildcards.
+
+The last pattern matching an item decides. Folders are checked when they
+are listed, and an ignored folder is never looked into, so nothing under
+it can be taken back by '!'; this is what git does as well.
+
+All patterns are compiled once, into lookups that each tell the last
+pattern matching: plain names and '*.ext' like patterns go to dicts, other
+suffixes to a tuple, and the rest are joined into one regular expression,
+or one per first folder when that is a plain name. Only when that one
+matches are its patterns tried one by one, latest first; most items match
+none, and are told at once."""
+
+import os
+import re
+
+class IgnoreRules(object):
+    """Compiled ignore patterns, see above. False when there's none, so
+    that callers can skip matching altogether."""
+
+    def __init__(self, patterns=()):
+        self.patterns = tuple(patterns)
+        # patterns for any item, and the ones only for folders
+        self.rules = (_Rules(), _Rules())
+        self.count = 0
+        for index, pattern in enumerate(self.patterns):
+            rule = _parse(pattern)
+            if rule is None:
+                continue
+            negate, dirOnly, anchored, pattern = rule
+            self.rules[dirOnly].add(index, negate, anchored, pattern)
+            self.count += 1
+        for rules in self.rules:
+            rules.compile()
+        # whether any pattern looks at more than the name
+        self.needsPath = any(rules.pathRes for rules in self.rules)
+
+    def __nonzero__(self):
+        return bool(self.count)
+
+    def __reduce__(self):
+        # compiled patterns don't pickle well, so they're compiled again
+        return (IgnoreRules, (self.patterns, ))
+
+    def ignores(self, relDir, name, isDir):
+        """Tells if the item <name> in the folder <relDir> is ignored.
+        <relDir> is relative to the compared folders, '' for the top one,
+        and uses '/' or os.sep."""
+        relName = None
+        if self.needsPath:
+            if os.sep != '/':
+                relDir = relDir.replace(os.sep, '/')
+            relName = relDir + '/' + name if relDir else name
+        last = self.rules[0].last(name, relName)
+        if isDir:
+            last = max(last, self.rules[1].last(name, relName))
+        index, negate = last
+        return not negate
+
+def getRules(ignore):
+    """Returns <ignore> compiled to IgnoreRules; <ignore> may be a sequence
+    of patterns, or IgnoreRules already."""
+    if isinstance(ignore, IgnoreRules):
+        return ignore
+    return IgnoreRules(ignore)
+
+# (index, negate) of the last pattern matching, when none does
+_NONE = (-1, True)
+
+class _Rules(object):
+    """Patterns for the same kind of items, see IgnoreRules."""
+
+    def __init__(self):
+        # (index, negate) of the last pattern by name or extension
+        self.names = {}
+        self.extensions = {}
+        # [(suffix, index, negate)]
+        self.suffixes = []
+        # [(index, negate, expression)], for the whole name
+        self.nameRes = []
+        # the same for the relative path, by the first folder of the
+        # patterns, None when it's not a plain name
+        self.pathRes = {}
+
+    def add(self, index, negate, anchored, pattern):
+        if anchored and pattern.startswith('**/') and '/' not in pattern[3:]:
+            # the same as the name alone
+            anchored, pattern = False, pattern[3:]
+        if not anchored and not _WILDCARD.search(pattern):
+            self.names[_unescape(pattern)] = (index, negate)
+        elif not anchored and pattern.startswith('*') and not _WILDCARD.search(pattern[1:]):
+            suffix = _unescape(pattern[1:])
+            if suffix.rfind('.') == 0:
+                self.extensions[suffix] = (index, negate)
+            else:
+                self.suffixes.append((suffix, index, negate))
+        elif not anchored:
+            self.nameRes.append((index, negate, _translate(pattern)))
+        else:
+            first = pattern.split('/', 1)[0]
+            key = None if _WILDCARD.search(first) else _unescape(first)
+            self.pathRes.setdefault(key, []).append((index, negate, _translate(pattern)))
+
+    def compile(self):
+        self.anySuffix = tuple(suffix for suffix, index, negate in self.suffixes)
+        self.suffixes.reverse()
+        self.nameRes = _compile(self.nameRes)
+        self.pathRes = dict((key, _compile(each)) for key, each in self.pathRes.iteritems())
+
+    def last(self, name, relName):
+        """Returns (index, negate) of the last pattern matching, _NONE if
+        there's none."""
+        last = self.names.get(name, _NONE)
+        if self.extensions:
+            last = max(last, self.extensions.get(name[name.rfind('.'):], _NONE))
+        if self.anySuffix and name.endswith(self.anySuffix):
+            for suffix, index, negate in self.suffixes:
+                if name.endswith(suffix):
+                    last = max(last, (index, negate))
+                    break
+        if self.nameRes:
+            last = _lastMatch(self.nameRes, name, last)
+        if self.pathRes:
+            for key in (relName.partition('/')[0], None):
+                compiled = self.pathRes.get(key)
+                if compiled:
+                    last = _lastMatch(compiled, relName, last)
+        return last
+
+##############################
+# helpers                    #
+##############################
+_WILDCARD = re.compile(r'[*?\[\\]')
+
+def _parse(pattern):
+    """Returns (negate, dirOnly, anchored, pattern), or None if the
+    pattern means nothing."""
+    pattern = pattern.strip()
+    if not pattern or pattern.startswith('#'):
+        return None
+    negate = pattern.startswith('!')
+    if negate:
+        pattern = pattern[1:]
+    dirOnly = pattern.endswith('/')
+    pattern = pattern.rstrip('/')
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/')
+    if not pattern:
+        return None
+    return negate, dirOnly, anchored, pattern
+
+def _unescape(pattern):
+    return re.sub(r'\\(.)', r'\1', pattern)
+
+def _translate(pattern):
+    """Turns a glob pattern into a regular expression."""
+    out, i, n = [], 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith('**', i) and (i == 0 or pattern[i - 1] == '/'):
+            if pattern.startswith('**/', i):
+                # any number of folders, none included
+                out.append('(?:.*/)?')
+                i += 3
+                continue
+            if i + 2 == n:
+                # everything below
+                out.append('.*')
+                i += 2
+                continue
+        if c == '*':
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '\\' and i + 1 < n:
+            i += 1
+            out.append(re.escape(pattern[i]))
+        elif c == '[':
+            end = pattern.find(']', i + 2)
+            if end < 0:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:end].replace('\\', '\\\\')
+                if body[0] in '!^':
+                    body = '^' + body[1:]
+                out.append('[%s]' % body)
+                i = end
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return ''.join(out)
+
+def _compile(patterns):
+    """Compiles [(index, negate, expression)] into the match method of one
+    expression matching any of them, and [(index, negate, match method)],
+    latest first. Returns None if there's none."""
+    if not patterns:
+        return None
+    anyMatch = re.compile('(?:%s)\\Z' % '|'.join(expression for index, negate, expression in patterns),
+                          re.DOTALL).match
+    return anyMatch, [(index, negate, re.compile(expression + '\\Z', re.DOTALL).match)
+                      for index, negate, expression in reversed(patterns)]
+
+def _lastMatch(compiled, text, last):
+    """Returns (index, negate) of the last pattern in <compiled> matching
+    <text> if it comes after <last>, <last> otherwise."""
+    anyMatch, patterns = compiled
+    if not anyMatch(text):
+        return last
+    for index, negate, match in patterns:
+        if index <= last[0]:
+            break
+        if match(text):
+            return (index, negate)
+    return last
@@ -0,0 +1,278 @@
+#    -*- coding: utf-8 -*-
+#    Advanced directory compare tool in Python.
+#
+#    Copyright (C) 2008, 2009  Pan Xingzhi
+#    http://code.google.com/p/dircompare/
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Manifests: what a tree holds, written down where the tree is, so that
+it can be compared somewhere else.
+
+A manifest is written while the tree is walked, as JSON lines: a header,
+then one line per item, [relName, type, size, mtime, digest], then a
+trailer with the number of items. relName uses '/' whatever the system;
+type is 'd' for folders, 'f' for files, 'o' for anything else and '?' for
+what can't be read. Files carry the digest of their content. A relName
+that isn't valid UTF-8, which JSON can't hold, is written as if it were
+latin-1, and the line gets a sixth field, 'latin-1', to read it back as
+the same bytes.
+
+A manifest file can be given in place of a folder to compare; the files
+on the other side are then compared by digest, so nothing is read on the
+manifest side.
+
+Command line usage:
+    python manifest.py [options] rootPath"""
+
+from __future__ import print_function
+import os
+import os.path as path
+import sys
+import stat
+import errno
+import time
+import json
+import optparse
+from multiprocessing.pool import ThreadPool
+
+import configuration as conf
+import hashcache
+import ignorerules
+import model
+from errors import *
+
+# tells manifests from other JSON lines files
+FORMAT = 'DirCompare manifest'
+# the version of the manifest format
+VERSION = 1
+# how the digests are computed, see hashcache.newHash
+DIGEST = 'sha256'
+
+FOLDER, FILE, OTHER, UNKNOWN = 'd', 'f', 'o', '?'
+
+class Entry(object):
+    """What a manifest has for an item. Looks like an os.stat result."""
+    __slots__ = ('st_mode', 'st_size', 'st_mtime', 'st_ino', 'digest')
+
+    _MODES = {FOLDER: stat.S_IFDIR, FILE: stat.S_IFREG, OTHER: 0}
+
+    def __init__(self, kind, size, mtime, digest=None):
+        self.st_mode = self._MODES[kind]
+        self.st_size = size
+        self.st_mtime = mtime
+        # the inode means nothing on another machine
+        self.st_ino = 0
+        self.digest = digest
+
+class Manifest(object):
+    """A tree read from a manifest file, listed and stat'ed the way model
+    lists and stats folders; see model._scanDir."""
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.mtime = os.stat(fileName).st_mtime
+        # entries of each folder by name, folders by relName
+        self.folders = {'': {}}
+        count = 0
+        fp = open(fileName, 'rb')
+        try:
+            header = json.loads(fp.readline())
+            if header.get('format') != FORMAT or header.get('version') != VERSION \
+               or header.get('digest') != DIGEST:
+                raise InvalidValueError('%s is not a manifest this version can read.' % fileName)
+            self.root = Entry(FOLDER, 0, header['created'])
+            trailer = None
+            for line in fp:
+                record = json.loads(line)
+                if isinstance(record, dict):
+                    trailer = record
+                    break
+                relName, kind, size, mtime, digest = record[:5]
+                relName = _fsName(relName, record[5] if len(record) > 5 else 'utf-8')
+                parent, sep, name = relName.rpartition('/')
+                entry = Entry(str(kind), size, mtime, digest) if kind != UNKNOWN else None
+                self.folders.setdefault(parent, {})[model._intern(name)] = entry
+                if kind == FOLDER:
+                    self.folders.setdefault(relName, {})
+                count += 1
+        finally:
+            fp.close()
+        if trailer is None or trailer.get('entries') != count:
+            raise InvalidValueError('%s is incomplete.' % fileName)
+
+    def listDir(self, relName, ignore=(), ignoreDir=''):
+        """Returns what's in a folder like model._scanDir does.
+        <ignoreDir> is where the folder is in the compared tree."""
+        folder = self.folders.get(relName)
+        if folder is None:
+            return None
+        rules = ignorerules.getRules(ignore)
+        if not rules:
+            return dict(folder)
+        return dict((name, entry) for name, entry in folder.iteritems()
+                    if not rules.ignores(ignoreDir, name,
+                                         entry is not None and stat.S_ISDIR(entry.st_mode)))
+
+    def statEntries(self, relName, names):
+        folder = self.folders.get(relName, {})
+        return dict((name, folder.get(name)) for name in names)
+
+    def stat(self, relName):
+        """Returns the Entry of an item; raises OSError like os.stat if
+        there's none."""
+        if not relName:
+            return self.root
+        parent, sep, name = relName.rpartition('/')
+        entry = self.folders.get(parent, {}).get(name)
+        if entry is None:
+            raise OSError(errno.ENOENT, 'not in manifest %s' % self.fileName, relName)
+        return entry
+
+def isManifest(fileName):
+    """Tells if <fileName> starts like a manifest, of any version."""
+    try:
+        fp = open(fileName, 'rb')
+    except IOError:
+        return False
+    try:
+        line = fp.readline(64 * 1024)
+    finally:
+        fp.close()
+    try:
+        header = json.loads(line)
+    except ValueError:
+        return False
+    return isinstance(header, dict) and header.get('format') == FORMAT
+
+def write(rootPath, fp, ignore=(), map=map):
+    """Walks the folder <rootPath> and writes its manifest to <fp> as it
+    goes. The digests of the files in a folder are computed through <map>,
+    which may run the jobs concurrently. Returns the number of items."""
+    ignore = ignorerules.getRules(ignore)
+    # only shown; a name that isn't UTF-8 is shown as best it can
+    root = rootPath.decode('utf-8', 'replace') if isinstance(rootPath, str) else rootPath
+    fp.write(json.dumps({'format': FORMAT, 'version': VERSION, 'digest': DIGEST,
+                         'root': root, 'created': time.time()}, sort_keys=True) + '\n')
+    count = 0
+    # folders to list: (fullName, relName); a folder's own line is
+    # written when it's listed, so that a folder that can't be is unknown
+    pending = [(rootPath, '')]
+    while pending:
+        fullName, relName = pending.pop()
+        entries = model._scanDir(fullName, ignore, relName)
+        if relName:
+            st = entries is not None and _stat(fullName)
+            _writeRecord(fp, relName, FOLDER if st else UNKNOWN, st)
+            count += 1
+        if entries is None:
+            continue
+        folders, files = model._splitEntries(entries)
+        files = sorted(files)
+        digests = map(_digestJob, [(path.join(fullName, name), entries[name]) for name in files])
+        for name, digest in zip(files, digests):
+            st = entries[name]
+            if st is None or (stat.S_ISREG(st.st_mode) and digest is None):
+                kind = UNKNOWN
+            else:
+                kind = FILE if stat.S_ISREG(st.st_mode) else OTHER
+            _writeRecord(fp, _join(relName, name), kind, st, digest)
+            count += 1
+        # popped in sorted order
+        pending.extend((path.join(fullName, name), _join(relName, name))
+                       for name in sorted(folders, reverse=True))
+    fp.write(json.dumps({'entries': count}) + '\n')
+    return count
+
+##############################
+# helpers                    #
+##############################
+def _writeRecord(fp, relName, kind, st, digest=None):
+    relName, encoding = _jsonName(relName)
+    if kind == UNKNOWN:
+        record = [relName, kind, None, None, None]
+    else:
+        record = [relName, kind, st.st_size if kind != FOLDER else 0, st.st_mtime, digest]
+    if encoding:
+        record.append(encoding)
+    fp.write(json.dumps(record) + '\n')
+
+def _digestJob(args):
+    fileName, st = args
+    if st is None or not stat.S_ISREG(st.st_mode):
+        return None
+    try:
+        return hashcache.digestOf(fileName, st)
+    except IOError, e:
+        model._warnUnknown(fileName, e)
+        return None
+
+def _stat(fullName):
+    try:
+        return os.stat(fullName)
+    except OSError, e:
+        model._warnUnknown(fullName, e)
+        return None
+
+def _join(relName, name):
+    return relName + '/' + name if relName else name
+
+def _jsonName(name):
+    """Returns (name, encoding) to write a name as: encoding is None
+    unless the name isn't UTF-8, see above."""
+    if isinstance(name, str):
+        try:
+            name.decode('utf-8')
+        except UnicodeDecodeError:
+            return name.decode('latin-1'), 'latin-1'
+    return name, None
+
+def _fsName(name, encoding='utf-8'):
+    # JSON gives back unicode; the tree keeps file system encoded names
+    return name.encode(encoding) if isinstance(name, unicode) else name
+
+def main(args=None):
+    parser = optparse.OptionParser(usage='python manifest.py [options] rootPath',
+            description='Writes a manifest of a folder, which can be compared '
+                        'in place of the folder elsewhere.')
+    parser.add_option('-o', '--output', metavar='FILE',
+            help='write the manifest to FILE instead of the standard output')
+    parser.add_option('-i', '--ignore', default='',
+            help='comma seperated patterns to ignore, e.g. .svn,*.pyc,build/')
+    options, args = parser.parse_args(args)
+    if len(args) != 1:
+        parser.print_usage(sys.stderr)
+        return 2
+    rootPath, = args
+    if not path.isdir(rootPath):
+        print('Invalid given path.', file=sys.stderr)
+        return 2
+    ignore = tuple(ign.strip() for ign in options.ignore.split(',') if ign.strip())
+
+    workers = int(conf.workers)
+    pool = ThreadPool(workers) if workers > 1 else None
+    out = open(options.output, 'wb') if options.output else sys.stdout
+    try:
+        write(rootPath, out, ignore, pool.map if pool else map)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+        hashcache.flush()
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
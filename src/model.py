@@ -21,11 +21,31 @@ from __future__ import print_function
 import os
 import os.path as path
 import sys
-import filecmp
 import subprocess as subp
 import shutil
+import stat
+import struct
 import configuration as conf
+import hashcache
+import manifest
+import ignorerules
+import profiling
 import itertools
+import time
+import heapq
+import contextlib
+import functools
+import operator
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+try:
+    from os import scandir
+except ImportError:
+    # the scandir backport saves one stat call per entry on Windows
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 import logging
 # import all customized exceptions
@@ -41,41 +61,202 @@ STATUS_COMMON_SAME = 'common same'
 STATUS_COMMON_DIFF = 'common diff'
 STATUS_LEFT_ONLY = 'left only'
 STATUS_RIGHT_ONLY = 'right only'
+# files only found on one side, whose content is found on the other side
+# under another name or folder; see moves.py
+STATUS_LEFT_MOVED = 'left moved'
+STATUS_RIGHT_MOVED = 'right moved'
 # abnormal status
 # note that STATUS_UNKNOWN_COMMON can be further divided to
 # "both unknown", "left unknown" and "right unknown", though we don't care for now
 STATUS_UNKNOWN_COMMON = 'unknown common'
 STATUS_UNKNOWN_LEFT = 'unknown left'
 STATUS_UNKNOWN_RIGHT = 'unknown right'
+# not decided yet: a common folder left to be compared when its children are
+# first needed, see DirectoryDataItem.compare
+STATUS_COMMON_PENDING = 'common pending'
+# used to pack statuses as small integers
+_STATUSES = (None,
+             STATUS_COMMON_SAME, STATUS_COMMON_DIFF, STATUS_LEFT_ONLY, STATUS_RIGHT_ONLY,
+             STATUS_UNKNOWN_COMMON, STATUS_UNKNOWN_LEFT, STATUS_UNKNOWN_RIGHT,
+             STATUS_COMMON_PENDING, STATUS_LEFT_MOVED, STATUS_RIGHT_MOVED)
+
+# position of each status in _STATUSES
+_STATUS_INDEX = dict((status, i) for i, status in enumerate(_STATUSES))
+
+# statuses are summed up under these names in subtree statistics
+STAT_NAMES = ('same', 'diff', 'leftOnly', 'rightOnly', 'unknown', 'pending', 'moved')
+_STAT_OF_STATUS = {STATUS_COMMON_SAME: 'same', STATUS_COMMON_DIFF: 'diff',
+                   STATUS_LEFT_ONLY: 'leftOnly', STATUS_RIGHT_ONLY: 'rightOnly',
+                   STATUS_UNKNOWN_COMMON: 'unknown', STATUS_UNKNOWN_LEFT: 'unknown',
+                   STATUS_UNKNOWN_RIGHT: 'unknown', STATUS_COMMON_PENDING: 'pending',
+                   STATUS_LEFT_MOVED: 'moved', STATUS_RIGHT_MOVED: 'moved'}
+
+_MOVED_STATUSES = (STATUS_LEFT_MOVED, STATUS_RIGHT_MOVED)
+
+# three-way status of data items compared with a base, a tree both sides
+# came from: which side changed since, see DirectoryDataItem.compare
+MERGE_SAME = 'same'
+MERGE_CHANGED_LEFT = 'changed left'
+MERGE_CHANGED_RIGHT = 'changed right'
+MERGE_CONFLICT = 'conflict'
+_MERGE_STATUSES = (None, MERGE_SAME, MERGE_CHANGED_LEFT, MERGE_CHANGED_RIGHT, MERGE_CONFLICT)
+_MERGE_INDEX = dict((status, i) for i, status in enumerate(_MERGE_STATUSES))
+# files with these statuses are compared with the base
+_MERGEABLE_STATUSES = (STATUS_COMMON_DIFF, STATUS_LEFT_ONLY, STATUS_RIGHT_ONLY) + _MOVED_STATUSES
+
+# files compared between two checks for cancellation
+FILE_BATCH = 1000
+
+##############################
+# status batches             #
+##############################
+class _Batch(object):
+    """Collects status changes made inside batch(). Folders are decided
+    again and listeners are called once for all of them, when the
+    outermost batch ends."""
+
+    def __init__(self):
+        self.depth = 0
+        # data items whose status changed, by id
+        self.changed = {}
+        # folders to decide again, by id, and their children without
+        # status any more
+        self.dirty = {}
+        self.removed = {}
+
+    def add(self, itm, notify):
+        self.changed[id(itm)] = itm
+        if notify:
+            parent = itm.parent
+            self.dirty[id(parent)] = parent
+            if itm.status is None:
+                self.removed.setdefault(id(parent), []).append(itm)
+
+    def commit(self):
+        # status changes made while deciding are collected as well
+        self.depth += 1
+        try:
+            # the deepest folders first, so that each is decided once
+            heap, queued = [], set()
+            while self.dirty or heap:
+                for key, itm in self.dirty.iteritems():
+                    if key not in queued:
+                        queued.add(key)
+                        heapq.heappush(heap, (-_depthOf(itm), key, itm))
+                self.dirty = {}
+                if heap:
+                    depth, key, itm = heapq.heappop(heap)
+                    itm._settle(self.removed.pop(key, ()))
+        finally:
+            self.depth -= 1
+        changed, self.changed = self.changed, {}
+        for itm in changed.itervalues():
+            itm.updateUI()
+
+# the batch of the thread changing the tree, see batch()
+_batch = _Batch()
+
+@contextlib.contextmanager
+def batch():
+    """Status changes made inside the with block are propagated to the
+    folders above, and reported to the listeners, once each when the
+    outermost block ends. Only one thread may change the tree meanwhile."""
+    _batch.depth += 1
+    try:
+        yield
+    finally:
+        _batch.depth -= 1
+        if not _batch.depth:
+            _batch.commit()
+
+def _batched(method):
+    """Makes <method> run inside batch()."""
+    @functools.wraps(method)
+    def batchedMethod(*args, **kwargs):
+        with batch():
+            return method(*args, **kwargs)
+    return batchedMethod
 
 ##############################
 # data model                 #
 ##############################
 class DataItem(object):
-    """Represents one entry in the result of the comparison."""
-    # TODO consider slots
+    """Represents one entry in the result of the comparison.
+    There can be millions of them, so they have no __dict__, and only
+    the root one keeps its locations."""
+
+    __slots__ = ('name', 'parent', 'leftSig', 'rightSig', 'pyData', 'mergeStatus',
+                 '__status', '__leftLocation', '__rightLocation', '__existence')
 
-    __status = None
     def onStatusRead(self):
         return self.__status
     def onStatusChange(self, newStatus):
         oldStatus = self.__status
         if newStatus is not self.__status:
             self.__status = newStatus
-            # the controller observes model
-            self.updateUI()
+            parent = self.parent
+            if parent is not None:
+                counts = parent.childCounts
+                counts[_STATUS_INDEX[oldStatus]] -= 1
+                counts[_STATUS_INDEX[newStatus]] += 1
+                parent._forgetSubtreeCounts()
+            if oldStatus in _MOVED_STATUSES:
+                self._unpair()
             # oldStatus is None means this is the first time set
             # it's parent should not be notified in this case
-            if propagateStatus and oldStatus and self.parent:
-                self.parent.notifyChildUpdate(self)
+            self._notify(propagateStatus and oldStatus and parent)
     status = property(fget=onStatusRead, fset=onStatusChange)
 
-    # the parent DataItem representing the directory it's in
-    parent = None
+    def _notify(self, notify):
+        """Reports a change of this item to the listeners, and to the parent
+        as well if <notify>."""
+        if _batch.depth:
+            _batch.add(self, notify)
+            return
+        if notify:
+            # the folders above are decided one after another by the batch,
+            # not each from the one below it, however deep the tree is
+            with batch():
+                _batch.add(self, notify)
+            return
+        # the controller observes model
+        self.updateUI()
+
+    def _setMergeStatus(self, mergeStatus):
+        if mergeStatus != self.mergeStatus:
+            self.mergeStatus = mergeStatus
+            if _batch.depth:
+                _batch.add(self, False)
+
+    def updateUI(self):
+        """Listener on the model. The controller installs a real one."""
+        pass
+
+    def updateChildrenUI(self):
+        """Listener on the model, called when children are added to a folder.
+        The controller installs a real one."""
+        pass
+
+    # parent: the parent DataItem representing the directory it's in
+
+    # leftSig, rightSig: stat signatures taken when this DataItem was
+    # last compared, see _signature
+
+    # mergeStatus: one of the MERGE_ statuses when compared with a base,
+    # None otherwise, or when not known
 
     # locations of this DataItem
-    leftLocation = None
-    rightLocation = None
+    # they're the full names of the parent, only the root keeps its own
+    def onLeftLocationRead(self):
+        if self.parent is not None:
+            return self.parent.leftFullName
+        return self.__leftLocation
+    def onRightLocationRead(self):
+        if self.parent is not None:
+            return self.parent.rightFullName
+        return self.__rightLocation
+    leftLocation = property(fget=onLeftLocationRead)
+    rightLocation = property(fget=onRightLocationRead)
 
     # full name = location + short name
     def onLeftFullNameRead(self):
@@ -91,62 +272,119 @@ class DataItem(object):
     leftFullName = property(fget=onLeftFullNameRead)
     rightFullName = property(fget=onRightFullNameRead)
 
+    # the base, if any, is only kept by the root folder
+    def onBaseLocationRead(self):
+        if self.parent is not None:
+            return self.parent.baseFullName
+        return None
+    def onBaseFullNameRead(self):
+        if not self.baseLocation:
+            return None
+        else:
+            return path.join(self.baseLocation, self.name)
+    baseLocation = property(fget=onBaseLocationRead)
+    baseFullName = property(fget=onBaseFullNameRead)
+
+    # existence on both sides is recorded when found by the walk, or when
+    # first asked for, and kept up to date by copy, delete and refresh
     def onLeftExistsRead(self):
-        return path.exists(self.leftFullName)
+        return self._exists('left')
     def onRightExistsRead(self):
-        return path.exists(self.rightFullName)
+        return self._exists('right')
+    def onBaseExistsRead(self):
+        return self._exists('base')
     leftExists = property(fget=onLeftExistsRead)
     rightExists = property(fget=onRightExistsRead)
+    baseExists = property(fget=onBaseExistsRead)
+
+    def _exists(self, side):
+        known, exists = _EXISTENCE_BITS[side]
+        if not self.__existence & known:
+            self._setExists(side, _pathExists(getattr(self, side + 'FullName')))
+        return bool(self.__existence & exists)
+
+    def _setExists(self, side, exists):
+        known, bit = _EXISTENCE_BITS[side]
+        self.__existence = (self.__existence & ~bit) | known | (bit if exists else 0)
+
+    def _forgetExists(self):
+        """The file system will be asked again next time."""
+        self.__existence = 0
+
+    def _knowsExists(self, side):
+        """Tells if the existence on <side> is recorded. Only the items
+        compared with a base know if they are found in it."""
+        return bool(self.__existence & _EXISTENCE_BITS[side][0])
 
     def __init__(self, *args):
         raise InvalidMethodInvocationError('Please choose a subclass to initialize.')
 
-    def baseinit(self, name, leftLocation, rightLocation):
+    def baseinit(self, name, leftLocation, rightLocation, parent=None):
         # ONLY when it's root DataItem, the name can be an empty string
         # but it's never an empty value
+        # locations are ignored when parent is given
         def assertNotNone(v):
             if v is None:
                 raise(InvalidValueError('name, leftLocation and rightLocation can\'t be None.'))
-        map(assertNotNone, (name, leftLocation, rightLocation))
-        self.name = name
-        self.leftLocation = leftLocation
-        self.rightLocation = rightLocation
+        map(assertNotNone, (name, ) if parent else (name, leftLocation, rightLocation))
+        self.name = _intern(name)
+        self.parent = parent
+        self.__leftLocation = None if parent else leftLocation
+        self.__rightLocation = None if parent else rightLocation
+        if not parent:
+            map(useManifest, (leftLocation, rightLocation))
+        self.__status = None
+        self.__existence = 0
+        self.leftSig = self.rightSig = None
+        self.mergeStatus = None
+
+    def _packBase(self):
+        """The three-way status and whether it's found in the base, if
+        known, as put in the result of pack."""
+        return (_MERGE_INDEX[self.mergeStatus],
+                self.baseExists if self._knowsExists('base') else None)
 
     # operations
     def _precopy(self, srcSide, destSide):
-        if self.status not in (STATUS_COMMON_DIFF, STATUS_LEFT_ONLY, STATUS_RIGHT_ONLY):
+        if self.status not in (STATUS_COMMON_DIFF, STATUS_LEFT_ONLY, STATUS_RIGHT_ONLY) + _MOVED_STATUSES:
             # we don't raise exceptions here since we want the program continue to run
-            logging.debug('copy operation on '
-                    + str(self)
-                    + ' not executed, since self.status is'
-                    + self.status
-                    + '.')
+            # named by path: str() of a folder holds everything in it
+            logging.debug('copy operation on %s not executed, since self.status is %s.'
+                    % (_relNameOf(self), self.status))
             return None, None
 
         if not getattr(self, srcSide + 'Exists'):
             # we don't raise exceptions here, too for the same reason
-            logging.debug('copy operation on '
-                    + str(self)
-                    + ' not executed, since the file on '
-                    + srcSide
-                    + 'does not exist.')
+            logging.debug('copy operation on %s not executed, since the file on %s does not exist.'
+                    % (_relNameOf(self), srcSide))
             return None, None
 
         src = getattr(self, srcSide + 'FullName')
         dest = getattr(self, destSide + 'FullName')
+        if _inManifest(dest)[0]:
+            raise InvalidMethodInvocationError('%s is in a manifest, it can\'t be changed.' % dest)
+        if _inManifest(src)[0]:
+            # a manifest has names and digests, not the data
+            raise InvalidMethodInvocationError('%s is in a manifest, it can\'t be copied.' % src)
+        if path.lexists(dest) and path.isdir(dest) != self.isDir():
+            # a file of the same name where a folder goes, or the other way round
+            raise InvalidMethodInvocationError('%s is a %s, it can\'t be replaced by a copy.'
+                    % (dest, 'folder' if path.isdir(dest) else 'file'))
 
         return src, dest
 
     def _delete(self, delCmd, side):
         target = getattr(self, side + 'FullName')
+        if _inManifest(target)[0]:
+            raise InvalidMethodInvocationError('%s is in a manifest, it can\'t be changed.' % target)
         if not getattr(self, side + 'Exists'):
-            logging.debug('delete operation on '
-                    + str(self)
-                    + ' not executed, since the file on'
-                    + side
-                    + 'does not exist.')
+            logging.debug('delete operation on %s not executed, since the file on %s does not exist.'
+                    % (_relNameOf(self), side))
         else:
             delCmd(target)
+            self._setExists(side, False)
+        # not known until compared with the base again
+        self.mergeStatus = None
         if self.leftExists:
             self.status = STATUS_LEFT_ONLY
         elif self.rightExists:
@@ -174,38 +412,443 @@ class DataItem(object):
         return self.__str__()
 
 class DirectoryDataItem(DataItem):
-    def __init__(self, name, leftLocation, rightLocation):
+    __slots__ = ('childCounts', '_subtreeCounts', '__children', '__index', '__stale',
+                 '__loader', '__leftFullName', '__rightFullName',
+                 '__baseLocation', '__baseFullName')
+
+    def __init__(self, name, leftLocation, rightLocation, validate=True, parent=None,
+                 baseLocation=None):
         # sub data items
-        self.children = []
-        super(DirectoryDataItem, self).baseinit(name, leftLocation, rightLocation)
-        if (self.leftExists and not path.isdir(self.leftFullName)) or \
-           (self.rightExists and not path.isdir(self.rightFullName)):
+        self.__children = []
+        # children by (name, isDir), built when first needed
+        self.__index = None
+        # number of removed children still in __children
+        self.__stale = 0
+        # adds the children when they are first needed, see setChildrenLoader
+        self.__loader = None
+        # number of children with each status, in the order of _STATUSES
+        self.childCounts = [0] * len(_STATUSES)
+        # the same for the whole subtree, None until asked for
+        self._subtreeCounts = None
+        self.__leftFullName = self.__rightFullName = None
+        # the tree both sides came from, see compare; only the root keeps it
+        self.__baseLocation = None if parent else baseLocation
+        self.__baseFullName = None
+        super(DirectoryDataItem, self).baseinit(name, leftLocation, rightLocation, parent)
+        if self.__baseLocation:
+            useManifest(self.__baseLocation)
+        # validate is False when the caller already knows these are dirs,
+        # e.g. when the item is created from a directory listing
+        if validate and \
+           ((self.leftExists and not _hasMode(self.leftFullName, stat.S_ISDIR)) or \
+            (self.rightExists and not _hasMode(self.rightFullName, stat.S_ISDIR))):
             raise InvalidMethodInvocationError('DirectoryDataItem.__init__ should be invoked with dirs.')
 
-    def compare(self, ignore=()):
+    # removed children are only dropped from the list when it's read again,
+    # so removing many of them costs one pass
+    def onChildrenRead(self):
+        if self.__loader is not None:
+            self.__loadChildren()
+        if self.__stale:
+            index = self.__index
+            self.__children[:] = [itm for itm in self.__children
+                                  if index.get((itm.name, itm.isDir())) is itm]
+            self.__stale = 0
+        return self.__children
+    children = property(fget=onChildrenRead)
+
+    def getChild(self, name, isDir):
+        """Returns the child with the given name and type, or None."""
+        return self.__childIndex().get((name, isDir))
+
+    def __childIndex(self):
+        if self.__loader is not None:
+            self.__loadChildren()
+        if self.__index is None:
+            self.__index = dict(((itm.name, itm.isDir()), itm) for itm in self.__children)
+        return self.__index
+
+    def setChildrenLoader(self, loader):
+        """Defers creating the children: <loader>(self) is called when they
+        are first needed, and adds them with addChild."""
+        self.__loader = loader
+
+    def getChildrenLoader(self):
+        return self.__loader
+
+    def loadChildren(self):
+        """Runs the children loader now, if there's one."""
+        if self.__loader is not None:
+            self.__loadChildren()
+
+    def isDeferred(self):
+        """Tells if this folder is left to be compared when its children are
+        first needed, see compare."""
+        return isinstance(self.__loader, _Deferred)
+
+    def __loadChildren(self):
+        loader, self.__loader = self.__loader, None
+        loader(self)
+
+    def addChild(self, name, itemType):
+        """Creates a child, still without status, and adds it to children.
+        Only meant for children loaders; the child is no different from
+        the ones found by compare."""
+        return self.__newChild(name, itemType)
+
+    def subtreeCounts(self):
+        """Returns the number of items with each status in the whole subtree,
+        in the order of _STATUSES. It's kept until something below changes.
+        Deferred folders are counted, but not compared for it."""
+        if self._subtreeCounts is None:
+            # the folders to count, each before the ones in it
+            folders, stack = [], [self]
+            while stack:
+                itm = stack.pop()
+                if itm._subtreeCounts is None:
+                    folders.append(itm)
+                    stack.extend(each for each in itm.children
+                                 if each.isDir() and not each.isDeferred())
+            for itm in reversed(folders):
+                counts = list(itm.childCounts)
+                for each in itm.children:
+                    if each.isDir() and not each.isDeferred():
+                        counts = map(operator.add, counts, each._subtreeCounts)
+                itm._subtreeCounts = counts
+        return self._subtreeCounts
+
+    def subtreeStats(self):
+        """Returns subtreeCounts summed up as a dict keyed by STAT_NAMES."""
+        stats = dict.fromkeys(STAT_NAMES, 0)
+        for status, count in zip(_STATUSES, self.subtreeCounts()):
+            if status is not None:
+                stats[_STAT_OF_STATUS[status]] += count
+        return stats
+
+    def _forgetSubtreeCounts(self):
+        # a folder never has its counts while a folder above has none
+        itm = self
+        while itm is not None and itm._subtreeCounts is not None:
+            itm._subtreeCounts = None
+            itm = itm.parent
+
+    # full names of folders are kept, since every child needs them
+    def onLeftFullNameRead(self):
+        if self.__leftFullName is None:
+            self.__leftFullName = DataItem.onLeftFullNameRead(self)
+        return self.__leftFullName
+    def onRightFullNameRead(self):
+        if self.__rightFullName is None:
+            self.__rightFullName = DataItem.onRightFullNameRead(self)
+        return self.__rightFullName
+    def onBaseFullNameRead(self):
+        if self.__baseFullName is None:
+            self.__baseFullName = DataItem.onBaseFullNameRead(self)
+        return self.__baseFullName
+    def onBaseLocationRead(self):
+        if self.parent is not None:
+            return self.parent.baseFullName
+        return self.__baseLocation
+    leftFullName = property(fget=onLeftFullNameRead)
+    rightFullName = property(fget=onRightFullNameRead)
+    baseLocation = property(fget=onBaseLocationRead)
+    baseFullName = property(fget=onBaseFullNameRead)
+
+    def compare(self, ignore=(), workers=None, processes=None, progress=None, filters=None,
+                lazy=False, detectMoves=None, callAfter=None):
         """Starts computing current DirectoryDataItem instance.
-           The directories must exist on both sides."""
+           The directories must exist on both sides; either side may also
+           be a manifest file (see manifest.py) given as the location of
+           the root, in which case that side is read from the manifest.
+           Folders are listed and files are compared by <workers> threads,
+           WORKERS in the config file by default.
+           When <processes> (PROCESSES in the config file by default) is more
+           than 1, common sub folders are compared in that many processes.
+           When a CompareProgress is given as <progress>, the top level
+           items are compared one after another and reported to it as soon
+           as each is done, and CompareCancelledError is raised if it is
+           cancelled.
+           A WalkFilter given as <filters> leaves files and deep folders
+           out while the trees are walked.
+           When <lazy> is true, only the items right in this folder are
+           compared. Sub folders are deferred, with STATUS_COMMON_PENDING
+           when they are common, and each is compared the same way when its
+           children are first needed, e.g. when it's expanded; so only what's
+           looked at is ever compared. See prefetch.py to compare the next
+           levels ahead in the background.
+           Unless <detectMoves> is false (DETECT_MOVES in the config file by
+           default), one side files found on the other side under another
+           name are marked moved, see moves.py; never in lazy mode. When
+           the comparison runs on another thread than the one owning the
+           tree, moved files are marked through <callAfter>, e.g.
+           wx.CallAfter, as the items may be shown by then.
+           When the root was given a base location, a folder or a manifest
+           of the tree both sides came from, the base is listed along with
+           both sides, and every item gets a mergeStatus telling which side
+           changed since: MERGE_SAME, MERGE_CHANGED_LEFT, MERGE_CHANGED_RIGHT,
+           or MERGE_CONFLICT when both did. Files that differ between the
+           sides are compared with the base, with each side at most once; a
+           folder sums up where it's found and what's in it. The base is
+           not looked at in lazy mode."""
 
         if not self.leftExists or not self.rightExists:
             raise InvalidMethodInvocationError('method compare can only be called on common DirectoryDataItem(s).')
 
-        if _isUnknown(self.leftFullName) or _isUnknown(self.rightFullName):
-            status = STATUS_UNKNOWN_COMMON
+        if workers is None:
+            workers = int(conf.workers)
+        if processes is None:
+            processes = int(conf.processes)
+        if detectMoves is None:
+            detectMoves = bool(int(conf.detectMoves))
+        ignore = ignorerules.getRules(ignore)
+        if any(_inManifest(name)[0]
+               for name in (self.leftFullName, self.rightFullName, self.baseFullName) if name):
+            # manifests are only known to this process
+            processes = 1
+        if lazy:
+            lazy = _Lazy(ignore, filters, workers)
+            processes = 1
+        self._forgetExists()
+        if self.baseFullName is not None and not lazy:
+            self._setExists('base', _hasMode(self.baseFullName, stat.S_ISDIR))
+        self.leftSig, self.rightSig = \
+            _signature(_stat(self.leftFullName)), _signature(_stat(self.rightFullName))
+        # opened here, not by the first worker to need a digest
+        hashcache.getCache()
+        pool = ThreadPool(workers) if workers > 1 else None
+        processPool = multiprocessing.Pool(processes) if processes > 1 else None
+        sharding = processPool and (processPool, processes, workers)
+        # once the worker processes are started, so they don't inherit it
+        profile = profiling.begin(_profileTitle(self))
+        try:
+            if lazy:
+                self.__compareLevels(ignore, pool.map if pool else map, [(self, None)],
+                        progress=progress, filters=filters, lazy=lazy)
+                if progress:
+                    progress.total = len(self.children)
+                    for itm in self.children:
+                        progress.itemDone(itm)
+            elif progress:
+                self.__compareProgressively(ignore, pool.map if pool else map,
+                        sharding, progress, filters)
+            else:
+                self.__compareLevels(ignore, pool.map if pool else map, [(self, None)],
+                        sharding=sharding, filters=filters)
+            if detectMoves and not lazy:
+                _detectMoves(self, pool.map if pool else map, callAfter)
+        finally:
+            for each in (pool, processPool):
+                if each:
+                    each.close()
+                    each.join()
+            hashcache.flush()
+            profiling.end(profile)
+
+    def __compareProgressively(self, ignore, map, sharding, progress, filters=None):
+        """Compares the top level first, then every top level folder as a
+        whole, so that each top level item is reported to <progress> as
+        soon as its subtree is known."""
+        (lEntries, rEntries, bEntries), = _scanLevel(map, [(self, None)], ignore, filters)
+        if lEntries is None or rEntries is None:
             return
+        progress.entries += len(lEntries) + len(rEntries)
+        pending, fileJobs, mergeJobs = [], [], []
+        self.__initSubItems(lEntries, rEntries, pending, fileJobs)
+        if bEntries is not None:
+            self.__initBase(self.children, lEntries, rEntries, bEntries, mergeJobs)
+        progress.total = len(self.children)
+        # top level files first, they are usually few
+        self.__compareLevels(ignore, map, [], fileJobs, mergeJobs, progress=progress,
+                             filters=filters)
+        folders = set(id(itm) for itm, side in pending)
+        self.children.sort()
+        for itm in self.children:
+            if id(itm) not in folders:
+                progress.itemDone(itm)
+        for itm, side in pending:
+            itm.__compareLevels(ignore, map, [(itm, side)],
+                    sharding=side is None and sharding, progress=progress, filters=filters)
+            progress.itemDone(itm)
+        self.__decideMerge()
+        self.status = self.__diffOrSame()
+
+    def __compareLevels(self, ignore, map, pending, fileJobs=(), mergeJobs=(), sharding=None,
+                        progress=None, filters=None, lazy=None):
+        """Compares the tree level by level, starting from the folders in
+        <pending> and the files in <fileJobs>. All folders found on a level
+        are listed through <map>, then all common files found in them are
+        compared through <map>; <map> may run the jobs concurrently.
+        Folders found in a base are listed along with it, in the same job,
+        and the files in <mergeJobs>, see __initBase, are compared with the
+        base once compared between the sides.
+        Results are merged into the tree on the calling thread only.
+        <sharding> is (processPool, processes, workers) or None. When given,
+        on the first level with at least <processes> common folders, these
+        folders are compared in the process pool instead, and their results
+        are grafted into the tree.
+        <progress> is a CompareProgress or None. It is checked for
+        cancellation between steps, and files are then compared in batches
+        of FILE_BATCH so that cancelling doesn't wait for a whole level.
+        <filters> is a WalkFilter or None, applied to every listing.
+        When <lazy>, a _Lazy, is given, only the first level is compared;
+        the folders found on it are deferred, see compare."""
+        # listed folders, parents always before children
+        folders = []
+        # folders to list on the next level: (item, side)
+        # side is None for common folders
+        # files to compare on this level: (item, leftStat, rightStat)
+        fileJobs, mergeJobs = list(fileJobs), list(mergeJobs)
+        shards, shardResults = [], None
+        profile = profiling.current
+        while pending or fileJobs or mergeJobs:
+            if progress:
+                progress.check()
+            if sharding:
+                processPool, processes, workers = sharding
+                common = [itm for itm, side in pending if side is None]
+                if len(common) >= processes:
+                    shards = common
+                    shardResults = processPool.map_async(_compareShard,
+                            [(_relNameOf(itm), _rootOf(itm).leftLocation,
+                              _rootOf(itm).rightLocation,
+                              _rootOf(itm).baseLocation if itm._knowsExists('base') else None,
+                              ignore, workers, filters)
+                             for itm in shards])
+                    pending = [(itm, side) for itm, side in pending if side is not None]
+                    sharding = None
+            # each side is listed exactly once, and every entry in it is stat'ed
+            # exactly once; the results are shared by everything below
+            listings = _scanLevel(map, pending, ignore, filters)
+            nextPending = []
+            started = time.time() if profile else None
+            for (itm, side), (lEntries, rEntries, bEntries) in zip(pending, listings):
+                if progress:
+                    progress.entries += len(lEntries or ()) + len(rEntries or ())
+                if side is None and filters and not filters.lists(_relNameOf(itm)):
+                    # on the last level: not compared, rather than same
+                    itm.status = STATUS_COMMON_PENDING
+                    continue
+                if side is None:
+                    if lEntries is None or rEntries is None:
+                        # unknown common folders are left uncompared
+                        if itm.status is STATUS_COMMON_PENDING:
+                            # a deferred one is shown already
+                            itm.status = STATUS_UNKNOWN_COMMON
+                        continue
+                    itm.__initSubItems(lEntries, rEntries, nextPending, fileJobs)
+                else:
+                    itm.__initOneSideListing(side,
+                            lEntries if side == 'left' else rEntries, nextPending)
+                if bEntries is not None:
+                    itm.__initBase(itm.children, lEntries, rEntries, bEntries, mergeJobs)
+                folders.append((itm, side))
+            if profile:
+                profile.add('build', time.time() - started)
+
+            shallow = int(conf.shallow)
+            batch = FILE_BATCH if progress else len(fileJobs)
+            for start in xrange(0, len(fileJobs), batch or 1):
+                jobs = fileJobs[start:start + batch]
+                if progress:
+                    progress.check()
+                results = map(_cmpFilePair,
+                        [(itm.leftFullName, itm.rightFullName, lStat, rStat, shallow)
+                         for itm, lStat, rStat in jobs])
+                for (itm, lStat, rStat), (same, offset) in zip(jobs, results):
+                    itm.firstDiffOffset = offset
+                    itm.status = STATUS_COMMON_SAME if same else STATUS_COMMON_DIFF
+                if progress:
+                    progress.bytes += sum(lStat.st_size for itm, lStat, rStat in jobs)
+            if mergeJobs:
+                _decideMerges(map, mergeJobs, shallow)
+            pending, fileJobs, mergeJobs = nextPending, [], []
+            if lazy:
+                for itm, side in pending:
+                    itm.__defer(lazy, side)
+                if lazy.prefetcher:
+                    lazy.prefetcher.queue(pending)
+                pending = []
+
+        if shards:
+            for itm, packed in zip(shards, shardResults.get()):
+                itm.__graft(packed)
+
+        started = time.time() if profile else None
+        for itm, side in folders:
+            itm.children.sort()
+        if profile:
+            profile.add('sort', time.time() - started)
+        # status of dir comparisons, children first
+        for itm, side in reversed(folders):
+            itm.__decideMerge()
+            if side is None:
+                itm.status = itm.__diffOrSame()
+
+    def __defer(self, lazy, side):
+        """Leaves this folder to be compared when its children are first
+        needed. A common folder is pending meanwhile."""
+        if side is None:
+            self.status = STATUS_COMMON_PENDING
+        else:
+            self.status = globals()['STATUS_' + side.upper() + '_ONLY']
+        self.setChildrenLoader(_Deferred(lazy, side))
+
+    @_batched
+    def _compareDeferred(self, deferred):
+        """Compares a deferred folder one level deep, deferring its sub
+        folders in turn. Jobs already run ahead by a prefetch.Prefetcher
+        are not run again."""
+        lazy = deferred.lazy
+        pool = None
+        if deferred.prefetched is not None:
+            mapLevel = functools.partial(_mapPrefetched, deferred.prefetched)
+        else:
+            pool = ThreadPool(lazy.workers) if lazy.workers > 1 else None
+            mapLevel = pool.map if pool else map
+        try:
+            self.__compareLevels(lazy.ignore, mapLevel, [(self, deferred.side)],
+                                 filters=lazy.filters, lazy=lazy)
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+            hashcache.flush()
+
+    def pack(self):
+        """Returns this subtree in a compact, picklable form,
+        which can be turned back by graft."""
+        return (self.name, _STATUS_INDEX[self.status],
+                tuple(each.pack() for each in self.children),
+                self.leftSig, self.rightSig) + self._packBase()
+
+    def __graft(self, packed):
+        """Creates the subtree returned by pack under this item."""
+        name, status, children, self.leftSig, self.rightSig, merge, inBase = packed
+        for each in children:
+            itemType = DirectoryDataItem if each[2] is not None else FileDataItem
+            itm = self.__newChild(each[0], itemType)
+            if itemType is DirectoryDataItem:
+                itm.__graft(each)
+            else:
+                itm.leftSig, itm.rightSig, itm.firstDiffOffset = each[3:6]
+                itm.status = _STATUSES[each[1]]
+            for side in ('left', 'right'):
+                itm._setExists(side, side in _sidesOf(itm.status)
+                                     and getattr(itm, side + 'Sig') is not None)
+            itm.mergeStatus = _MERGE_STATUSES[each[-2]]
+            if each[-1] is not None:
+                itm._setExists('base', each[-1])
+        self.mergeStatus = _MERGE_STATUSES[merge]
+        self.status = _STATUSES[status]
 
+    def __initSubItems(self, lEntries, rEntries, pending, fileJobs):
+        """Creates sub DataItems of a common folder from its listings."""
         # get necessary sets: commonFolders, commonFiles, lOnlyFolders, lOnlyFiles, rOnlyFolders, rOnlyFiles
 
         # lFolders, rFolders, lFiles, rFiles, commonFolders, commonFiles,
         # lOnlyFolders, rOnlyFolders, lOnlyFiles, rOnlyFiles are all short names
-        lShortNames, rShortNames = \
-            set(_filter(os.listdir(self.leftFullName), ignore)), \
-            set(_filter(os.listdir(self.rightFullName), ignore))
-
-        # seperate folders from files
-        lFolders, rFolders = \
-            set(name for name in lShortNames if path.isdir(path.join(self.leftFullName, name))), \
-            set(name for name in rShortNames if path.isdir(path.join(self.rightFullName, name)))
-        lFiles, rFiles = lShortNames.difference(lFolders), rShortNames.difference(rFolders)
+        (lFolders, lFiles), (rFolders, rFiles) = \
+            _splitEntries(lEntries), _splitEntries(rEntries)
         # common
         commonFolders = lFolders.intersection(rFolders)
         commonFiles = lFiles.intersection(rFiles)
@@ -219,74 +862,312 @@ class DirectoryDataItem(DataItem):
                 (lOnlyFolders, rOnlyFolders, lOnlyFiles, rOnlyFiles),
                 (DirectoryDataItem, DirectoryDataItem, FileDataItem, FileDataItem),
                 ('left', 'right') * 2,
-                (ignore, ) * 4)
+                (lEntries, rEntries) * 2,
+                (pending, ) * 4)
 
         # deal with 'common' items
-        self.__initCommonSubItems(commonFolders, DirectoryDataItem, ignore)
-        self.__initCommonSubItems(commonFiles, FileDataItem, ignore)
+        self.__initCommonSubItems(commonFolders, DirectoryDataItem, lEntries, rEntries, pending, fileJobs)
+        self.__initCommonSubItems(commonFiles, FileDataItem, lEntries, rEntries, pending, fileJobs)
 
-        # status of current dir comparison
-        self.status = self.__diffOrSame()
+    def __initBase(self, items, lEntries, rEntries, bEntries, mergeJobs):
+        """Records which of <items>, children of this folder, are found in
+        the base listing <bEntries>, and puts the files to <mergeJobs> to be
+        compared with the base once compared between the sides.
+        <lEntries> and <rEntries> are the listings of both sides, None for
+        a side the folder is not on."""
+        bFolders = _splitEntries(bEntries)[0]
+        lEntries, rEntries = lEntries or {}, rEntries or {}
+        for itm in items:
+            name = itm.name
+            if itm.isDir():
+                itm._setExists('base', name in bFolders)
+                continue
+            bStat = bEntries.get(name) if name not in bFolders else None
+            if bStat is None and name in bEntries and name not in bFolders:
+                # can't be stat'ed, so neither is known
+                continue
+            itm._setExists('base', bStat is not None)
+            mergeJobs.append((itm, lEntries.get(name), rEntries.get(name), bStat))
 
-        self.children.sort()
+    def __mergeOf(self):
+        """Decides the three-way status of a folder from where it's found
+        and from its children's, which must be decided first. Children not
+        known are left out."""
+        if self.status in (STATUS_UNKNOWN_COMMON, STATUS_UNKNOWN_LEFT, STATUS_UNKNOWN_RIGHT):
+            return None
+        changes = set(itm.mergeStatus for itm in self.children)
+        if self.leftExists != self.rightExists:
+            changes.add(MERGE_CHANGED_RIGHT if self.baseExists == self.leftExists
+                        else MERGE_CHANGED_LEFT)
+        changes.difference_update((None, MERGE_SAME))
+        if not changes:
+            return MERGE_SAME
+        return changes.pop() if len(changes) == 1 else MERGE_CONFLICT
+
+    def __decideMerge(self):
+        if self._knowsExists('base'):
+            self._setMergeStatus(self.__mergeOf())
 
     def __diffOrSame(self):
         if not self.leftExists or not self.rightExists:
             raise InvalidMethodInvocationError('method __diffOrSame is meaningful only when called on common DirectoryDataItem(s).')
-        if [itm for itm in self.children if itm.status is not STATUS_COMMON_SAME]:
-            return STATUS_COMMON_DIFF
-        else:
+        same = self.childCounts[_STATUS_INDEX[STATUS_COMMON_SAME]]
+        total = sum(self.childCounts)
+        if same == total:
             return STATUS_COMMON_SAME
+        elif same + self.childCounts[_STATUS_INDEX[STATUS_COMMON_PENDING]] == total:
+            # nothing different so far, but not everything is compared
+            return STATUS_COMMON_PENDING
+        else:
+            return STATUS_COMMON_DIFF
+
+    def __initOneSideListing(self, side, entries, pending):
+        """Decides the status of a one side folder from its listing."""
+        if entries is None:
+            self.status = globals()['STATUS_UNKNOWN_' + side.upper()]
+            return
+        self.status = globals()['STATUS_' + side.upper() + '_ONLY']
+        folders, files = _splitEntries(entries)
+        self.__initOneSideSubItems(folders, DirectoryDataItem, side, entries, pending)
+        self.__initOneSideSubItems(files, FileDataItem, side, entries, pending)
 
-    def __initOneSideSubItems(self, names, itemType, side, ignore=()):
-        """Recursively creates DataItem objects for given dir with given status."""
+    def __initOneSideSubItems(self, names, itemType, side, entries, pending):
+        """Creates DataItem objects for given dir with given status.
+           Sub folders are put to <pending> to be listed on the next level."""
         status = globals()['STATUS_' + side.upper() + '_ONLY']
         badStatus = globals()['STATUS_UNKNOWN_' + side.upper()]
-        baseDir = getattr(self, side + 'FullName')
         for each in names:
-            # though it's only on one side, we still set the other side's location
+            # though it's only on one side, it still has the other side's location
             # it's useful for the Copy operation
-            itm = itemType(each, self.leftFullName, self.rightFullName)
-            itm.parent = self
-            if not _isUnknown(path.join(baseDir, each)):
-                itm.status = status
-                if itemType is DirectoryDataItem:
-                    # recursive call when <names> are dirs
-                    newBaseDir = getattr(itm, side + 'FullName')
-                    shortNames = set(_filter(os.listdir(newBaseDir), ignore))
-                    folders = set(name for name in shortNames if path.isdir(path.join(newBaseDir, name)))
-                    files = shortNames.difference(folders)
-                    itm.__initOneSideSubItems(folders, DirectoryDataItem, side, ignore)
-                    itm.__initOneSideSubItems(files, FileDataItem, side, ignore)
-            else:
+            itm = self.__newChild(each, itemType)
+            setattr(itm, side + 'Sig', _signature(entries[each]))
+            itm._setExists(side, entries[each] is not None)
+            itm._setExists(_otherSide(side), False)
+            if entries[each] is None:
                 itm.status = badStatus
-            self.children.append(itm)
-
-        self.children.sort()
+            elif itemType is DirectoryDataItem:
+                pending.append((itm, side))
+            else:
+                itm.status = status
 
-    def __initCommonSubItems(self, names, itemType, ignore):
-        """Creates DataItems that are common on both sides."""
+    def __initCommonSubItems(self, names, itemType, lEntries, rEntries, pending, fileJobs):
+        """Creates DataItems that are common on both sides.
+           Sub folders are put to <pending> to be listed on the next level,
+           files to <fileJobs> to be compared when the level is done."""
         for each in names:
-            itm = itemType(each, self.leftFullName, self.rightFullName)
-            itm.parent = self
+            itm = self.__newChild(each, itemType)
+            itm.leftSig, itm.rightSig = _signature(lEntries[each]), _signature(rEntries[each])
+            itm._setExists('left', lEntries[each] is not None)
+            itm._setExists('right', rEntries[each] is not None)
             if itemType is DirectoryDataItem:
-                itm.compare(ignore)
+                pending.append((itm, None))
             elif itemType is FileDataItem:
-                if not _isUnknown(itm.leftFullName) and not _isUnknown(itm.rightFullName):
-                    itm.status = STATUS_COMMON_SAME \
-                            if filecmp.cmp(itm.leftFullName, itm.rightFullName, shallow=int(conf.shallow)) else \
-                            STATUS_COMMON_DIFF
+                lStat, rStat = lEntries[each], rEntries[each]
+                if lStat is not None and rStat is not None:
+                    fileJobs.append((itm, lStat, rStat))
                 else:
                     itm.status = STATUS_UNKNOWN_COMMON
             else:
                 raise InvalidValueError()
-            self.children.append(itm)
 
-    # trigger
-    def notifyChildUpdate(self, child):
-        """only available to directories"""
-        if child.status is None:
-            self.children.remove(child)
+    def __newChild(self, name, itemType):
+        """Creates a child, still without status, and adds it to children."""
+        if self.__loader is not None:
+            self.__loadChildren()
+        itm = itemType(name, None, None, validate=False, parent=self)
+        self.__children.append(itm)
+        if self.__index is not None:
+            self.__index[(itm.name, itm.isDir())] = itm
+        self.childCounts[0] += 1
+        self._forgetSubtreeCounts()
+        return itm
+
+    def _removeChildren(self, items):
+        """Removes the given children, if they are still there."""
+        index = self.__childIndex()
+        for itm in items:
+            key = (itm.name, itm.isDir())
+            if index.get(key) is itm:
+                del index[key]
+                self.childCounts[_STATUS_INDEX[itm.status]] -= 1
+                self.__stale += 1
+        self._forgetSubtreeCounts()
+
+    def __clearChildren(self):
+        self.__loader = None
+        del self.__children[:]
+        self.__index = None
+        self.__stale = 0
+        self.childCounts[:] = [0] * len(_STATUSES)
+        self._forgetSubtreeCounts()
+
+    @_batched
+    def refresh(self, ignore=(), workers=None, recursive=True, filters=None, detectMoves=None):
+        """Compares again only what has changed since the last comparison.
+        Folders whose modified time didn't change are not listed again; only
+        their known entries are stat'ed. Files whose stat signature didn't
+        change are not compared again. Changed items are patched in place, so
+        their status changes propagate the usual way.
+        When <recursive> is False, known sub folders are not looked into;
+        this is used when the caller knows exactly which folders changed.
+        <filters> should be the WalkFilter the tree was compared with.
+        Moved files are looked for again in the whole tree, unless
+        <detectMoves> is false; see compare.
+        Files compared again are compared with the base again, if there's
+        one; the base itself is taken as never changing."""
+        if detectMoves is None:
+            detectMoves = bool(int(conf.detectMoves))
+        if self.status is None:
+            # never compared, or unknown
+            self.__clearChildren()
+            self.compare(ignore, workers, filters=filters, detectMoves=False)
+            if detectMoves:
+                _detectMoves(_rootOf(self))
+            return
+        if workers is None:
+            workers = int(conf.workers)
+        ignore = ignorerules.getRules(ignore)
+        hashcache.getCache()
+        pool = ThreadPool(workers) if workers > 1 else None
+        profile = profiling.begin(_profileTitle(self))
+        try:
+            pending, fileJobs, mergeJobs, touched = [], [], [], []
+            subFolders = [self]
+            while subFolders:
+                subFolders.pop().__refresh(ignore, pending, fileJobs, mergeJobs, touched,
+                                           recursive, filters, subFolders)
+            self.__compareLevels(ignore, pool.map if pool else map, pending, fileJobs, mergeJobs,
+                                 filters=filters)
+            if detectMoves:
+                _detectMoves(_rootOf(self), pool.map if pool else map)
+            if self._knowsExists('base'):
+                # the folders above and below may have changed with their children
+                folders = [itm for itm in self.iterSubItems() if itm.isDir()] if recursive else []
+                for itm in reversed(folders):
+                    itm.__decideMerge()
+                itm = self
+                while itm is not None:
+                    itm.__decideMerge()
+                    itm = itm.parent
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+            hashcache.flush()
+            profiling.end(profile)
+        # the new children are all compared now
+        for itm in reversed(touched):
+            itm.children.sort()
+            if len(_sidesOf(itm.status)) == 2:
+                itm.status = itm.__diffOrSame()
+            itm.updateChildrenUI()
+
+    def __refresh(self, ignore, pending, fileJobs, mergeJobs, touched, recursive, filters,
+                  subFolders):
+        """Patches the children of this folder according to the file system.
+        New items are put to <pending> and <fileJobs> to be compared,
+        files to compare with the base again to <mergeJobs>, folders that
+        got new children to <touched>, and sub folders to patch as well if
+        <recursive> to <subFolders>."""
+        sides = _sidesOf(self.status)
+        withBase = self._knowsExists('base')
+        # items whose three-way status is to be decided again
+        toMerge = []
+        relName = _relNameOf(self)
+        listed = not filters or filters.lists(relName)
+        entries = {}
+        for side in sides:
+            fullName = getattr(self, side + 'FullName')
+            try:
+                sig = _signature(_stat(fullName))
+            except OSError, e:
+                _warnUnknown(fullName, e)
+                self._forgetExists()
+                return
+            self._setExists(side, True)
+            if not listed:
+                entries[side] = {}
+            elif sig == getattr(self, side + 'Sig'):
+                # same entries as last time
+                entries[side] = _statEntries(fullName,
+                        [itm.name for itm in self.children if side in _sidesOf(itm.status)])
+            else:
+                entries[side] = _scanDir(fullName, ignore, relName)
+                if entries[side] is None:
+                    return
+            setattr(self, side + 'Sig', sig)
+        if filters:
+            filters.apply([entries[side] for side in sides])
+
+        # where each (name, isDir) is found now
+        found = {}
+        for side in sides:
+            folders, files = _splitEntries(entries[side])
+            for key in itertools.chain(((name, True) for name in folders),
+                                       ((name, False) for name in files)):
+                found[key] = found.get(key, ()) + (side, )
+
+        # items with these statuses are always compared again
+        redo = (None, STATUS_UNKNOWN_COMMON, STATUS_UNKNOWN_LEFT, STATUS_UNKNOWN_RIGHT)
+        for itm in list(self.children):
+            key = (itm.name, itm.isDir())
+            itmSides = found.pop(key, None)
+            if itmSides != _sidesOf(itm.status) or itm.status in redo:
+                # gone, or to be compared again from scratch
+                if itmSides:
+                    found[key] = itmSides
+                itm.status = None
+                self._removeChildren((itm, ))
+                continue
+            changed = False
+            for side in itmSides:
+                sig = _signature(entries[side][itm.name])
+                itm._setExists(side, sig is not None)
+                changed = changed or sig != getattr(itm, side + 'Sig')
+                if itm.isFile():
+                    setattr(itm, side + 'Sig', sig)
+            if itm.isDir():
+                # deferred folders are compared from scratch when loaded
+                if recursive and not itm.isDeferred():
+                    subFolders.append(itm)
+                continue
+            if changed and len(itmSides) == 2:
+                lStat, rStat = entries['left'][itm.name], entries['right'][itm.name]
+                if lStat is not None and rStat is not None:
+                    fileJobs.append((itm, lStat, rStat))
+                else:
+                    itm.status = STATUS_UNKNOWN_COMMON
+            if withBase and (changed or itm.mergeStatus is None):
+                toMerge.append(itm)
+
+        # whatever left in found is new
+        if found:
+            touched.append(self)
+        for (name, isDir), itmSides in found.iteritems():
+            itemType = DirectoryDataItem if isDir else FileDataItem
+            if len(itmSides) == 2:
+                self.__initCommonSubItems((name, ), itemType,
+                        entries['left'], entries['right'], pending, fileJobs)
+            else:
+                side = itmSides[0]
+                self.__initOneSideSubItems((name, ), itemType, side, entries[side], pending)
+            if withBase:
+                toMerge.append(self.getChild(name, isDir))
+
+        if toMerge:
+            bEntries = _scanDir(self.baseFullName, ignore, relName) if self.baseExists else {}
+            if bEntries is not None:
+                self.__initBase(toMerge, entries.get('left'), entries.get('right'), bEntries,
+                                mergeJobs)
+
+    def _settle(self, removed=()):
+        """Removes the children in <removed>, which have no status any more,
+        then decides the status of this folder again."""
+        if removed:
+            self._removeChildren(removed)
+        oldStatus, oldMerge = self.status, self.mergeStatus
+        if self._knowsExists('base'):
+            self.mergeStatus = self.__mergeOf()
         # decide self status. children all have correct status at this moment
         if self.leftExists and self.rightExists:
             self.status = self.__diffOrSame()
@@ -294,8 +1175,12 @@ class DirectoryDataItem(DataItem):
             self.status = STATUS_LEFT_ONLY
         elif self.rightExists:
             self.status = STATUS_RIGHT_ONLY
+        if self.mergeStatus != oldMerge and self.status is oldStatus:
+            # nothing told the folders above yet
+            self._notify(propagateStatus and self.parent)
 
     # operations
+    @_batched
     def copyTo(self, srcSide, destSide):
         copyCmd = shutil.copytree
         src, dest = self._precopy(srcSide, destSide)
@@ -310,27 +1195,58 @@ class DirectoryDataItem(DataItem):
             # copy the whole directory
             # only when the dest directory is not there
             copyCmd(src, dest)
-            for each in self.children:
+            _setAncestorsExist(self, destSide)
+            self._setExists(destSide, True)
+            for each in self.iterSubItems():
+                each._setExists(destSide, True)
+                if each.mergeStatus is not None:
+                    each.mergeStatus = MERGE_SAME
                 each.status = STATUS_COMMON_SAME
         else:
-            # if not, call copyTo on each children
-            for each in self.children:
-                each.copyTo(srcSide, destSide)
+            # if not, copy what's in it; the folders found on both sides
+            # are walked here rather than copied one inside another
+            folders, stack = [], list(self.children)
+            while stack:
+                each = stack.pop()
+                if each.isDir() and getattr(each, destSide + 'Exists'):
+                    if each._precopy(srcSide, destSide)[0]:
+                        folders.append(each)
+                        stack.extend(each.children)
+                else:
+                    each.copyTo(srcSide, destSide)
+            # the deepest first, as each decides from the ones in it
+            for each in reversed(folders):
+                each._settle()
         propagateStatus = oldPropagateStatus
-        self.status = self.__diffOrSame()
+        self._settle()
 
+    @_batched
     def delete(self, side):
         delCmd = shutil.rmtree
         self._delete(delCmd, side)
+        if not getattr(self, side + 'Exists'):
+            # everything in it is gone along with it
+            for each in self.iterSubItems():
+                each._setExists(side, False)
         global propagateStatus
         oldPropagateStatus = propagateStatus
         # in _delete, we already decided self's status
         # so we turn off its children's status propagation here
         propagateStatus = False
-        for each in self.children:
-            each.delete(side)
+        # from the top down, one after another rather than one inside another
+        for each in list(self.iterSubItems()):
+            each._delete(shutil.rmtree if each.isDir() else os.remove, side)
         propagateStatus = oldPropagateStatus
 
+    def iterSubItems(self):
+        """Yields all DataItems under this one, recursively."""
+        stack = list(self.children)
+        while stack:
+            itm = stack.pop()
+            yield itm
+            if itm.isDir():
+                stack.extend(itm.children)
+
     def browse(self, side):
         if sys.platform == 'win32':
             if getattr(self, side + 'Exists'):
@@ -354,10 +1270,19 @@ class DirectoryDataItem(DataItem):
         return False
 
 class FileDataItem(DataItem):
-    def __init__(self, name, leftLocation, rightLocation):
-        super(FileDataItem, self).baseinit(name, leftLocation, rightLocation)
-        if (self.leftExists and not path.isfile(self.leftFullName)) or \
-           (self.rightExists and not path.isfile(self.rightFullName)):
+    # firstDiffOffset: where the content comparison found the files differ,
+    # None if not known
+    # counterpart: where the file with the same content is found on the
+    # other side, as given by _relNameOf, if this one is moved
+    __slots__ = ('firstDiffOffset', 'counterpart')
+
+    def __init__(self, name, leftLocation, rightLocation, validate=True, parent=None):
+        self.firstDiffOffset = None
+        self.counterpart = None
+        super(FileDataItem, self).baseinit(name, leftLocation, rightLocation, parent)
+        if validate and \
+           ((self.leftExists and not _hasMode(self.leftFullName, stat.S_ISREG)) or \
+            (self.rightExists and not _hasMode(self.rightFullName, stat.S_ISREG))):
             raise InvalidMethodInvocationError('FileDataItem.__init__ should be invoked with files.')
 
     # operations
@@ -367,11 +1292,32 @@ class FileDataItem(DataItem):
         if not src or not dest:
             return
         destLocation = getattr(self, destSide + 'Location')
-        if not path.exists(destLocation):
+        if not (self.parent._exists(destSide) if self.parent else path.exists(destLocation)):
             os.makedirs(destLocation)
         copyCmd(src, dest)
+        _setAncestorsExist(self, destSide)
+        self._setExists(destSide, True)
+        self.firstDiffOffset = None
+        if self.mergeStatus is not None:
+            self.mergeStatus = MERGE_SAME
         self.status = STATUS_COMMON_SAME
 
+    def _unpair(self):
+        """Called when this file isn't moved any more; neither is its
+        counterpart then."""
+        counterpart, self.counterpart = self.counterpart, None
+        if counterpart is None:
+            return
+        other = _itemAt(_rootOf(self), counterpart, False)
+        if other is not None and other.status in _MOVED_STATUSES \
+           and other.counterpart == _relNameOf(self):
+            other.status = STATUS_LEFT_ONLY if other.status is STATUS_LEFT_MOVED \
+                           else STATUS_RIGHT_ONLY
+
+    def pack(self):
+        return (self.name, _STATUS_INDEX[self.status], None,
+                self.leftSig, self.rightSig, self.firstDiffOffset) + self._packBase()
+
     def delete(self, side):
         delCmd = os.remove
         self._delete(delCmd, side)
@@ -405,42 +1351,567 @@ class FileDataItem(DataItem):
     def isFile(self):
         return True
 
+class CompareProgress(object):
+    """Follows a comparison running on another thread.
+    The comparison updates the counters: entries listed, bytes of files
+    compared, and top level items done out of total. Folders compared in
+    other processes are only counted as top level items.
+    cancel() may be called from any thread; the comparison then stops
+    with CompareCancelledError at its next step."""
+
+    def __init__(self):
+        self.entries = 0
+        self.bytes = 0
+        self.done = 0
+        self.total = 0
+        self.cancelled = False
+        self.started = time.time()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def check(self):
+        if self.cancelled:
+            raise CompareCancelledError('comparison cancelled')
+
+    def itemDone(self, itm):
+        """Called on the comparing thread when the subtree of top level
+        item <itm> is known."""
+        self.done += 1
+        self.onItemDone(itm)
+
+    def onItemDone(self, itm):
+        """Listener, does nothing by default."""
+        pass
+
+    def eta(self):
+        """Estimates the seconds left from the top level items done so far,
+        or returns None if nothing is done yet."""
+        if not self.done:
+            return None
+        elapsed = time.time() - self.started
+        return elapsed * (self.total - self.done) / self.done
+
+class WalkFilter(object):
+    """Leaves items out of a comparison while the trees are walked, judging
+    by the stat results taken when listing: files by size and modified
+    time, and everything more than <maxDepth> levels below the compared
+    folders. Folders on the last level are shown but never listed; common
+    ones are STATUS_COMMON_PENDING, as nothing is known of what's in them,
+    and so are the folders above unless found different.
+    None means no limit; <newerThan> and <olderThan> are times like
+    time.time(). A file is kept if it's kept on either side."""
+
+    def __init__(self, minSize=None, maxSize=None, newerThan=None, olderThan=None,
+                 maxDepth=None):
+        self.minSize = minSize
+        self.maxSize = maxSize
+        self.newerThan = newerThan
+        self.olderThan = olderThan
+        self.maxDepth = maxDepth
+
+    def __nonzero__(self):
+        return any(value is not None for value in self.__dict__.itervalues())
+
+    def lists(self, relName):
+        """Tells if the folder at <relName> in the compared tree is listed."""
+        if self.maxDepth is None:
+            return True
+        depth = len(relName.replace(os.sep, '/').split('/')) if relName else 0
+        return depth < self.maxDepth
+
+    def keeps(self, st):
+        """Tells if an entry with the stat result <st> is kept; entries
+        that are not files, or can't be stat'ed, always are."""
+        if st is None or not stat.S_ISREG(st.st_mode):
+            return True
+        return (self.minSize is None or st.st_size >= self.minSize) \
+           and (self.maxSize is None or st.st_size <= self.maxSize) \
+           and (self.newerThan is None or st.st_mtime >= self.newerThan) \
+           and (self.olderThan is None or st.st_mtime <= self.olderThan)
+
+    def apply(self, listings):
+        """Drops the entries left out from the listings of the same folder
+        on each side, dicts returned by _scanDir or None, in place."""
+        listings = [listing for listing in listings if listing]
+        dropped = set()
+        for listing in listings:
+            dropped.update(name for name, st in listing.iteritems() if not self.keeps(st))
+        for name in dropped:
+            if not any(self.keeps(listing[name]) for listing in listings if name in listing):
+                for listing in listings:
+                    listing.pop(name, None)
+
+class _Lazy(object):
+    """What the folders deferred by a lazy comparison are compared with."""
+
+    def __init__(self, ignore, filters, workers):
+        self.ignore = ignore
+        self.filters = filters
+        self.workers = workers
+        # the prefetch.Prefetcher told about deferred folders, if any
+        self.prefetcher = None
+
+class _Deferred(object):
+    """Children loader of a folder deferred by a lazy comparison."""
+    __slots__ = ('lazy', 'side', 'prefetched')
+
+    def __init__(self, lazy, side):
+        self.lazy = lazy
+        # None for common folders
+        self.side = side
+        # results of the jobs of its level run ahead, by (function, args)
+        self.prefetched = None
+
+    def __call__(self, folder):
+        folder._compareDeferred(self)
+
 class CompareSession(object):
-    def __init__(self, leftPath='', rightPath='', ignore=()):
+    # sessions saved before there were filters, or bases, have none
+    filters = None
+    basePath = None
+
+    def __init__(self, leftPath='', rightPath='', ignore=(), filters=None, basePath=None):
         self.leftPath = leftPath
         self.rightPath = rightPath
         self.ignore = ignore
+        self.filters = filters
+        # the tree both sides came from, for a three-way comparison
+        self.basePath = basePath
 
 ##############################
 # helpers                    #
 ##############################
-def _isUnknown(name):
-    """Used to decide whether a folder/file is comparable.
+def _scanDir(dirName, ignore=(), relName=''):
+    """Lists a folder and stats every entry in it, once each.
+    Entries matching <ignore>, patterns or IgnoreRules (see ignorerules.py),
+    are left out; <relName> is where the folder is in the compared tree,
+    which the patterns are relative to.
     Returns:
-            True if unknown
-            False if not"""
+            None if the folder is unknown (can't be listed)
+            a dict mapping short names to os.stat results otherwise;
+            the result is None for entries that can't be stat'ed"""
+    profile = profiling.current
+    started = time.time() if profile else None
+    rules = ignorerules.getRules(ignore)
+    m, inManifest = _inManifest(dirName)
+    if m:
+        entries = m.listDir(inManifest, rules, relName)
+        if profile:
+            profile.add('list', time.time() - started, dirName,
+                        dirsListed=1, entries=len(entries or ()))
+        return entries
     try:
-        os.stat(name)
-        if(path.isdir(name)):
-            os.listdir(name)
+        # listed first, then stat'ed, so that profiles tell one from the other
+        listing = list(scandir(dirName)) if scandir else os.listdir(dirName)
+    except OSError, e:
+        _warnUnknown(dirName, e)
+        return None
+    if profile:
+        listed = time.time()
+        profile.add('list', listed - started, dirName, dirsListed=1, entries=len(listing))
+    entries = {}
+    if scandir:
+        for entry in listing:
+            # ignored folders are never stat'ed, let alone listed
+            if rules and rules.ignores(relName, entry.name, entry.is_dir()):
+                continue
+            try:
+                entries[entry.name] = entry.stat()
+            except OSError, e:
+                _warnUnknown(entry.path, e)
+                entries[entry.name] = None
+    else:
+        for name in listing:
+            fullName = path.join(dirName, name)
+            try:
+                st = os.stat(fullName)
+            except OSError, e:
+                st = None
+            if rules and rules.ignores(relName, name, st is not None and stat.S_ISDIR(st.st_mode)):
+                continue
+            if st is None:
+                _warnUnknown(fullName, e)
+            entries[name] = st
+    if profile:
+        profile.add('stat', time.time() - listed, dirName, stats=len(entries))
+    return entries
+
+# manifests in use in place of folders, by file name
+_manifests = {}
+
+def useManifest(location):
+    """If <location> is a manifest file, everything under it is read from
+    the manifest from now on. Returns whether it is one."""
+    if not location or not path.isfile(location) or not manifest.isManifest(location):
         return False
-    except Exception, e:
-        logging.warn('unknown file/folder found: ' + name + ', with exception ' + str(e))
-        return True
+    m = _manifests.get(location)
+    if m is None or m.mtime != os.stat(location).st_mtime:
+        _manifests[location] = manifest.Manifest(location)
+    return True
 
-def _filter(filelist, skip):
-    return list(itertools.ifilterfalse(skip.__contains__, filelist))
+def isComparable(location):
+    """Tells if <location> is a folder or a manifest, which can be compared."""
+    return path.isdir(location) or useManifest(location)
 
-# TODO command line usage: generate report
-# K:\DirCompare\trunk\src>python model.py ..\..\sandbox\leftDir ..\..\sandbox\rightDir
-if __name__ == '__main__':
-    DataItem.updateUI = lambda self: None
+def _inManifest(fullName):
+    """Returns (Manifest, relName) if <fullName> is found in a manifest in
+    use, (None, None) otherwise."""
+    for fileName, m in _manifests.iteritems():
+        if fullName.startswith(fileName):
+            rest = fullName[len(fileName):]
+            if not rest or rest[0] == os.sep:
+                return m, rest.strip(os.sep).replace(os.sep, '/')
+    return None, None
+
+def _stat(fullName):
+    """os.stat, or what a manifest has for <fullName>."""
+    m, relName = _inManifest(fullName)
+    return m.stat(relName) if m else os.stat(fullName)
+
+def _pathExists(fullName):
+    try:
+        _stat(fullName)
+    except OSError:
+        return False
+    return True
+
+def _hasMode(fullName, test):
+    """Tells if <fullName> exists and its mode passes <test>, e.g. stat.S_ISDIR."""
+    try:
+        return test(_stat(fullName).st_mode)
+    except OSError:
+        return False
+
+# (known, exists) bits of DataItem existence on each side
+_EXISTENCE_BITS = {'left': (1, 2), 'right': (4, 8), 'base': (16, 32)}
+
+def _otherSide(side):
+    return 'right' if side == 'left' else 'left'
+
+def _setAncestorsExist(itm, side):
+    """Records that the folders containing itm exist on the given side."""
+    itm = itm.parent
+    while itm is not None:
+        itm._setExists(side, True)
+        itm = itm.parent
+
+def _intern(name):
+    """Names are interned, so that a name found on both sides, or in many
+    folders, is kept only once."""
+    return intern(name) if type(name) is str else name
+
+def _statEntries(dirName, names):
+    """Stats the given entries of a folder without listing it.
+    Returns a dict like _scanDir does."""
+    m, relName = _inManifest(dirName)
+    if m:
+        return m.statEntries(relName, names)
+    profile = profiling.current
+    started = time.time() if profile else None
+    entries = {}
+    for name in names:
+        fullName = path.join(dirName, name)
+        try:
+            entries[name] = os.stat(fullName)
+        except OSError, e:
+            _warnUnknown(fullName, e)
+            entries[name] = None
+    if profile:
+        profile.add('stat', time.time() - started, dirName, stats=len(entries))
+    return entries
+
+_SIGNATURE = struct.Struct('qdQ')
+def _signature(st):
+    """The part of an os.stat result telling if a file/folder has changed:
+    its size, modified time and inode, packed into a short string."""
+    if st is None:
+        return None
+    return _SIGNATURE.pack(st.st_size, st.st_mtime, st.st_ino)
+
+def _relNameOf(itm):
+    """Returns where a DataItem is in the compared tree, joined by '/'.
+    The root of a shard compared in another process is named after where
+    it is, see _compareShard."""
+    names = []
+    while itm is not None:
+        names.append(itm.name)
+        itm = itm.parent
+    return '/'.join(reversed([name for name in names if name]))
+
+def _itemAt(rootDataItem, relName, isDir):
+    """Returns the DataItem found at <relName>, as given by _relNameOf,
+    or None."""
+    itm = rootDataItem
+    names = relName.split('/')
+    for i, name in enumerate(names):
+        itm = itm.getChild(name, isDir or i < len(names) - 1)
+        if itm is None:
+            return None
+    return itm
+
+def _rootOf(itm):
+    while itm.parent is not None:
+        itm = itm.parent
+    return itm
+
+def _depthOf(itm):
+    depth = 0
+    while itm.parent is not None:
+        itm, depth = itm.parent, depth + 1
+    return depth
+
+def _sidesOf(status):
+    """Returns the sides where an item with the given status is found."""
+    if status in (STATUS_LEFT_ONLY, STATUS_UNKNOWN_LEFT, STATUS_LEFT_MOVED):
+        return ('left', )
+    elif status in (STATUS_RIGHT_ONLY, STATUS_UNKNOWN_RIGHT, STATUS_RIGHT_MOVED):
+        return ('right', )
+    else:
+        return ('left', 'right')
+
+def _splitEntries(entries):
+    """Seperates folders from files in the result of _scanDir.
+    Entries that can't be stat'ed are considered files."""
+    folders = set(name for name, st in entries.iteritems()
+                  if st is not None and stat.S_ISDIR(st.st_mode))
+    return folders, set(entries).difference(folders)
+
+def _scanPair(args):
+    """Lists the given folders. None is given for a folder that's not there.
+    <relName> is where they are in the compared trees, <filters> a
+    WalkFilter or None."""
+    lName, rName, ignore, relName, filters = args
+    if filters and not filters.lists(relName):
+        return tuple({} if name else None for name in (lName, rName))
+    listings = tuple(_scanDir(name, ignore, relName) if name else None for name in (lName, rName))
+    if filters:
+        filters.apply(listings)
+    return listings
+
+def _scanArgs(itm, side, ignore, filters):
+    """Returns the _scanPair job listing a folder on the given side, or
+    both when <side> is None."""
+    return (itm.leftFullName if side != 'right' else None,
+            itm.rightFullName if side != 'left' else None,
+            ignore, _relNameOf(itm), filters)
+
+def _baseScanName(itm):
+    """Returns the base folder to list along with <itm>: its full name,
+    '' if it's not in the base, or None if the base isn't looked at."""
+    if not itm._knowsExists('base'):
+        return None
+    return itm.baseFullName if itm.baseExists else ''
+
+def _scanWithBase(args):
+    """Lists the given folders like _scanPair does, then the base folder.
+    Returns (lEntries, rEntries, bEntries); bEntries is {} for a folder
+    not in the base, and None if it can't be listed."""
+    scanArgs, bName = args
+    lName, rName, ignore, relName, filters = scanArgs
+    bEntries = {}
+    if bName and (not filters or filters.lists(relName)):
+        bEntries = _scanDir(bName, ignore, relName)
+    return _scanPair(scanArgs) + (bEntries, )
+
+def _scanLevel(map, pending, ignore, filters):
+    """Lists the folders in <pending>, [(item, side)], through <map>, the
+    base folders along with them if there are. Returns a list of
+    (lEntries, rEntries, bEntries); bEntries is None when the base is not
+    looked at."""
+    scanArgs = [_scanArgs(itm, side, ignore, filters) for itm, side in pending]
+    bNames = [_baseScanName(itm) for itm, side in pending]
+    if any(bName is not None for bName in bNames):
+        return map(_scanWithBase, zip(scanArgs, bNames))
+    return [listings + (None, ) for listings in map(_scanPair, scanArgs)]
+
+def _mapPrefetched(prefetched, func, jobs):
+    """Maps <func> over <jobs>, taking the results found in <prefetched>,
+    by (func, args), instead of running them again."""
+    return [prefetched[(func, args)] if (func, args) in prefetched else func(args)
+            for args in jobs]
+
+def _compareShard(args):
+    """Compares a common folder in a worker process.
+    Returns the result packed by DirectoryDataItem.pack."""
+    relName, leftLocation, rightLocation, baseLocation, ignore, workers, filters = args
+    itm = DirectoryDataItem(relName, leftLocation, rightLocation, validate=False,
+                            baseLocation=baseLocation)
+    # moves are looked for in the whole tree once it's grafted
+    itm.compare(ignore, workers, processes=1, filters=filters, detectMoves=False)
+    return itm.pack()
+
+def _profileTitle(itm):
+    """Names the comparison of <itm> in its profile."""
+    title = '%s <> %s' % (itm.leftFullName, itm.rightFullName)
+    if itm.baseFullName is not None:
+        title += ' (base %s)' % itm.baseFullName
+    return title
+
+def _detectMoves(rootDataItem, map=map, callAfter=None):
+    """Marks moved files, see moves.py. Files are read on the calling
+    thread; the tree is changed through <callAfter>, e.g. wx.CallAfter,
+    if given."""
+    # moves.py needs this module loaded first
+    import moves
+    profile = profiling.current
+    if profile:
+        found = profile.call('moves', None, moves.find, rootDataItem, map)
+    else:
+        found = moves.find(rootDataItem, map)
+    if callAfter:
+        callAfter(moves.apply, *found)
+    else:
+        moves.apply(*found)
+
+def _decideMerges(map, jobs, shallow):
+    """Decides the three-way status of the files in <jobs>, put there by
+    DirectoryDataItem.__initBase, once they are compared between the
+    sides. Files that differ are compared with the base through <map>."""
+    todo = []
+    for job in jobs:
+        status = job[0].status
+        if status is STATUS_COMMON_SAME:
+            job[0]._setMergeStatus(MERGE_SAME)
+        elif status in _MERGEABLE_STATUSES:
+            todo.append(job)
+        else:
+            job[0]._setMergeStatus(None)
+    results = map(_mergeFilePair,
+            [(itm.leftFullName, itm.rightFullName, itm.baseFullName, lStat, rStat, bStat, shallow)
+             for itm, lStat, rStat, bStat in todo])
+    for (itm, lStat, rStat, bStat), mergeStatus in zip(todo, results):
+        itm._setMergeStatus(mergeStatus)
+
+def _mergeFilePair(args):
+    profile = profiling.current
+    if profile:
+        return profile.call('compare', path.dirname(args[2] or args[0] or args[1]),
+                            _mergeFiles, *args, filesCompared=1)
+    return _mergeFiles(*args)
+
+def _mergeFiles(lName, rName, bName, lStat, rStat, bStat, shallow):
+    """Tells which side changed a file that differs between the sides.
+    The stat of a side, or of the base, the file is not on is None."""
+    try:
+        if bStat is None:
+            baseIsLeft, baseIsRight = lStat is None, rStat is None
+        else:
+            # the sides differ, so the base is the same as one of them at most
+            baseIsLeft = lStat is not None and _cmpFiles(bName, lName, bStat, lStat, shallow)[0]
+            baseIsRight = not baseIsLeft and rStat is not None and \
+                          _cmpFiles(bName, rName, bStat, rStat, shallow)[0]
+    except (IOError, OSError), e:
+        _warnUnknown(bName, e)
+        return None
+    if baseIsLeft:
+        return MERGE_CHANGED_RIGHT
+    elif baseIsRight:
+        return MERGE_CHANGED_LEFT
+    return MERGE_CONFLICT
+
+def _cmpFilePair(args):
+    profile = profiling.current
+    if profile:
+        return profile.call('compare', path.dirname(args[0]), _cmpFiles, *args, filesCompared=1)
+    return _cmpFiles(*args)
+
+def _cmpFiles(f1, f2, s1, s2, shallow):
+    """Does what filecmp.cmp does, using stat results taken during the walk.
+    Returns (same, offset); offset is where the files are found to differ,
+    or None if same or not known."""
+    if not stat.S_ISREG(s1.st_mode) or not stat.S_ISREG(s2.st_mode):
+        return False, None
+    if shallow and s1.st_size == s2.st_size and s1.st_mtime == s2.st_mtime:
+        return True, None
+    if s1.st_size != s2.st_size:
+        return False, None
+    if isinstance(s1, manifest.Entry) or isinstance(s2, manifest.Entry):
+        # only the digest is known on that side
+        return _digestOf(f1, s1) == _digestOf(f2, s2), None
+    cache = hashcache.getCache()
+    if cache:
+        d1, d2 = cache.lookup(f1, s1), cache.lookup(f2, s2)
+        if d1 is not None and d2 is not None:
+            return d1 == d2, None
+        hashes = hashcache.newHash(), hashcache.newHash()
+    else:
+        hashes = None
+    offset = _firstDiff(f1, f2, s1.st_size, int(conf.blockSize), hashes)
+    if offset is None and hashes:
+        # read all the way through, so the digests come for free
+        cache.store(f1, s1, hashes[0].hexdigest())
+        cache.store(f2, s2, hashes[1].hexdigest())
+    return offset is None, offset
+
+def _digestOf(fileName, st):
+    if isinstance(st, manifest.Entry):
+        return st.digest
+    return hashcache.digestOf(fileName, st)
+
+def _firstDiff(f1, f2, size, blockSize, hashes=None):
+    """Compares two files of the given size, and returns the offset of the
+    first differing byte found, or None if they're same.
+    The first and the last blocks are compared before everything else, so
+    differences near either end are found without reading the whole files;
+    a difference found in the last block is the first one in that block.
+    If given, the pair of hash objects are updated with all the contents,
+    unless a difference is found."""
+    fp1, fp2 = open(f1, 'rb'), open(f2, 'rb')
+    # bytes read from each file
+    read = 0
     try:
-        leftPath, rightPath = sys.argv[1], sys.argv[2]
-    except IndexError, e:
-        print("Usage: python model.py leftPath rightPath")
-        sys.exit(1)
-    rootDataItem = DirectoryDataItem('', leftPath, rightPath)
-    rootDataItem.compare()
-    print(rootDataItem)
+        probes = [0]
+        if size > blockSize:
+            probes.append(size - blockSize)
+        for start in probes:
+            fp1.seek(start)
+            fp2.seek(start)
+            b1, b2 = fp1.read(blockSize), fp2.read(blockSize)
+            read += len(b1)
+            if b1 != b2:
+                return start + _firstDiffInBlock(b1, b2)
+        if size <= blockSize and not hashes:
+            return None
+        fp1.seek(0)
+        fp2.seek(0)
+        start = 0
+        while True:
+            b1, b2 = fp1.read(blockSize), fp2.read(blockSize)
+            read += len(b1)
+            if b1 != b2:
+                return start + _firstDiffInBlock(b1, b2)
+            if not b1:
+                return None
+            if hashes:
+                hashes[0].update(b1)
+                hashes[1].update(b2)
+            start += len(b1)
+    finally:
+        fp1.close()
+        fp2.close()
+        if profiling.current:
+            profiling.current.add(None, 0, bytesRead=2 * read)
 
+def _firstDiffInBlock(b1, b2):
+    """Returns the offset of the first differing byte of two different strings."""
+    lo, hi = 0, min(len(b1), len(b2))
+    # bisect by comparing slices, which is done in C
+    while hi - lo > 64:
+        mid = (lo + hi) // 2
+        if b1[lo:mid] == b2[lo:mid]:
+            lo = mid
+        else:
+            hi = mid
+    while lo < hi and b1[lo] == b2[lo]:
+        lo += 1
+    return lo
+
+def _warnUnknown(name, e):
+    logging.warn('unknown file/folder found: ' + name + ', with exception ' + str(e))
+
+# command line usage: see report.py
+# K:\DirCompare\trunk\src>python model.py ..\..\sandbox\leftDir ..\..\sandbox\rightDir
+if __name__ == '__main__':
+    import report
+    sys.exit(report.main())
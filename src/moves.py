@@ -0,0 +1,184 @@
+#    -*- coding: utf-8 -*-
+#    Advanced directory compare tool in Python.
+#
+#    Copyright (C) 2008, 2009  Pan Xingzhi
+#    http://code.google.com/p/dircompare/
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Finds files moved or renamed between the two sides.
+
+A file moved to another folder, or renamed, on one side shows up as a file
+only found on the left plus one only found on the right. Such pairs are
+marked STATUS_LEFT_MOVED and STATUS_RIGHT_MOVED instead, each knowing the
+other as its counterpart, so that a sync can move the file instead of
+copying all of it again.
+
+One side files are bucketed by size first, and only the buckets holding
+files of both sides are looked into: their files are told apart by the
+digest of their first PARTIAL_SIZE bytes, then by the digest of their
+whole content, through the hash cache. Nothing is ever compared pairwise,
+so millions of one side files cost a few dict lookups each, and only files
+of the same size as some file on the other side are read at all."""
+
+from __future__ import print_function
+import hashcache
+import model
+
+# bytes digested at the start of files of the same size, to tell most apart
+PARTIAL_SIZE = 64 * 1024
+# smaller files are never taken as moved; all empty files look the same
+MIN_SIZE = 1
+
+def detect(rootDataItem, map=map):
+    """Marks the one side files under <rootDataItem> whose content is found
+    on the other side under another name as moved, and the ones that were
+    moved and aren't any more as one side only again. Files are read
+    through <map>, which may run the jobs concurrently. Deferred folders
+    are not looked into. Returns the number of moved pairs."""
+    return apply(*find(rootDataItem, map))
+
+def find(rootDataItem, map=map):
+    """Finds what detect marks, without touching the tree, so it may run
+    on another thread than the one owning it. Returns (moved, pairs) to
+    give to apply: the files marked moved so far, and {id(file): (file,
+    counterpart)} of the pairs found."""
+    # one side files by size, on each side
+    bySize = ({}, {})
+    moved = []
+    stack = [rootDataItem]
+    while stack:
+        folder = stack.pop()
+        for itm in folder.children:
+            if itm.isDir():
+                if not itm.isDeferred():
+                    stack.append(itm)
+                continue
+            side = _ONE_SIDE.get(itm.status)
+            if side is None:
+                continue
+            if itm.status in _MOVED:
+                moved.append(itm)
+            sig = getattr(itm, _SIDES[side] + 'Sig')
+            size = model._SIGNATURE.unpack(sig)[0] if sig is not None else 0
+            if size >= MIN_SIZE:
+                bySize[side].setdefault(size, []).append(itm)
+
+    # [(key, (lefts, rights))], keyed by size, then digests
+    groups = [((length, ), (lefts, bySize[1][length]))
+              for length, lefts in bySize[0].iteritems() if length in bySize[1]]
+    done = []
+    # the start of a file on a manifest side can't be read
+    if not any(model._inManifest(location)[0]
+               for location in (rootDataItem.leftFullName, rootDataItem.rightFullName)):
+        groups = _split(groups, map, True)
+        # the start of a small file is all of it
+        done = [(key, items) for key, items in groups if key[0] <= PARTIAL_SIZE]
+        groups = [(key, items) for key, items in groups if key[0] > PARTIAL_SIZE]
+    groups = done + _split(groups, map, False)
+
+    pairs = {}
+    for key, (lefts, rights) in groups:
+        for left, right in _pairUp(lefts, rights):
+            pairs[id(left)] = (left, right)
+            pairs[id(right)] = (right, left)
+    return moved, pairs
+
+def apply(moved, pairs):
+    """Marks the pairs found by find, on the thread owning the tree.
+    Files whose status has changed since are left alone. Returns the
+    number of moved pairs."""
+    with model.batch():
+        # pairs that changed are taken apart first; taking one file apart
+        # takes its counterpart as well
+        for itm in moved:
+            pair = pairs.get(id(itm))
+            if itm.status in _MOVED and \
+               (pair is None or itm.counterpart != model._relNameOf(pair[1])):
+                itm.status = _ONLY[itm.status]
+        for itm, other in pairs.itervalues():
+            if itm.status in _MOVED_OF and other.status in _ONE_SIDE:
+                itm.counterpart = model._relNameOf(other)
+                itm.status = _MOVED_OF[itm.status]
+    return len(pairs) / 2
+
+##############################
+# helpers                    #
+##############################
+# which side, 0 for left, a one side status is found on
+_ONE_SIDE = {model.STATUS_LEFT_ONLY: 0, model.STATUS_LEFT_MOVED: 0,
+             model.STATUS_RIGHT_ONLY: 1, model.STATUS_RIGHT_MOVED: 1}
+_SIDES = ('left', 'right')
+_MOVED = model._MOVED_STATUSES
+_ONLY = {model.STATUS_LEFT_MOVED: model.STATUS_LEFT_ONLY,
+         model.STATUS_RIGHT_MOVED: model.STATUS_RIGHT_ONLY}
+_MOVED_OF = {model.STATUS_LEFT_ONLY: model.STATUS_LEFT_MOVED,
+             model.STATUS_RIGHT_ONLY: model.STATUS_RIGHT_MOVED}
+
+def _split(groups, map, partial):
+    """Splits [(key, (lefts, rights))] by the digest of the start of the
+    files if <partial>, of their whole content otherwise. Returns the new
+    groups still holding files of both sides; files that can't be read
+    are dropped."""
+    jobs = []
+    for key, items in groups:
+        for side, sideItems in enumerate(items):
+            for itm in sideItems:
+                jobs.append((key, side, itm))
+    digests = map(_digestJob, [(getattr(itm, _SIDES[side] + 'FullName'),
+                                getattr(itm, _SIDES[side] + 'Sig'), partial)
+                               for key, side, itm in jobs])
+    split = {}
+    for (key, side, itm), digest in zip(jobs, digests):
+        if digest is not None:
+            split.setdefault(key + (digest, ), ([], []))[side].append(itm)
+    return [(key, items) for key, items in split.iteritems() if items[0] and items[1]]
+
+def _digestJob(args):
+    fullName, sig, partial = args
+    try:
+        if partial:
+            fp = open(fullName, 'rb')
+            try:
+                h = hashcache.newHash()
+                h.update(fp.read(PARTIAL_SIZE))
+                return h.hexdigest()
+            finally:
+                fp.close()
+        st = model._stat(fullName)
+        if model._signature(st) != sig:
+            # changed since compared; refreshing tells what it is now
+            return None
+        return model._digestOf(fullName, st)
+    except (IOError, OSError), e:
+        model._warnUnknown(fullName, e)
+        return None
+
+def _pairUp(lefts, rights):
+    """Pairs up files of the same content, the ones with the same name
+    first, as they are moved rather than renamed; the rest in the order
+    of their paths. Returns [(left, right)]."""
+    pairs, byName = [], {}
+    for itm in sorted(rights, key=model._relNameOf, reverse=True):
+        byName.setdefault(itm.name, []).append(itm)
+    rest = []
+    for itm in sorted(lefts, key=model._relNameOf):
+        sameName = byName.get(itm.name)
+        if sameName:
+            pairs.append((itm, sameName.pop()))
+        else:
+            rest.append(itm)
+    others = sorted((itm for each in byName.itervalues() for itm in each), key=model._relNameOf)
+    pairs.extend(zip(rest, others))
+    return pairs
@@ -0,0 +1,156 @@
+#    -*- coding: utf-8 -*-
+#    Advanced directory compare tool in Python.
+#
+#    Copyright (C) 2008, 2009  Pan Xingzhi
+#    http://code.google.com/p/dircompare/
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compares the folders deferred by a lazy comparison ahead of the user.
+
+A lazily compared tree (see model.DirectoryDataItem.compare) only compares
+a folder when its children are first needed, e.g. when it's expanded. The
+Prefetcher lists and compares the next few levels below what's been opened
+in a background thread, breadth first, so that they're usually done by the
+time they're expanded, and the pending statuses above them get decided."""
+
+from __future__ import print_function
+import os.path as path
+import threading
+import Queue
+import logging
+from multiprocessing.pool import ThreadPool
+
+import configuration as conf
+import hashcache
+import model
+
+class Prefetcher(threading.Thread):
+    """Compares the deferred folders of a lazily compared DirectoryDataItem
+    tree, up to <levels> levels below the folders loaded otherwise.
+
+    Only the listings and the file comparisons are done in the background.
+    The results are handed through <callAfter>, e.g. wx.CallAfter, to the
+    thread owning the model, which loads the folder from them exactly like
+    it would have loaded it by itself. A folder loaded meanwhile is left
+    alone."""
+
+    def __init__(self, rootDataItem, levels=None, callAfter=None, workers=None):
+        super(Prefetcher, self).__init__()
+        self.setDaemon(True)
+        self.levels = int(conf.prefetchLevels) if levels is None else levels
+        self.callAfter = callAfter or (lambda func, *args: func(*args))
+        self.workers = int(conf.workers) if workers is None else workers
+        # (folder, loader, levels left below it, _scanPair job)
+        self.__queue = Queue.Queue()
+        self.__stopped = threading.Event()
+        # the lazy comparisons telling this about deferred folders
+        self.__lazies = set()
+        # levels left below the folder being loaded from prefetched results
+        self.__loading = None
+        # folders deferred before this was started
+        deferred, stack = [], [rootDataItem]
+        while stack:
+            itm = stack.pop()
+            for each in itm.children:
+                if not each.isDir():
+                    continue
+                loader = each.getChildrenLoader()
+                if isinstance(loader, model._Deferred):
+                    deferred.append((each, loader.side))
+                elif loader is None:
+                    stack.append(each)
+        self.queue(deferred)
+
+    def stop(self):
+        self.__stopped.set()
+        for lazy in self.__lazies:
+            if lazy.prefetcher is self:
+                lazy.prefetcher = None
+
+    def queue(self, folders):
+        """Queues folders just deferred, [(folder, side)]; called by the model
+        on its thread."""
+        levels = self.levels if self.__loading is None else self.__loading
+        if levels < 1 or self.__stopped.isSet():
+            return
+        for itm, side in folders:
+            loader = itm.getChildrenLoader()
+            lazy = loader.lazy
+            if lazy not in self.__lazies:
+                self.__lazies.add(lazy)
+                lazy.prefetcher = self
+            self.__queue.put((itm, loader, levels,
+                              model._scanArgs(itm, side, lazy.ignore, lazy.filters)))
+
+    def run(self):
+        pool = ThreadPool(self.workers) if self.workers > 1 else None
+        try:
+            while not self.__stopped.isSet():
+                try:
+                    job = self.__queue.get(timeout=0.5)
+                except Queue.Empty:
+                    hashcache.flush()
+                    continue
+                itm, loader, levels, scanArgs = job
+                if itm.getChildrenLoader() is not loader:
+                    # loaded meanwhile
+                    continue
+                try:
+                    results = _runLevel(scanArgs, pool.map if pool else map)
+                except Exception:
+                    logging.exception('prefetching %s failed' % model._relNameOf(itm))
+                    continue
+                self.callAfter(self.__apply, itm, loader, levels, results)
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+            hashcache.flush()
+
+    def __apply(self, itm, loader, levels, results):
+        """Loads a folder from prefetched results, on the model's thread."""
+        if self.__stopped.isSet() or itm.getChildrenLoader() is not loader:
+            return
+        parent = itm.parent
+        if parent is not None and parent.getChild(itm.name, True) is not itm:
+            # removed by a refresh
+            return
+        loader.prefetched = results
+        self.__loading = levels - 1
+        try:
+            itm.loadChildren()
+        finally:
+            self.__loading = None
+
+def _runLevel(scanArgs, map):
+    """Runs the jobs comparing a deferred folder one level deep, see
+    model.DirectoryDataItem._compareDeferred. Returns their results by
+    (function, args)."""
+    listings = model._scanPair(scanArgs)
+    results = {(model._scanPair, scanArgs): listings}
+    lName, rName = scanArgs[:2]
+    lEntries, rEntries = listings
+    if lEntries is None or rEntries is None:
+        # one side only, or unknown: nothing to compare
+        return results
+    shallow = int(conf.shallow)
+    lFiles, rFiles = model._splitEntries(lEntries)[1], model._splitEntries(rEntries)[1]
+    jobs = [(path.join(lName, name), path.join(rName, name), lEntries[name], rEntries[name],
+             shallow)
+            for name in lFiles.intersection(rFiles)
+            if lEntries[name] is not None and rEntries[name] is not None]
+    for args, result in zip(jobs, map(model._cmpFilePair, jobs)):
+        results[(model._cmpFilePair, args)] = result
+    return results
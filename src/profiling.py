@@ -0,0 +1,165 @@
+#    -*- coding: utf-8 -*-
+#    Advanced directory compare tool in Python.
+#
+#    Copyright (C) 2008, 2009  Pan Xingzhi
+#    http://code.google.com/p/dircompare/
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Where the time of a comparison goes: timers of its phases, counters, and
+the folders that took longest.
+
+With PROFILE set to 1 in the config file, or --profile given to a command
+line tool, every comparison is profiled. When it's done, a summary goes to
+the log, and the same as a line of JSON to PROFILE_FILE, if set.
+
+Phases:
+    list      listing folders
+    stat      stat'ing what's in them
+    compare   comparing files, with each other or with the base
+    build     creating DataItems from the listings
+    sort      sorting children
+    moves     looking for moved files
+Jobs run on worker threads are timed on each thread and summed up, so the
+phases may take longer than the comparison. Everything listed or compared
+while a comparison is profiled is counted along; what worker processes do
+(see PROCESSES) isn't.
+
+When nothing is profiled, the model only checks profiling.current once per
+folder listed and per file compared."""
+
+from __future__ import print_function
+import time
+import json
+import heapq
+import logging
+import operator
+import threading
+import multiprocessing
+
+import configuration as conf
+
+PHASES = ('list', 'stat', 'compare', 'build', 'sort', 'moves')
+COUNTERS = ('dirsListed', 'entries', 'stats', 'filesCompared', 'bytesRead')
+# number of the slowest folders reported
+SLOWEST = 10
+
+# the Profile of the comparison going on, if it's profiled
+current = None
+
+class Profile(object):
+    """Timers and counters of one comparison. Updated from any thread."""
+
+    def __init__(self, title=''):
+        self.title = title
+        self.times = dict.fromkeys(PHASES, 0.0)
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        # seconds spent listing each folder and comparing the files in it,
+        # by full name
+        self.folders = {}
+        self.started = time.time()
+        self.elapsed = None
+        self.lock = threading.Lock()
+
+    def add(self, phase, seconds, folder=None, **counts):
+        """Adds <seconds> to <phase>, and to <folder> if given, and the
+        keyword arguments to the counters of the same names."""
+        with self.lock:
+            if phase is not None:
+                self.times[phase] += seconds
+            for name, n in counts.iteritems():
+                self.counts[name] += n
+            if folder is not None:
+                self.folders[folder] = self.folders.get(folder, 0.0) + seconds
+
+    def call(self, phase, folder, func, *args, **counts):
+        """Returns func(*args), adding the time it takes like add does."""
+        started = time.time()
+        try:
+            return func(*args)
+        finally:
+            self.add(phase, time.time() - started, folder, **counts)
+
+    def stop(self):
+        self.elapsed = time.time() - self.started
+
+    def slowest(self, count=SLOWEST):
+        """Returns [(full name, seconds)] of the <count> slowest folders."""
+        return heapq.nlargest(count, self.folders.iteritems(), key=operator.itemgetter(1))
+
+    def summary(self):
+        """Returns the summary written as JSON."""
+        return {'title': self.title,
+                'started': self.started,
+                'elapsed': self.elapsed,
+                'phases': dict(self.times),
+                'counts': dict(self.counts),
+                'slowestFolders': [[name, seconds] for name, seconds in self.slowest()]}
+
+    def log(self):
+        logging.info('profile of %s: %.3f s' % (self.title, self.elapsed or 0))
+        logging.info('  ' + ', '.join('%s %.3f s' % (phase, self.times[phase])
+                                      for phase in PHASES))
+        logging.info('  ' + ', '.join('%s %d' % (name, self.counts[name]) for name in COUNTERS))
+        for name, seconds in self.slowest():
+            logging.info('  slow folder: %s %.3f s' % (name, seconds))
+
+    def write(self, fileName):
+        """Appends the summary to <fileName>, as one line of JSON."""
+        fp = open(fileName, 'ab')
+        try:
+            fp.write(json.dumps(self.summary(), sort_keys=True) + '\n')
+        finally:
+            fp.close()
+
+def begin(title):
+    """Starts profiling a comparison, if PROFILE is on and no comparison
+    is profiled already. Returns the Profile, to be given to end, or None."""
+    global current
+    if current is not None or not int(conf.profile):
+        return None
+    if multiprocessing.current_process().daemon:
+        # a worker process, see PROCESSES; not counted
+        return None
+    current = Profile(title)
+    return current
+
+def end(profile):
+    """Stops profiling, and reports <profile> if it's not None."""
+    global current
+    if profile is None:
+        return
+    current = None
+    profile.stop()
+    profile.log()
+    if conf.profileFile:
+        try:
+            profile.write(conf.profileFile)
+        except IOError, e:
+            logging.warning('the profile could not be written to %s: %s' % (conf.profileFile, e))
+
+def addOption(parser, prefix=''):
+    """Adds --profile to an optparse parser of a command line tool;
+    <prefix> starts its help."""
+    parser.add_option('--profile', metavar='FILE',
+            help=prefix + 'profile the comparison: a summary is shown, and written to FILE as JSON')
+
+def applyOption(options):
+    """Turns profiling on if --profile was given, showing the summary on
+    the standard error."""
+    if options.profile:
+        conf.profile = '1'
+        conf.profileFile = options.profile
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
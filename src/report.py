@@ -0,0 +1,295 @@
+#    -*- coding: utf-8 -*-
+#    Advanced directory compare tool in Python.
+#
+#    Copyright (C) 2008, 2009  Pan Xingzhi
+#    http://code.google.com/p/dircompare/
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Command line comparison reports. No GUI needed.
+
+Results are written while the trees are walked, a folder right after
+everything in it; nothing but the folders being walked is kept in memory.
+
+Usage: python report.py [options] leftPath rightPath
+Either path may be a manifest file written by manifest.py.
+Exit status is 0 if the trees are same, 1 if they differ, 2 if in trouble.
+Common folders left out by --max-depth are reported as not compared, and
+don't make the trees differ; one side folders are reported as not listed,
+with nothing counted in them. Moved files are not looked for, see moves.py: that
+takes every one side file of the trees at once, and reports are written
+as they go; a moved file is reported left only and right only."""
+
+from __future__ import print_function
+import os.path as path
+import sys
+import time
+import csv
+import json
+import optparse
+from multiprocessing.pool import ThreadPool
+
+import configuration as conf
+import model
+import ignorerules
+import profiling
+
+# the numbers of items under a folder in a record, see model.STAT_NAMES;
+# there's no moved item in a report
+STAT_NAMES = tuple(name for name in model.STAT_NAMES if name != 'moved')
+# fields of a record, in output order
+# a folder also has the number of items under it with each kind of status,
+# see STAT_NAMES; these are None for files
+FIELDS = ('path', 'type', 'status', 'offset') + STAT_NAMES
+
+def iterCompare(leftPath, rightPath, ignore=(), map=map, filters=None):
+    """Compares two folders, yielding a record (dict) for each item found.
+    Items are yielded in the order DirectoryDataItem sorts them, a folder
+    right after its sub items. <map> is used to compare the files of
+    a folder, and may run the jobs concurrently. <filters> is a
+    model.WalkFilter or None."""
+    return _walkCommon(leftPath, rightPath, '', (ignorerules.getRules(ignore), filters), map,
+                       [False], _newStats())
+
+def _record(relName, isDir, status, offset=None, stats=None):
+    """offset is where a common file is found different, if known.
+    stats are the numbers of items under a folder."""
+    record = {'path': relName, 'type': 'dir' if isDir else 'file', 'status': status,
+              'offset': offset}
+    record.update(stats or dict.fromkeys(STAT_NAMES))
+    return record
+
+def _newStats():
+    return dict.fromkeys(STAT_NAMES, 0)
+
+def _count(below, status, stats=None):
+    """Adds an item and the items under it to <below>."""
+    below[model._STAT_OF_STATUS[status]] += 1
+    for name, count in (stats or {}).iteritems():
+        below[name] += count
+
+# how model.STAT_NAMES read in text
+_STAT_LABELS = ('same', 'different', 'left only', 'right only', 'unknown', 'not compared yet',
+                'moved')
+
+def formatStats(stats):
+    """Returns the non zero numbers in <stats>, a record or
+    DataItem.subtreeStats(), as text."""
+    return ', '.join('%d %s' % (stats[name], label)
+                     for name, label in zip(model.STAT_NAMES, _STAT_LABELS)
+                     if stats.get(name))
+
+def _sortedNames(folders, files):
+    key = lambda name: name.lower()
+    return [(name, True) for name in sorted(folders, key=key)] + \
+           [(name, False) for name in sorted(files, key=key)]
+
+def _walkCommon(lDir, rDir, relName, walk, map, differs, below):
+    """Walks a common folder. Sets differs[0] to True if it's not same.
+    The folder and everything in it are counted in <below>.
+    <walk> is (ignore, filters) as given to model._scanPair."""
+    ignore, filters = walk
+    if filters and not filters.lists(relName):
+        # on the last level: not compared, rather than same
+        _count(below, model.STATUS_COMMON_PENDING)
+        yield _record(relName, True, model.STATUS_COMMON_PENDING)
+        return
+    lEntries, rEntries = model._scanPair((lDir, rDir, ignore, relName, filters))
+    if lEntries is None or rEntries is None:
+        differs[0] = True
+        _count(below, model.STATUS_UNKNOWN_COMMON)
+        yield _record(relName, True, model.STATUS_UNKNOWN_COMMON)
+        return
+    (lFolders, lFiles), (rFolders, rFiles) = \
+        model._splitEntries(lEntries), model._splitEntries(rEntries)
+    commonFolders = lFolders.intersection(rFolders)
+    commonFiles = lFiles.intersection(rFiles)
+
+    # compare the common files of this folder all at once
+    shallow = int(conf.shallow)
+    fileJobs = sorted(name for name in commonFiles
+                      if lEntries[name] is not None and rEntries[name] is not None)
+    results = dict(zip(fileJobs, map(model._cmpFilePair,
+            [(path.join(lDir, name), path.join(rDir, name), lEntries[name], rEntries[name], shallow)
+             for name in fileJobs])))
+
+    diff = False
+    stats = _newStats()
+    for name, isDir in _sortedNames(lFolders | rFolders, lFiles | rFiles):
+        subName = path.join(relName, name)
+        if isDir and name in commonFolders:
+            subDiffers = [False]
+            for record in _walkCommon(path.join(lDir, name), path.join(rDir, name),
+                                      subName, walk, map, subDiffers, stats):
+                yield record
+            diff = diff or subDiffers[0]
+            continue
+        if not isDir and name in commonFiles:
+            same, offset = results.get(name, (None, None))
+            if same is not None:
+                status = model.STATUS_COMMON_SAME if same else model.STATUS_COMMON_DIFF
+            else:
+                status = model.STATUS_UNKNOWN_COMMON
+            diff = diff or status is not model.STATUS_COMMON_SAME
+            _count(stats, status)
+            yield _record(subName, False, status, offset)
+            continue
+        diff = True
+        if name in (lFolders if isDir else lFiles):
+            side, entries, baseDir = 'left', lEntries, lDir
+        else:
+            side, entries, baseDir = 'right', rEntries, rDir
+        for record in _walkOneSide(path.join(baseDir, name), subName, isDir,
+                                   entries[name] is None, side, walk, stats):
+            yield record
+    differs[0] = differs[0] or diff
+    if diff:
+        status = model.STATUS_COMMON_DIFF
+    elif stats['pending']:
+        status = model.STATUS_COMMON_PENDING
+    else:
+        status = model.STATUS_COMMON_SAME
+    _count(below, status, stats)
+    yield _record(relName, True, status, stats=stats)
+
+def _walkOneSide(fullName, relName, isDir, unknown, side, walk, below):
+    status = getattr(model, 'STATUS_' + side.upper() + '_ONLY')
+    badStatus = getattr(model, 'STATUS_UNKNOWN_' + side.upper())
+    if unknown:
+        _count(below, badStatus)
+        yield _record(relName, isDir, badStatus)
+        return
+    if not isDir or (walk[1] and not walk[1].lists(relName)):
+        # a folder on the last level isn't listed: what's in it is unknown
+        _count(below, status)
+        yield _record(relName, isDir, status)
+        return
+    entries = model._scanPair((fullName, None, walk[0], relName, walk[1]))[0]
+    if entries is None:
+        _count(below, badStatus)
+        yield _record(relName, True, badStatus)
+        return
+    folders, files = model._splitEntries(entries)
+    stats = _newStats()
+    for name, subIsDir in _sortedNames(folders, files):
+        for record in _walkOneSide(path.join(fullName, name), path.join(relName, name),
+                                   subIsDir, entries[name] is None, side, walk, stats):
+            yield record
+    _count(below, status, stats)
+    yield _record(relName, True, status, stats=stats)
+
+##############################
+# writers                    #
+##############################
+def writeText(records, out):
+    for record in records:
+        if record['offset'] is not None:
+            note = ' (first difference at byte %d)' % record['offset']
+        elif record['type'] == 'dir' and record['same'] is not None:
+            note = ' (%s)' % (formatStats(record) or 'empty')
+        elif record['type'] == 'dir' and record['status'] in (model.STATUS_LEFT_ONLY,
+                                                              model.STATUS_RIGHT_ONLY):
+            note = ' (not listed)'
+        else:
+            note = ''
+        out.write('%-15s %s%s%s\n' % (record['status'], record['path'] or '.',
+                                      '/' if record['type'] == 'dir' else '', note))
+
+def writeJsonLines(records, out):
+    for record in records:
+        out.write(json.dumps(record, sort_keys=True) + '\n')
+
+def writeCsv(records, out):
+    writer = csv.writer(out)
+    writer.writerow(FIELDS)
+    for record in records:
+        writer.writerow([record[field] for field in FIELDS])
+
+writers = {'text': writeText, 'jsonl': writeJsonLines, 'csv': writeCsv}
+
+def addFilterOptions(parser):
+    """Adds the options of a model.WalkFilter to an optparse parser."""
+    parser.add_option('--min-size', type='int', metavar='BYTES',
+            help='leave out files smaller than BYTES')
+    parser.add_option('--max-size', type='int', metavar='BYTES',
+            help='leave out files bigger than BYTES')
+    parser.add_option('--max-age', type='float', metavar='DAYS',
+            help='leave out files not changed within DAYS')
+    parser.add_option('--min-age', type='float', metavar='DAYS',
+            help='leave out files changed within DAYS')
+    parser.add_option('--max-depth', type='int', metavar='LEVELS',
+            help='do not look more than LEVELS levels down')
+
+def filtersOf(options):
+    """Returns the model.WalkFilter given by the options added by
+    addFilterOptions, or None."""
+    now = time.time()
+    filters = model.WalkFilter(options.min_size, options.max_size,
+            now - options.max_age * 86400 if options.max_age is not None else None,
+            now - options.min_age * 86400 if options.min_age is not None else None,
+            options.max_depth)
+    return filters or None
+
+def main(args=None):
+    parser = optparse.OptionParser(usage='python report.py [options] leftPath rightPath',
+            description='Compares two folders and reports the differences. '
+                        'Exit status is 0 if they are same, 1 if they differ, 2 if in trouble.')
+    parser.add_option('-f', '--format', choices=sorted(writers), default='text',
+            help='output format: text, jsonl or csv [default: %default]')
+    parser.add_option('-o', '--output', metavar='FILE',
+            help='write the report to FILE instead of the standard output')
+    parser.add_option('-i', '--ignore', default='',
+            help='comma seperated patterns to ignore, e.g. .svn,*.pyc,build/')
+    parser.add_option('-d', '--diff-only', action='store_true', default=False,
+            help='only report items that are not same')
+    addFilterOptions(parser)
+    profiling.addOption(parser)
+    options, args = parser.parse_args(args)
+    if len(args) != 2:
+        parser.print_usage(sys.stderr)
+        return 2
+    leftPath, rightPath = args
+    if not model.isComparable(leftPath) or not model.isComparable(rightPath):
+        print('Invalid given path(s).', file=sys.stderr)
+        return 2
+    ignore = tuple(ign.strip() for ign in options.ignore.split(',') if ign.strip())
+    profiling.applyOption(options)
+
+    workers = int(conf.workers)
+    pool = ThreadPool(workers) if workers > 1 else None
+    out = open(options.output, 'wb') if options.output else sys.stdout
+    # the walk goes on while the report is written
+    profile = profiling.begin('%s <> %s' % (leftPath, rightPath))
+    try:
+        differs = [False]
+        records = _walkCommon(leftPath, rightPath, '',
+                              (ignorerules.getRules(ignore), filtersOf(options)),
+                              pool.map if pool else map, differs, _newStats())
+        if options.diff_only:
+            records = (record for record in records
+                       if record['status'] is not model.STATUS_COMMON_SAME)
+        writers[options.format](records, out)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+        model.hashcache.flush()
+        if out is not sys.stdout:
+            out.close()
+        profiling.end(profile)
+    return 1 if differs[0] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
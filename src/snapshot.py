@@ -0,0 +1,357 @@
+#    -*- coding: utf-8 -*-
+#    Advanced directory compare tool in Python.
+#
+#    Copyright (C) 2008, 2009  Pan Xingzhi
+#    http://code.google.com/p/dircompare/
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Saves the whole result of a comparison in a compact binary file, and
+loads it back without comparing again.
+
+The file is memory-mapped when loaded, and the children of a folder are
+only decoded when they are first needed, so a big snapshot opens at once.
+The loaded tree keeps the stat signatures it was saved with, so refreshing
+it only compares again what has changed since.
+
+Layout, all integers little endian; varints are unsigned LEB128:
+    MAGIC
+    children blocks: one per folder, the blocks of sub folders always
+        come before the block of their parent. A block is a run of records:
+            varint  index of the name in the string table
+            varint  flags: bit 0 folder, bits 1-4 status (see
+                    model._STATUSES), bit 5 has left signature, bit 6 has
+                    right signature, bit 7 has firstDiffOffset, bit 8 has
+                    counterpart, bit 9 has three-way status
+            each signature present: varint size, double mtime, varint inode
+            varint  firstDiffOffset, if present
+            varint  index of the counterpart in the string table, if present
+            varint  three-way status, if present: its index in
+                    model._MERGE_STATUSES << 2, | 2 if it's known whether
+                    the item is in the base, | 1 if it is
+            folders only: varint number of children, varint block offset
+    meta: varint length, then JSON (paths, ignore, filters, root status...);
+        paths and patterns are written as latin-1 when one of them isn't
+        UTF-8, as told by its encoding
+    string table: uint32 offsets of count + 1 strings in the blob, the blob
+    trailer: uint64 meta offset, root block offset, root children count,
+        string table offset, string count; MAGIC again"""
+
+from __future__ import print_function
+import os
+import os.path as path
+import sys
+import mmap
+import json
+import time
+import struct
+import functools
+
+import model
+from errors import *
+
+# the version of the snapshot format; files of another one are refused
+VERSION = 3
+MAGIC = 'DCSNAP\x00' + chr(VERSION)
+
+_TRAILER = struct.Struct('<QQQQQ')
+_MTIME = struct.Struct('<d')
+_OFFSET = struct.Struct('<I')
+
+# record flags
+_DIR = 1
+_STATUS_SHIFT = 1
+_STATUS_MASK = 0xf << _STATUS_SHIFT
+_LEFT_SIG = 1 << 5
+_RIGHT_SIG = 1 << 6
+_DIFF_OFFSET = 1 << 7
+_COUNTERPART = 1 << 8
+_MERGE = 1 << 9
+
+def save(rootDataItem, fileName, session=None):
+    """Writes the comparison result under <rootDataItem> to <fileName>.
+    The ignore list and filters of <session> are kept along, if given. The file is
+    replaced only when it's completely written."""
+    unicodeNames = isinstance(rootDataItem.leftLocation, unicode)
+    strings, names = {}, []
+    def nameIndex(name):
+        index = strings.get(name)
+        if index is None:
+            index = strings[name] = len(names)
+            names.append(name.encode('utf-8') if unicodeNames else name)
+        return index
+
+    # parents always before children, so reversed, children come first
+    folders, stack = [], [rootDataItem]
+    while stack:
+        itm = stack.pop()
+        folders.append(itm)
+        stack.extend(child for child in itm.children if child.isDir())
+
+    tmpName = fileName + '.tmp'
+    fp = open(tmpName, 'wb')
+    try:
+        fp.write(MAGIC)
+        blocks = {}
+        for folder in reversed(folders):
+            children = folder.children
+            blocks[id(folder)] = (fp.tell(), len(children))
+            fp.write(''.join([_encodeItem(child, nameIndex, blocks) for child in children]))
+        rootOffset, rootCount = blocks[id(rootDataItem)]
+
+        metaOffset = fp.tell()
+        ignore = list(session.ignore) if session else []
+        locations = [rootDataItem.leftLocation, rootDataItem.rightLocation,
+                     rootDataItem.baseLocation]
+        encoding = _metaEncoding(locations + ignore)
+        jsonName = lambda name: name.decode(encoding) if isinstance(name, str) else name
+        meta = json.dumps({'version': VERSION,
+                           'leftPath': jsonName(rootDataItem.leftLocation),
+                           'rightPath': jsonName(rootDataItem.rightLocation),
+                           'basePath': jsonName(rootDataItem.baseLocation),
+                           'encoding': encoding,
+                           'merge': _mergeOf(rootDataItem),
+                           'ignore': [jsonName(each) for each in ignore],
+                           'filters': vars(session.filters) if session and session.filters else None,
+                           'unicode': unicodeNames,
+                           'status': model._STATUS_INDEX[rootDataItem.status],
+                           'leftSig': _hexOrNone(rootDataItem.leftSig),
+                           'rightSig': _hexOrNone(rootDataItem.rightSig),
+                           'counts': rootDataItem.subtreeCounts(),
+                           'saved': time.time()}, sort_keys=True)
+        fp.write(_varint(len(meta)) + meta)
+
+        stringsOffset = fp.tell()
+        offsets, end = [], 0
+        for name in names:
+            offsets.append(end)
+            end += len(name)
+        offsets.append(end)
+        fp.write(struct.pack('<%dI' % len(offsets), *offsets))
+        fp.write(''.join(names))
+
+        fp.write(_TRAILER.pack(metaOffset, rootOffset, rootCount, stringsOffset, len(names)))
+        fp.write(MAGIC)
+    finally:
+        fp.close()
+    if sys.platform == 'win32' and path.exists(fileName):
+        os.remove(fileName)
+    os.rename(tmpName, fileName)
+
+def load(fileName):
+    """Loads a snapshot written by save.
+    Returns (rootDataItem, session). Only the root is decoded now, the
+    rest when asked for."""
+    reader = _Reader(fileName)
+    meta = reader.meta
+    encoding = meta.get('encoding', 'utf-8')
+    fsName = (lambda name: _fsName(name, encoding)) if not meta['unicode'] else unicode
+    basePath = meta['basePath']
+    root = model.DirectoryDataItem('', fsName(meta['leftPath']), fsName(meta['rightPath']),
+                                   validate=False,
+                                   baseLocation=fsName(basePath) if basePath else None)
+    root.leftSig, root.rightSig = _sigOrNone(meta['leftSig']), _sigOrNone(meta['rightSig'])
+    reader.defer(root, reader.rootOffset, reader.rootCount)
+    if meta['merge'] is not None:
+        _setMerge(root, meta['merge'])
+    root.status = model._STATUSES[meta['status']]
+    # shown before anything below is decoded; decoding forgets them
+    root._subtreeCounts = meta['counts']
+    filters = meta['filters']
+    session = model.CompareSession(root.leftLocation, root.rightLocation,
+                                   tuple(fsName(each) for each in meta['ignore']),
+                                   model.WalkFilter(**filters) if filters else None,
+                                   root.baseLocation)
+    return root, session
+
+def isSnapshot(fileName):
+    """Tells if <fileName> starts like a snapshot, of any version, so
+    that one this version can't load is told as such."""
+    try:
+        fp = open(fileName, 'rb')
+    except IOError:
+        return False
+    try:
+        return fp.read(len(MAGIC) - 1) == MAGIC[:-1]
+    finally:
+        fp.close()
+
+class _Reader(object):
+    """Decodes a memory-mapped snapshot one folder at a time. The file is
+    closed when every folder is decoded."""
+
+    def __init__(self, fileName):
+        fp = open(fileName, 'rb')
+        try:
+            size = os.fstat(fp.fileno()).st_size
+            if size < 2 * len(MAGIC) + _TRAILER.size:
+                raise InvalidValueError('%s is not a snapshot.' % fileName)
+            self.data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            fp.close()
+        data = self.data
+        magic = data[:len(MAGIC)]
+        if magic != MAGIC or data[-len(MAGIC):] != magic:
+            data.close()
+            raise InvalidValueError('%s is not a snapshot this version can load.' % fileName)
+        metaOffset, self.rootOffset, self.rootCount, stringsOffset, self.stringCount = \
+                _TRAILER.unpack_from(data, size - len(MAGIC) - _TRAILER.size)
+        length, pos = _readVarint(data, metaOffset)
+        self.meta = json.loads(data[pos:pos + length])
+        self.unicodeNames = self.meta['unicode']
+        self.stringsOffset = stringsOffset
+        self.blobOffset = stringsOffset + _OFFSET.size * (self.stringCount + 1)
+        # folders whose children are not decoded yet
+        self.pending = 0
+
+    def string(self, index):
+        start, end = struct.unpack_from('<II', self.data, self.stringsOffset + _OFFSET.size * index)
+        name = self.data[self.blobOffset + start:self.blobOffset + end]
+        return name.decode('utf-8') if self.unicodeNames else name
+
+    def defer(self, folder, offset, count):
+        """Decodes the children of <folder> when they are first needed."""
+        self.pending += 1
+        folder.setChildrenLoader(functools.partial(self.decode, offset, count))
+
+    def decode(self, offset, count, folder):
+        """Adds the <count> children found at <offset> to <folder>."""
+        data, pos = self.data, offset
+        unpackMTime = _MTIME.unpack_from
+        packSig = model._SIGNATURE.pack
+        try:
+            for i in xrange(count):
+                index, pos = _readVarint(data, pos)
+                flags, pos = _readVarint(data, pos)
+                isDir = flags & _DIR
+                itm = folder.addChild(self.string(index),
+                        model.DirectoryDataItem if isDir else model.FileDataItem)
+                sigs = []
+                for bit in (_LEFT_SIG, _RIGHT_SIG):
+                    if flags & bit:
+                        size, pos = _readVarint(data, pos)
+                        mtime, = unpackMTime(data, pos)
+                        ino, pos = _readVarint(data, pos + _MTIME.size)
+                        sigs.append(packSig(size, mtime, ino))
+                    else:
+                        sigs.append(None)
+                itm.leftSig, itm.rightSig = sigs
+                if flags & _DIFF_OFFSET:
+                    itm.firstDiffOffset, pos = _readVarint(data, pos)
+                if flags & _COUNTERPART:
+                    index, pos = _readVarint(data, pos)
+                    itm.counterpart = self.string(index)
+                if flags & _MERGE:
+                    packed, pos = _readVarint(data, pos)
+                    _setMerge(itm, packed)
+                if isDir:
+                    childCount, pos = _readVarint(data, pos)
+                    childOffset, pos = _readVarint(data, pos)
+                    self.defer(itm, childOffset, childCount)
+                itm.status = model._STATUSES[(flags & _STATUS_MASK) >> _STATUS_SHIFT]
+                for side in ('left', 'right'):
+                    itm._setExists(side, side in model._sidesOf(itm.status)
+                                         and getattr(itm, side + 'Sig') is not None)
+        finally:
+            self.pending -= 1
+            if not self.pending:
+                data.close()
+
+##############################
+# helpers                    #
+##############################
+def _encodeItem(itm, nameIndex, blocks):
+    isDir = itm.isDir()
+    offset = None if isDir else itm.firstDiffOffset
+    counterpart = None if isDir else itm.counterpart
+    merge = _mergeOf(itm)
+    flags = (_DIR if isDir else 0) | model._STATUS_INDEX[itm.status] << _STATUS_SHIFT
+    if itm.leftSig is not None:
+        flags |= _LEFT_SIG
+    if itm.rightSig is not None:
+        flags |= _RIGHT_SIG
+    if offset is not None:
+        flags |= _DIFF_OFFSET
+    if counterpart is not None:
+        flags |= _COUNTERPART
+    if merge is not None:
+        flags |= _MERGE
+    out = [_varint(nameIndex(itm.name)), _varint(flags)]
+    for sig in (itm.leftSig, itm.rightSig):
+        if sig is not None:
+            size, mtime, ino = model._SIGNATURE.unpack(sig)
+            out += (_varint(size), _MTIME.pack(mtime), _varint(ino))
+    if offset is not None:
+        out.append(_varint(offset))
+    if counterpart is not None:
+        out.append(_varint(nameIndex(counterpart)))
+    if merge is not None:
+        out.append(_varint(merge))
+    if isDir:
+        start, count = blocks[id(itm)]
+        out += (_varint(count), _varint(start))
+    return ''.join(out)
+
+def _mergeOf(itm):
+    """Packs the three-way status of <itm> as written in records, None if
+    it's not compared with a base."""
+    if not itm._knowsExists('base'):
+        return None
+    return model._MERGE_INDEX[itm.mergeStatus] << 2 | 2 | (1 if itm.baseExists else 0)
+
+def _setMerge(itm, packed):
+    itm.mergeStatus = model._MERGE_STATUSES[packed >> 2]
+    if packed & 2:
+        itm._setExists('base', packed & 1)
+
+def _varint(n):
+    out = []
+    while n > 0x7f:
+        out.append(chr(n & 0x7f | 0x80))
+        n >>= 7
+    out.append(chr(n))
+    return ''.join(out)
+
+def _readVarint(data, pos):
+    """Returns the varint at <pos> and where the next thing starts."""
+    n = shift = 0
+    while True:
+        byte = ord(data[pos])
+        pos += 1
+        n |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return n, pos
+        shift += 7
+
+def _hexOrNone(sig):
+    return sig.encode('hex') if sig is not None else None
+
+def _sigOrNone(text):
+    return str(text).decode('hex') if text is not None else None
+
+def _fsName(name, encoding='utf-8'):
+    # JSON gives back unicode; the tree keeps file system encoded names
+    return name.encode(encoding) if isinstance(name, unicode) else name
+
+def _metaEncoding(names):
+    """Returns what the byte strings in <names> are written to the meta
+    as: UTF-8, unless one of them isn't, then latin-1, which takes any
+    bytes back and forth."""
+    for name in names:
+        if isinstance(name, str):
+            try:
+                name.decode('utf-8')
+            except UnicodeDecodeError:
+                return 'latin-1'
+    return 'utf-8'
@@ -0,0 +1,605 @@
+#    -*- coding: utf-8 -*-
+#    Advanced directory compare tool in Python.
+#
+#    Copyright (C) 2008, 2009  Pan Xingzhi
+#    http://code.google.com/p/dircompare/
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Copies everything that differs from one side to the other, in bulk.
+
+The whole set of operations is planned from the compared DataItem tree
+first, then run by a pool of threads; the tree is updated afterwards, in
+one status batch. Big files are copied by the kernel (copy_file_range or
+sendfile) where the system allows.
+
+Plans can be saved, reviewed and run later. A run records what it has
+done in a checkpoint file next to the plan, so a run that stopped halfway
+goes on where it stopped when started again. Each plan carries an id, a
+hash of its contents, and a checkpoint written for another plan is
+ignored.
+
+Command line usage:
+    python sync.py plan [options] srcPath destPath
+    python sync.py run [options] planFile"""
+
+from __future__ import print_function
+import os
+import os.path as path
+import sys
+import errno
+import shutil
+import time
+import json
+import hashlib
+import optparse
+import logging
+from multiprocessing.pool import ThreadPool
+
+import configuration as conf
+import model
+import report
+import profiling
+from errors import *
+
+# files at least this big are copied by the kernel, if possible
+KERNEL_COPY_MIN = 1024 * 1024
+# operations done between two flushes of the checkpoint file
+CHECKPOINT_INTERVAL = 1000
+# the version of the plan file format; plans of another one are refused
+PLAN_VERSION = 3
+
+class Plan(object):
+    """What a sync does, worked out before anything is touched.
+    <operations> is a list of (kind, relName, bytes), in the order they
+    must run; every path is found once at most:
+        ('delete', relName, size) deletes a file or a whole folder, found
+                                  only on the destination side
+        ('mkdir', relName, 0) creates a folder on the destination side
+        ('copy', relName, size) copies a file from the source side
+        ('move', relName, 0) renames a moved file found on the destination
+                             side, see moves.py, to relName
+        ('clone', relName, size) copies it to relName instead, on the
+                                 destination side
+    Deletes come first, and a folder always comes before what's in it;
+    but a folder holding files to move is deleted last.
+    relName is relative to <srcRoot> and <destRoot>, the compared folders.
+    <sources> maps the relName of each move and clone to the relName of
+    the file moved or cloned.
+    <rootDataItem> is the compared tree, None if the plan is loaded.
+    <id> is the hash of the plan as saved, None until saved or loaded."""
+
+    def __init__(self, srcRoot, destRoot, srcSide, destSide, operations, rootDataItem=None,
+                 sources=None):
+        self.srcRoot = srcRoot
+        self.destRoot = destRoot
+        self.srcSide = srcSide
+        self.destSide = destSide
+        self.operations = operations
+        self.rootDataItem = rootDataItem
+        self.sources = sources or {}
+        self.id = None
+
+    def srcName(self, relName):
+        return path.join(self.srcRoot, relName)
+
+    def destName(self, relName):
+        return path.join(self.destRoot, relName)
+
+    def count(self, kind):
+        return len([op for op in self.operations if op[0] == kind])
+
+    def totalBytes(self, kind=None):
+        return sum(op[2] for op in self.operations if kind in (None, op[0]))
+
+    def save(self, fileName):
+        fp = open(fileName, 'wb')
+        try:
+            self.write(fp)
+        finally:
+            fp.close()
+
+    def write(self, fp):
+        """Writes the plan as JSON lines: a header, then one line per
+        operation. Sets <id>, the hash of the lines after the header."""
+        header = {'version': PLAN_VERSION,
+                  'srcRoot': self.srcRoot, 'destRoot': self.destRoot,
+                  'srcSide': self.srcSide, 'destSide': self.destSide,
+                  'operations': len(self.operations),
+                  'bytes': self.totalBytes()}
+        lines = [json.dumps(header, sort_keys=True) + '\n']
+        for kind, relName, size in self.operations:
+            record = [kind, relName, size]
+            if relName in self.sources:
+                record.append(self.sources[relName])
+            lines.append(json.dumps(record) + '\n')
+        self.id = hashlib.sha1(''.join(lines)).hexdigest()
+        header['id'] = self.id
+        lines[0] = json.dumps(header, sort_keys=True) + '\n'
+        fp.writelines(lines)
+
+def loadPlan(fileName):
+    """Reads a plan written by Plan.save."""
+    fp = open(fileName, 'rb')
+    try:
+        header = json.loads(fp.readline())
+        if header.get('version') != PLAN_VERSION:
+            raise InvalidValueError('%s is not a plan this version can run.' % fileName)
+        operations, sources = [], {}
+        for line in fp:
+            record = json.loads(line)
+            kind, relName, size = record[:3]
+            operations.append((str(kind), _fsName(relName), size))
+            if len(record) > 3:
+                sources[_fsName(relName)] = _fsName(record[3])
+    finally:
+        fp.close()
+    if len(operations) != header['operations']:
+        raise InvalidValueError('%s is incomplete.' % fileName)
+    plan = Plan(_fsName(header['srcRoot']), _fsName(header['destRoot']),
+                str(header['srcSide']), str(header['destSide']), operations, sources=sources)
+    plan.id = str(header['id'])
+    return plan
+
+def planSync(rootDataItem, srcSide, destSide, delete=False):
+    """Plans copying every file that differs or is only found on <srcSide>,
+    and creating the folders they need, under the compared folder
+    <rootDataItem>. With <delete>, what's only found on <destSide> is
+    deleted as well, so that both sides end up the same.
+    A file moved on <srcSide> is moved on <destSide> as well, from where
+    its counterpart is; without <delete>, the counterpart is cloned there
+    instead, which is still only a copy within <destSide>.
+    Unknown items are left alone."""
+    for side in (srcSide, destSide):
+        if model._inManifest(getattr(rootDataItem, side + 'FullName'))[0]:
+            raise InvalidMethodInvocationError('the %s side is a manifest, it can\'t be synced.' % side)
+    srcOnly = getattr(model, 'STATUS_' + srcSide.upper() + '_ONLY')
+    destOnly = getattr(model, 'STATUS_' + destSide.upper() + '_ONLY')
+    srcMoved = getattr(model, 'STATUS_' + srcSide.upper() + '_MOVED')
+    deletes, operations, sources = [], [], {}
+    def walk(itm, relName):
+        for child in itm.children:
+            childName = path.join(relName, child.name)
+            if delete and child.status is destOnly:
+                # a folder is deleted as a whole
+                deletes.append(('delete', childName, _subtreeSize(child, destSide)))
+                continue
+            if child.status is srcMoved:
+                source = child.counterpart.replace('/', os.sep)
+                sources[childName] = source
+                if delete:
+                    operations.append(('move', childName, 0))
+                else:
+                    operations.append(('clone', childName,
+                                       _sizeOf(getattr(child, srcSide + 'Sig'))))
+                continue
+            if child.status not in (srcOnly, model.STATUS_COMMON_DIFF):
+                continue
+            if child.isDir():
+                if child.status is srcOnly:
+                    operations.append(('mkdir', childName, 0))
+                walk(child, childName)
+            else:
+                operations.append(('copy', childName, _sizeOf(getattr(child, srcSide + 'Sig'))))
+    walk(rootDataItem, '')
+    # folders holding files to move are deleted once they are moved
+    holding = set()
+    for source in sources.itervalues():
+        while source:
+            source = path.dirname(source)
+            holding.add(source)
+    last = [op for op in deletes if op[1] in holding]
+    deletes = [op for op in deletes if op[1] not in holding]
+    return Plan(getattr(rootDataItem, srcSide + 'FullName'),
+                getattr(rootDataItem, destSide + 'FullName'),
+                srcSide, destSide, deletes + operations + last, rootDataItem, sources)
+
+class SyncProgress(object):
+    """Follows a sync running on another thread.
+    cancel() may be called from any thread; operations not started yet
+    are then skipped."""
+
+    def __init__(self, plan):
+        self.operations = 0
+        self.operationsTotal = len(plan.operations)
+        self.bytes = 0
+        self.bytesTotal = plan.totalBytes()
+        self.errors = 0
+        self.cancelled = False
+        self.started = time.time()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def rate(self):
+        """Returns the bytes copied per second so far."""
+        elapsed = time.time() - self.started
+        return self.bytes / elapsed if elapsed > 0 else 0.0
+
+    def eta(self):
+        """Estimates the seconds left from the bytes copied so far,
+        or returns None if nothing is copied yet."""
+        rate = self.rate()
+        if not rate:
+            return None
+        return (self.bytesTotal - self.bytes) / rate
+
+def execute(plan, workers=None, progress=None, checkpoint=None):
+    """Runs the operations of <plan> on the file system; deletes and
+    folders are done on the calling thread, files are copied by <workers>
+    threads, WORKERS in the config file by default. Failed operations are
+    logged and counted in <progress>. Returns the operations done, in plan
+    order. The DataItem tree is not touched, see apply.
+    When the name of a <checkpoint> file is given, operations recorded
+    in it are skipped, and the ones done now are added to it; a checkpoint
+    of another plan than <plan> is ignored and started over."""
+    if workers is None:
+        workers = int(conf.workers)
+    if progress is None:
+        progress = SyncProgress(plan)
+    done = [False] * len(plan.operations)
+    log = None
+    if checkpoint:
+        recorded = _readCheckpoint(checkpoint, plan.id)
+        if recorded is None:
+            logging.warning('sync: %s is not a checkpoint of this plan, starting over' % checkpoint)
+        for i in recorded or ():
+            if i < len(done) and not done[i]:
+                done[i] = True
+                progress.operations += 1
+                progress.bytesTotal -= plan.operations[i][2]
+        log = Checkpoint(checkpoint, plan.id, recorded is None)
+    try:
+        copies = []
+        for i, (kind, relName, size) in enumerate(plan.operations):
+            if done[i]:
+                continue
+            if kind == 'copy':
+                copies.append((i, plan.srcName(relName), plan.destName(relName), size, progress))
+                continue
+            if kind == 'clone':
+                copies.append((i, plan.destName(plan.sources[relName]), plan.destName(relName),
+                               size, progress))
+                continue
+            if progress.cancelled:
+                break
+            if _runOperation(plan, kind, relName):
+                done[i] = True
+                if log:
+                    log.record(i)
+            else:
+                progress.errors += 1
+            progress.operations += 1
+
+        pool = ThreadPool(workers) if workers > 1 else None
+        try:
+            results = (pool.imap_unordered(_copyJob, copies, 16) if pool
+                       else (_copyJob(job) for job in copies))
+            for i, ok in results:
+                if ok is None:
+                    # skipped after cancelling
+                    continue
+                progress.operations += 1
+                if ok:
+                    done[i] = True
+                    progress.bytes += plan.operations[i][2]
+                    if log:
+                        log.record(i)
+                else:
+                    progress.errors += 1
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+    finally:
+        if log:
+            log.close()
+    logging.info('sync: %d operations done, %d failed, %d bytes copied in %.1f s (%.1f MB/s)' %
+            (len([each for each in done if each]), progress.errors, progress.bytes,
+             time.time() - progress.started, progress.rate() / 1024 / 1024))
+    return [op for op, each in zip(plan.operations, done) if each]
+
+def apply(plan, done):
+    """Updates the DataItem tree after the operations in <done>, in one
+    status batch. Must be called on the thread owning the tree."""
+    rootDataItem, destSide = plan.rootDataItem, plan.destSide
+    destOnly = getattr(model, 'STATUS_' + destSide.upper() + '_ONLY')
+    destMoved = getattr(model, 'STATUS_' + destSide.upper() + '_MOVED')
+    created = []
+    with model.batch():
+        for kind, relName, size in done:
+            if kind == 'delete':
+                for isDir in (True, False):
+                    itm = _find(rootDataItem, relName, isDir)
+                    if itm is not None and itm.status is destOnly:
+                        itm._setExists(destSide, False)
+                        if isDir:
+                            for each in itm.iterSubItems():
+                                each._setExists(destSide, False)
+                        itm.status = None
+                continue
+            itm = _find(rootDataItem, relName, kind == 'mkdir')
+            if itm is None:
+                continue
+            model._setAncestorsExist(itm, destSide)
+            itm._setExists(destSide, True)
+            if kind == 'mkdir':
+                created.append(itm)
+                continue
+            source = None
+            if kind == 'move':
+                source = _find(rootDataItem, plan.sources[relName], False)
+            itm.firstDiffOffset = None
+            if itm.mergeStatus is not None:
+                itm.mergeStatus = model.MERGE_SAME
+            # the counterpart is one side only again, if it's not moved
+            itm.status = model.STATUS_COMMON_SAME
+            if source is not None and source.status in (destOnly, destMoved):
+                source._setExists(destSide, False)
+                source.status = None
+        # created folders are decided from their children, deepest first
+        for itm in reversed(created):
+            itm._settle()
+
+def copyAll(rootDataItem, srcSide, destSide, workers=None, progress=None):
+    """Plans, executes and applies a sync on the calling thread.
+    Returns the plan."""
+    plan = planSync(rootDataItem, srcSide, destSide)
+    apply(plan, execute(plan, workers, progress))
+    return plan
+
+class Checkpoint(object):
+    """Records the indexes of the operations done, one per line, after a
+    first line naming the id of the plan. The file is flushed to disk
+    every CHECKPOINT_INTERVAL operations, so at most these are done again
+    after a crash. <restart> empties a file left by another plan."""
+
+    def __init__(self, fileName, planId, restart=False):
+        if restart or not path.exists(fileName):
+            self.fp = open(fileName, 'wb')
+            self.fp.write('plan %s\n' % planId)
+        else:
+            self.fp = open(fileName, 'ab')
+        self.pending = 0
+
+    def record(self, i):
+        self.fp.write('%d\n' % i)
+        self.pending += 1
+        if self.pending >= CHECKPOINT_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        self.fp.flush()
+        os.fsync(self.fp.fileno())
+        self.pending = 0
+
+    def close(self):
+        self.flush()
+        self.fp.close()
+
+def checkpointName(planFile):
+    return planFile + '.done'
+
+##############################
+# helpers                    #
+##############################
+def _sizeOf(sig):
+    return model._SIGNATURE.unpack(sig)[0] if sig is not None else 0
+
+def _subtreeSize(itm, side):
+    if itm.isFile():
+        return _sizeOf(getattr(itm, side + 'Sig'))
+    return sum(_sizeOf(getattr(each, side + 'Sig')) for each in itm.iterSubItems()
+               if each.isFile())
+
+def _fsName(name):
+    # JSON gives back unicode; the tree keeps file system encoded names
+    return name.encode('utf-8') if isinstance(name, unicode) else name
+
+def _readCheckpoint(fileName, planId):
+    """Returns the operation indexes recorded in a checkpoint file, none if
+    there is no file, or None if it was written for another plan than
+    <planId>; a line cut short by a crash is ignored."""
+    try:
+        fp = open(fileName, 'rb')
+    except IOError, e:
+        if e.errno == errno.ENOENT:
+            return []
+        raise
+    try:
+        if fp.readline() != 'plan %s\n' % planId:
+            return None
+        return [int(line) for line in fp if line.endswith('\n')]
+    finally:
+        fp.close()
+
+def _runOperation(plan, kind, relName):
+    """Runs a delete, mkdir or move. Returns True if done, or already done
+    by an earlier run."""
+    target = plan.destName(relName)
+    try:
+        if kind == 'move':
+            source = plan.destName(plan.sources[relName])
+            # already moved if the source is gone and the target is there
+            if path.lexists(source) or not path.lexists(target):
+                os.rename(source, target)
+        elif kind == 'mkdir':
+            if not path.isdir(target):
+                os.mkdir(target)
+        elif kind == 'delete':
+            if path.isdir(target) and not path.islink(target):
+                shutil.rmtree(target)
+            elif path.lexists(target):
+                os.remove(target)
+        else:
+            raise InvalidValueError('unknown operation: %s' % kind)
+        return True
+    except (IOError, OSError), e:
+        logging.warning('can\'t %s %s: %s' % (kind, target, e))
+        return False
+
+def _find(rootDataItem, relName, isDir):
+    itm = rootDataItem
+    names = relName.split(os.sep)
+    for i, name in enumerate(names):
+        itm = itm.getChild(name, isDir or i < len(names) - 1)
+        if itm is None:
+            return None
+    return itm
+
+def _copyJob(args):
+    """Returns (index, True if copied, False if failed, None if skipped)."""
+    i, src, dest, size, progress = args
+    if progress.cancelled:
+        return i, None
+    try:
+        copyFile(src, dest, size)
+        return i, True
+    except (IOError, OSError), e:
+        logging.warning('can\'t copy %s to %s: %s' % (src, dest, e))
+        return i, False
+
+def copyFile(src, dest, size):
+    """Copies a file and its permission bits, like shutil.copy. Files of
+    at least KERNEL_COPY_MIN bytes are copied by the kernel if possible."""
+    fsrc = os.open(src, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    try:
+        fdest = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0666)
+        try:
+            if size >= KERNEL_COPY_MIN and _kernelCopy:
+                try:
+                    while _kernelCopy(fsrc, fdest, max(size, KERNEL_COPY_MIN)):
+                        pass
+                except (IOError, OSError), e:
+                    if e.errno not in (errno.EINVAL, errno.ENOSYS, errno.EXDEV,
+                                       errno.EOPNOTSUPP, errno.EBADF):
+                        raise
+                    # not for these files; the rest is copied below
+            blockSize = int(conf.blockSize)
+            while True:
+                data = os.read(fsrc, blockSize)
+                if not data:
+                    break
+                while data:
+                    data = data[os.write(fdest, data):]
+        finally:
+            os.close(fdest)
+    finally:
+        os.close(fsrc)
+    shutil.copymode(src, dest)
+
+def _findKernelCopy():
+    """Returns a function copying up to count bytes between two file
+    descriptors in the kernel, from and to their current offsets, and
+    returning the bytes copied; or None if the system can't do it."""
+    if hasattr(os, 'copy_file_range'):
+        return lambda fsrc, fdest, count: os.copy_file_range(fsrc, fdest, count)
+    if hasattr(os, 'sendfile') and sys.platform.startswith('linux'):
+        return lambda fsrc, fdest, count: os.sendfile(fdest, fsrc, None, count)
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        import ctypes, ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    except (ImportError, OSError):
+        return None
+    def check(result):
+        if result < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        return result
+    try:
+        copyFileRange = libc.copy_file_range
+        copyFileRange.argtypes = (ctypes.c_int, ctypes.c_void_p, ctypes.c_int,
+                                  ctypes.c_void_p, ctypes.c_size_t, ctypes.c_uint)
+        copyFileRange.restype = ctypes.c_ssize_t
+        return lambda fsrc, fdest, count: check(copyFileRange(fsrc, None, fdest, None, count, 0))
+    except AttributeError:
+        pass
+    try:
+        sendfile = libc.sendfile
+        sendfile.argtypes = (ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t)
+        sendfile.restype = ctypes.c_ssize_t
+        return lambda fsrc, fdest, count: check(sendfile(fdest, fsrc, None, count))
+    except AttributeError:
+        return None
+
+_kernelCopy = _findKernelCopy()
+
+##############################
+# command line               #
+##############################
+def main(args=None):
+    parser = optparse.OptionParser(
+            usage='python sync.py plan [options] srcPath destPath\n'
+                  '       python sync.py run [options] planFile',
+            description='plan compares two folders and writes what copies srcPath to destPath '
+                        'without touching anything. run carries out a plan written by plan; '
+                        'started again, it goes on where the last run stopped. '
+                        'Exit status is 0 if everything is done, 1 if something failed, '
+                        '2 if in trouble.')
+    parser.add_option('-o', '--output', metavar='FILE',
+            help='plan: write the plan to FILE instead of the standard output')
+    parser.add_option('-d', '--delete', action='store_true', default=False,
+            help='plan: also delete what is only found in destPath')
+    parser.add_option('-i', '--ignore', default='',
+            help='plan: comma seperated patterns to ignore, e.g. .svn,*.pyc,build/')
+    # plan: what to leave out of the comparison
+    report.addFilterOptions(parser)
+    profiling.addOption(parser, 'plan: ')
+    parser.add_option('-w', '--workers', type='int',
+            help='run: number of files copied at the same time [default: WORKERS in the config file]')
+    options, args = parser.parse_args(args)
+    if len(args) == 3 and args[0] == 'plan':
+        srcPath, destPath = args[1:]
+        if not path.isdir(srcPath) or not path.isdir(destPath):
+            print('Invalid given path(s).', file=sys.stderr)
+            return 2
+        ignore = tuple(ign.strip() for ign in options.ignore.split(',') if ign.strip())
+        filters = report.filtersOf(options)
+        profiling.applyOption(options)
+        rootDataItem = model.DirectoryDataItem('', srcPath, destPath)
+        rootDataItem.compare(ignore, filters=filters)
+        plan = planSync(rootDataItem, 'left', 'right', options.delete)
+        if options.output:
+            plan.save(options.output)
+            # what was done for a plan written here before is of no use
+            if path.exists(checkpointName(options.output)):
+                os.remove(checkpointName(options.output))
+        else:
+            plan.write(sys.stdout)
+        print('%d to delete (%d bytes), %d folders to create, %d files to copy (%d bytes), '
+              '%d to move, %d to clone (%d bytes)' %
+                (plan.count('delete'), plan.totalBytes('delete'), plan.count('mkdir'),
+                 plan.count('copy'), plan.totalBytes('copy'),
+                 plan.count('move'), plan.count('clone'), plan.totalBytes('clone')),
+                file=sys.stderr)
+        return 0
+    if len(args) == 2 and args[0] == 'run':
+        try:
+            plan = loadPlan(args[1])
+        except (IOError, ValueError, KeyError, InvalidValueError), e:
+            print('Invalid plan file: %s' % e, file=sys.stderr)
+            return 2
+        progress = SyncProgress(plan)
+        done = execute(plan, options.workers, progress, checkpointName(args[1]))
+        print('%d of %d operations done, %d failed, %d bytes copied (%.1f MB/s)' %
+                (len(done), len(plan.operations), progress.errors, progress.bytes,
+                 progress.rate() / 1024 / 1024), file=sys.stderr)
+        return 1 if len(done) < len(plan.operations) else 0
+    parser.print_usage(sys.stderr)
+    return 2
+
+if __name__ == '__main__':
+    sys.exit(main())
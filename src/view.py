@@ -35,12 +35,16 @@ class MainFrame(wx.Frame):
             (None, ) * 4,
             (' > ', 'btn_cplr', 'Copy from left to right', 'Copy from left to right'),
             (' < ', 'btn_cprl', 'Copy from right to left', 'Copy from right to left'),
+            (' >> ', 'btn_sync_lr', 'Copy all from left to right', 'Copy everything that differs from left to right'),
+            (' << ', 'btn_sync_rl', 'Copy all from right to left', 'Copy everything that differs from right to left'),
             (None, ) * 4,
             (' D ', 'btn_del', 'Delete', 'Delete current item'),
             (None, ) * 4,
             (' C ', 'btn_cmp', 'Compare files', 'Compare left/right files (need GVim installed)'),
             (None, ) * 4,
             (' R ', 'btn_rfsh_all', 'Refresh all', 'Refresh all'),
+            (' W ', 'btn_watch', 'Watch', 'Keep the comparison up to date with file system changes'),
+            (' X ', 'btn_cancel', 'Cancel comparison', 'Stop the comparison running in the background'),
 #            (' r ', 'btn_rfsh', 'Refresh selected', 'Refresh selected item'),
             (' F ', 'btn_fcs', 'Focus on current folder', 'Start a new session using selected folders as roots'),
             (None, ) * 4,
@@ -52,9 +56,21 @@ class MainFrame(wx.Frame):
         super(MainFrame, self).__init__(parent=None, id=wx.ID_ANY, title='DirCompare', size=eval(conf.defaultFrameSize))
         self.splitter = Splitter(self)
         self.__createToolBar()
-        self.CreateStatusBar()
+        self.__createStatusBar()
         self.CenterOnScreen()
 
+    def __createStatusBar(self):
+        # the gauge shows the progress of the comparison in the second field
+        statusBar = self.CreateStatusBar(2)
+        statusBar.SetStatusWidths([-1, 150])
+        self.gauge = wx.Gauge(statusBar, wx.ID_ANY, 100)
+        def onSize(event):
+            event.Skip()
+            rect = statusBar.GetFieldRect(1)
+            self.gauge.SetPosition((rect.x + 2, rect.y + 2))
+            self.gauge.SetSize((rect.width - 4, rect.height - 4))
+        statusBar.Bind(wx.EVT_SIZE, onSize)
+
     def __createToolBar(self):
         def createToolBarItem(label, attrName, shortHelp, longHelp):
             if not label:
@@ -94,16 +110,62 @@ class Splitter(wx.SplitterWindow):
         glbs[side + 'Tree'] = tree
         glbs[side + 'TextCtrl'] = textCtrl
 
-# TODO use wx.gizmos.TreeListCtrl to replace this
-class Tree(wx.TreeCtrl):
-    style = wx.TR_NO_BUTTONS | wx.TR_NO_LINES | \
-            wx.TR_FULL_ROW_HIGHLIGHT | \
-            wx.TR_MULTIPLE | \
-            wx.TR_HIDE_ROOT
+class Tree(wx.ListCtrl):
+    """Shows one side of the comparison as an indented list.
+    The list is virtual: only the visible rows are asked for, so the number
+    of rows costs nothing here. <rows> is the list of data items currently
+    shown, shared by both sides; <describe> maps one of them to
+    (text, image index, wx.ListItemAttr). Both are set up by the controller."""
+    style = wx.LC_REPORT | wx.LC_VIRTUAL | wx.LC_NO_HEADER
 
     # TODO shall we handle *args and **kwargs?
     def __init__(self, parent):
         super(Tree, self).__init__(parent=parent, style=Tree.style)
+        self.InsertColumn(0, '')
+        self.rows = []
+        self.describe = None
+        self.Bind(wx.EVT_SIZE, self.__onSize)
+
+    def __onSize(self, event):
+        event.Skip()
+        self.SetColumnWidth(0, self.GetClientSize().width)
+
+    def OnGetItemText(self, row, col):
+        return self.describe(self.rows[row])[0]
+
+    def OnGetItemImage(self, row):
+        return self.describe(self.rows[row])[1]
+
+    def OnGetItemAttr(self, row):
+        return self.describe(self.rows[row])[2]
+
+    def getSelectedRows(self):
+        rows = []
+        row = self.GetFirstSelected()
+        while row != -1:
+            rows.append(row)
+            row = self.GetNextSelected(row)
+        return rows
+
+    def selectRows(self, rows):
+        """Selects exactly the given rows."""
+        for row in self.getSelectedRows():
+            self.SetItemState(row, 0, wx.LIST_STATE_SELECTED)
+        for row in rows:
+            self.SetItemState(row, wx.LIST_STATE_SELECTED, wx.LIST_STATE_SELECTED)
+
+    def refreshVisible(self):
+        """Repaints the visible rows after the data items in them changed."""
+        count = self.GetItemCount()
+        if count:
+            top = self.GetTopItem()
+            self.RefreshItems(top, min(top + self.GetCountPerPage(), count - 1))
+
+    def scrollTo(self, top):
+        """Scrolls so that row <top> is the first visible one."""
+        if self.GetItemCount():
+            rowHeight = self.GetItemRect(self.GetTopItem()).height
+            self.ScrollList(0, (top - self.GetTopItem()) * rowHeight)
 
 class SessionDialog(wx.Dialog):
     """Used to create a compare session or display the content of a session."""
@@ -113,60 +175,63 @@ class SessionDialog(wx.Dialog):
         if mode == 'New':
             title = 'New Compare Session'
             textStyle = 0
-            values = ('', '', '.svn, .cvs')
+            values = ('', '', '', '.svn, .cvs')
         elif mode == 'Save':
             title = 'Confirm Compare Session to Save'
             textStyle = wx.TE_READONLY
-            values = (session.leftPath, session.rightPath, '%s, ' * len(session.ignore) % tuple(session.ignore))
+            values = (session.leftPath, session.rightPath, session.basePath or '',
+                      '%s, ' * len(session.ignore) % tuple(session.ignore))
         elif mode == 'Load':
             title = 'Confirm Compare Session to Load'
             textStyle = wx.TE_READONLY
-            values = (session.leftPath, session.rightPath, '%s, ' * len(session.ignore) % tuple(session.ignore))
+            values = (session.leftPath, session.rightPath, session.basePath or '',
+                      '%s, ' * len(session.ignore) % tuple(session.ignore))
         else:
             raise ValueError('argument mode must be one of ("New", "Save", "Load")')
-        super(SessionDialog, self).__init__(frame, wx.ID_ANY, title, size=(300, 200))
+        super(SessionDialog, self).__init__(frame, wx.ID_ANY, title, size=(300, 260))
         # static text
         map(wx.StaticText,
             # parent
-            (self, ) * 2,
+            (self, ) * 3,
             # ID
-            (wx.ID_ANY, ) * 2,
+            (wx.ID_ANY, ) * 3,
             # text
-            ('Ignore :', 'Full name match. E.g, .svn, .cvs'),
+            ('Optional, where both came from', 'Ignore :', 'Like .gitignore. E.g, .svn, *.pyc, build/'),
             # positon
-            ((27, 100), (90, 120)))
+            ((90, 120), (27, 160), (90, 180)))
         # text ctrl
-        self.leftText, self.rightText, self.ignoreText = \
+        self.leftText, self.rightText, self.baseText, self.ignoreText = \
             map(wx.TextCtrl,
                 # parent
-                (self, ) * 3,
+                (self, ) * 4,
                 # ID
-                (wx.ID_ANY, ) * 3,
+                (wx.ID_ANY, ) * 4,
                 # text
                 values,
                 # positon
-                ((90, 20), (90, 60), (90, 100)),
+                ((90, 20), (90, 60), (90, 100), (90, 160)),
                 # size
-                ((170, 20), (170, 20), (170, 20)),
+                ((170, 20), (170, 20), (170, 20), (170, 20)),
                 # style
-                (textStyle, ) * 3)
+                (textStyle, ) * 4)
         # button
-        leftButton, rightButton, okButton, cancelButton = \
+        leftButton, rightButton, baseButton, okButton, cancelButton = \
             map(wx.Button,
                 # parent
-                (self, ) * 4,
+                (self, ) * 5,
                 # ID
-                (wx.ID_ANY, wx.ID_ANY, wx.ID_OK, wx.ID_CANCEL),
+                (wx.ID_ANY, wx.ID_ANY, wx.ID_ANY, wx.ID_OK, wx.ID_CANCEL),
                 # text
-                ('Left   : ', 'Right  :', 'OK', 'Cancel'),
+                ('Left   : ', 'Right  :', 'Base   :', 'OK', 'Cancel'),
                 # positon
-                ((25, 18), (25, 58), (60, 140), (160, 140)),
+                ((25, 18), (25, 58), (25, 98), (60, 200), (160, 200)),
                 # size
-                ((50, 25), (50, 25), wx.Button.GetDefaultSize(), wx.Button.GetDefaultSize()))
+                ((50, 25), (50, 25), (50, 25), wx.Button.GetDefaultSize(), wx.Button.GetDefaultSize()))
                 # style
         if mode == 'New':
             leftButton.Bind(wx.EVT_BUTTON, self.__genOpenDir(self.leftText, 'Choose a directory on left'))
             rightButton.Bind(wx.EVT_BUTTON, self.__genOpenDir(self.rightText, 'Choose a directory on right'))
+            baseButton.Bind(wx.EVT_BUTTON, self.__genOpenDir(self.baseText, 'Choose the directory both sides came from'))
 
     def __genOpenDir(self, textCtrl, msg):
         def openDir(event):
@@ -189,10 +254,12 @@ class SessionDialog(wx.Dialog):
         return openDir
 
 class TreeItemStyle(object):
+    # icons is () or (image when collapsed, image when expanded)
     def __init__(self, color, bgColor, icons):
         self.color = color
         self.bgColor = bgColor
         self.icons = icons
+        self.attr = wx.ListItemAttr(wx.NamedColour(color), wx.NamedColour(bgColor), wx.NullFont)
 
 ##############################
 # start                      #
@@ -200,9 +267,6 @@ class TreeItemStyle(object):
 app = wx.App(redirect=False)
 frame = MainFrame()
 
-lRoot = lTree.AddRoot('lRoot')
-rRoot = rTree.AddRoot('rRoot')
-
 # setup tree artworks
 imgSz = (16, 16)
 imgLst = wx.ImageList(*imgSz)
@@ -214,8 +278,8 @@ Tree.fldImg, Tree.fldOpnImg, Tree.fileImg = \
                 (imgSz, ) * 3))
 #Tree.naImg  = imgLst.Add(wx.ArtProvider_GetBitmap(wx.ART_MISSING_IMAGE, wx.ART_OTHER, imgSz))
 #Tree.naImg  = imgLst.Add(wx.EmptyBitmap(*imgSz))
-lTree.SetImageList(imgLst)
-rTree.SetImageList(imgLst)
+lTree.SetImageList(imgLst, wx.IMAGE_LIST_SMALL)
+rTree.SetImageList(imgLst, wx.IMAGE_LIST_SMALL)
 
 # setup wx tree item styles
 TreeItemStyle.FILE_SAME, TreeItemStyle.FILE_DIFF, \
@@ -234,14 +298,18 @@ TreeItemStyle.DIR_ONESIDEONLY, TreeItemStyle.DIR_ABSENT = \
          conf.normalBgColor, conf.diffBgColor,
          conf.oneSideBgColor, conf.oneSideBgColor),
         # icons
-        (((Tree.fileImg, wx.TreeItemIcon_Normal), (Tree.fileImg, wx.TreeItemIcon_Selected)),
-         ((Tree.fileImg, wx.TreeItemIcon_Normal), (Tree.fileImg, wx.TreeItemIcon_Selected)),
-         ((Tree.fileImg, wx.TreeItemIcon_Normal), (Tree.fileImg, wx.TreeItemIcon_Selected)),
+        ((Tree.fileImg, Tree.fileImg),
+         (Tree.fileImg, Tree.fileImg),
+         (Tree.fileImg, Tree.fileImg),
          (),
-         ((Tree.fldImg, wx.TreeItemIcon_Normal), (Tree.fldOpnImg, wx.TreeItemIcon_Expanded)),
-         ((Tree.fldImg, wx.TreeItemIcon_Normal), (Tree.fldOpnImg, wx.TreeItemIcon_Expanded)),
-         ((Tree.fldImg, wx.TreeItemIcon_Normal), (Tree.fldOpnImg, wx.TreeItemIcon_Expanded)),
+         (Tree.fldImg, Tree.fldOpnImg),
+         (Tree.fldImg, Tree.fldOpnImg),
+         (Tree.fldImg, Tree.fldOpnImg),
          ()))
+TreeItemStyle.DIR_PENDING = TreeItemStyle(conf.pendingTextColor, conf.normalBgColor,
+                                          (Tree.fldImg, Tree.fldOpnImg))
+TreeItemStyle.FILE_MOVED = TreeItemStyle(conf.movedTextColor, conf.oneSideBgColor,
+                                         (Tree.fileImg, Tree.fileImg))
 
 def show():
     """Brings up the GUI."""
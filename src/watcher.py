@@ -0,0 +1,296 @@
+#    -*- coding: utf-8 -*-
+#    Advanced directory compare tool in Python.
+#
+#    Copyright (C) 2008, 2009  Pan Xingzhi
+#    http://code.google.com/p/dircompare/
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Keeps a comparison up to date with the file system.
+
+On Linux, changes are reported by inotify (through ctypes); elsewhere,
+or when inotify is not usable, the compared trees are polled."""
+
+from __future__ import print_function
+import os
+import os.path as path
+import sys
+import errno
+import select
+import struct
+import threading
+import time
+import logging
+
+import configuration as conf
+import model
+
+class Watcher(threading.Thread):
+    """Watches both sides of a compared DirectoryDataItem tree.
+
+    Changes are debounced: they're collected until nothing happens for
+    <delay> seconds (or for at most <maxDelay> seconds in a row), then
+    the changed folders are refreshed as one batch. The batch is applied
+    through <callAfter>, e.g. wx.CallAfter, so that the model is only
+    touched by the thread owning it."""
+
+    def __init__(self, rootDataItem, ignore=(), callAfter=None,
+                 delay=None, maxDelay=None, backend=None, filters=None):
+        super(Watcher, self).__init__()
+        self.setDaemon(True)
+        self.rootDataItem = rootDataItem
+        self.ignore = ignore
+        self.filters = filters
+        self.callAfter = callAfter or (lambda func, *args: func(*args))
+        self.delay = float(conf.watchDelay) if delay is None else delay
+        self.maxDelay = float(conf.watchMaxDelay) if maxDelay is None else maxDelay
+        self.backend = backend or _createBackend(rootDataItem)
+        self.__stopped = threading.Event()
+
+    def stop(self):
+        self.__stopped.set()
+
+    def run(self):
+        changes = {}
+        first = None
+        while not self.__stopped.isSet():
+            for fullName, recursive in self.backend.wait(self.delay):
+                changes[fullName] = changes.get(fullName, False) or recursive
+                if first is None:
+                    first = time.time()
+            if changes and (not self.backend.busy or time.time() - first >= self.maxDelay):
+                batch, changes, first = changes, {}, None
+                done = threading.Event()
+                self.callAfter(self.__apply, batch, done)
+                # don't collect the next batch before this one is applied
+                while not done.wait(0.1) and not self.__stopped.isSet():
+                    pass
+        self.backend.close()
+
+    def __apply(self, changes, done):
+        """Refreshes the folders changed in a batch, on the model's thread."""
+        try:
+            if self.__stopped.isSet():
+                return
+            targets = {}
+            for fullName, recursive in changes.iteritems():
+                itm = findDataItem(self.rootDataItem, fullName)
+                if itm is not None:
+                    targets[itm] = targets.get(itm, False) or recursive
+            # refreshing a folder recursively covers its sub folders
+            for itm, recursive in targets.items():
+                parent = itm.parent
+                while parent is not None:
+                    if targets.get(parent):
+                        del targets[itm]
+                        break
+                    parent = parent.parent
+            logging.debug('watcher refreshing %d folder(s)' % len(targets))
+            # parents first, so that folders removed by refreshing
+            # their parents are skipped
+            # the folders above are decided once for all of them
+            with model.batch():
+                for itm in sorted(targets, key=_depth):
+                    if itm.parent is not None and itm.parent.getChild(itm.name, True) is not itm:
+                        continue
+                    itm.refresh(self.ignore, recursive=targets[itm], filters=self.filters,
+                                detectMoves=False)
+                if int(conf.detectMoves):
+                    model._detectMoves(self.rootDataItem)
+            self.backend.watch(self.rootDataItem)
+        finally:
+            done.set()
+
+def findDataItem(rootDataItem, fullName):
+    """Returns the deepest DirectoryDataItem containing the given file/folder
+    on either side, or None if it's not in the tree at all."""
+    for location in (rootDataItem.leftFullName, rootDataItem.rightFullName):
+        relative = path.relpath(fullName, location)
+        if relative == os.curdir:
+            return rootDataItem
+        if relative.startswith(os.pardir):
+            continue
+        itm = rootDataItem
+        for name in relative.split(os.sep):
+            sub = itm.getChild(name, True)
+            # nothing is compared in a deferred folder yet
+            if sub is None or sub.isDeferred():
+                break
+            itm = sub
+        return itm
+    return None
+
+def _depth(itm):
+    depth = 0
+    while itm.parent is not None:
+        itm, depth = itm.parent, depth + 1
+    return depth
+
+def _folders(rootDataItem):
+    """Yields the full names of all compared folders, on the sides where they exist."""
+    stack = [rootDataItem]
+    while stack:
+        itm = stack.pop()
+        for side in model._sidesOf(itm.status):
+            yield getattr(itm, side + 'FullName')
+        stack.extend(each for each in itm.children if each.isDir() and not each.isDeferred())
+
+def _pollTargets(rootDataItem):
+    """Returns what PollingBackend polls: for every compared folder, its
+    full name and [(full name, signature)] of the folder and of the items
+    in it, on the sides where they exist."""
+    targets = []
+    stack = [rootDataItem]
+    while stack:
+        itm = stack.pop()
+        children = list(itm.children)
+        known = [(getattr(each, side + 'FullName'), getattr(each, side + 'Sig'))
+                 for each in [itm] + children for side in model._sidesOf(each.status)]
+        targets.append((getattr(itm, model._sidesOf(itm.status)[0] + 'FullName'), known))
+        stack.extend(each for each in children if each.isDir() and not each.isDeferred())
+    return targets
+
+def _createBackend(rootDataItem):
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyBackend(rootDataItem)
+        except OSError, e:
+            logging.warn('inotify not usable, falling back to polling: ' + str(e))
+    return PollingBackend(rootDataItem)
+
+##############################
+# backends                   #
+##############################
+# A backend waits for changes and reports them as (full name of a changed
+# folder, whether its sub folders need to be looked into as well).
+# It's given the tree when created and by watch, after every batch, on
+# the model's thread; wait runs on the watcher thread and never touches it.
+
+class InotifyBackend(object):
+    IN_MODIFY = 0x002
+    IN_ATTRIB = 0x004
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_MOVE_SELF = 0x800
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ONLYDIR = 0x1000000
+    mask = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | \
+           IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+    eventHeader = struct.Struct('iIII')
+
+    def __init__(self, rootDataItem):
+        import ctypes, ctypes.util
+        self.__libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.__errno = ctypes.get_errno
+        self.fd = self.__libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(self.__errno(), 'inotify_init failed')
+        self.__folders = {}
+        self.__wds = {}
+        self.busy = False
+        try:
+            self.watch(rootDataItem)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def watch(self, rootDataItem):
+        """Watches the folders of the tree not watched yet."""
+        for fullName in _folders(rootDataItem):
+            if fullName in self.__wds:
+                continue
+            wd = self.__libc.inotify_add_watch(self.fd, fullName, self.mask)
+            if wd < 0:
+                code = self.__errno()
+                if code == errno.ENOSPC:
+                    raise OSError(code, 'too many inotify watches, see /proc/sys/fs/inotify/max_user_watches')
+                # gone or not accessible
+                continue
+            self.__folders[wd] = fullName
+            self.__wds[fullName] = wd
+
+    def wait(self, timeout):
+        readable = select.select([self.fd], [], [], timeout)[0]
+        self.busy = bool(readable)
+        if not readable:
+            return []
+        buf = os.read(self.fd, 64 * 1024)
+        changes = []
+        offset = 0
+        while offset < len(buf):
+            wd, mask, cookie, length = self.eventHeader.unpack_from(buf, offset)
+            offset += self.eventHeader.size + length
+            if mask & self.IN_Q_OVERFLOW:
+                # events are lost, look into everything
+                changes.extend((fullName, True) for fullName in self.__folders.values())
+                continue
+            fullName = self.__folders.get(wd)
+            if fullName is None:
+                continue
+            if mask & self.IN_IGNORED:
+                del self.__folders[wd]
+                del self.__wds[fullName]
+                continue
+            if mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF):
+                # the parent folder sees the change
+                fullName = path.dirname(fullName)
+            changes.append((fullName, False))
+        return changes
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingBackend(object):
+    """Stats every compared file/folder every WATCH_INTERVAL seconds.
+    What's polled, and the signatures it's checked against, are copied
+    from the tree by watch."""
+
+    def __init__(self, rootDataItem, interval=None):
+        self.interval = float(conf.watchInterval) if interval is None else interval
+        self.busy = False
+        self.__last = 0
+        self.watch(rootDataItem)
+
+    def watch(self, rootDataItem):
+        # replaced as a whole, while wait may be going through the last one
+        self.__targets = _pollTargets(rootDataItem)
+
+    def wait(self, timeout):
+        wait = self.__last + self.interval - time.time()
+        if wait > timeout:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(wait, 0))
+        self.__last = time.time()
+        changes = []
+        for folder, known in self.__targets:
+            for fullName, sig in known:
+                try:
+                    now = model._signature(model._stat(fullName))
+                except OSError:
+                    now = None
+                if now != sig:
+                    changes.append((folder, False))
+                    break
+        return changes
+
+    def close(self):
+        pass
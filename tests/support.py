@@ -0,0 +1,62 @@
+#    -*- coding: utf-8 -*-
+#    Advanced directory compare tool in Python.
+#
+#    Copyright (C) 2008, 2009  Pan Xingzhi
+#    http://code.google.com/p/dircompare/
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""What the test modules share. Run the tests from the top folder with:
+    python -m unittest discover -s tests"""
+
+import os
+import os.path as path
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..', 'src'))
+
+import configuration as conf
+# keep the tests off the hash cache of the user
+conf.hashCache = ''
+
+def makeFiles(root, files):
+    """Creates <files>, a dict of relative names to contents, under <root>;
+    a name ending with '/' is an empty folder."""
+    for relName, data in files.items():
+        fileName = path.join(root, relName)
+        folder = fileName if relName.endswith('/') else path.dirname(fileName)
+        if not path.isdir(folder):
+            os.makedirs(folder)
+        if not relName.endswith('/'):
+            fp = open(fileName, 'wb')
+            fp.write(data)
+            fp.close()
+
+class TreeTestCase(unittest.TestCase):
+    """Gives each test a scratch folder holding an empty left and right
+    folder."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='dircompare')
+        self.left = path.join(self.root, 'left')
+        self.right = path.join(self.root, 'right')
+        os.mkdir(self.left)
+        os.mkdir(self.right)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
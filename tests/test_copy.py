@@ -0,0 +1,80 @@
+#    -*- coding: utf-8 -*-
+#    Advanced directory compare tool in Python.
+#
+#    Copyright (C) 2008, 2009  Pan Xingzhi
+#    http://code.google.com/p/dircompare/
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os.path as path
+
+from support import makeFiles, TreeTestCase
+import model
+import manifest
+
+class ManifestCopyTest(TreeTestCase):
+    """A side read from a manifest can't be copied to or from."""
+
+    def setUp(self):
+        TreeTestCase.setUp(self)
+        makeFiles(self.left, {'same': 'x', 'diff': 'left', 'leftOnly': 'l'})
+        makeFiles(self.right, {'same': 'x', 'diff': 'right', 'rightOnly': 'r'})
+
+    def manifestOf(self, folder):
+        fileName = folder + '.dcm'
+        fp = open(fileName, 'wb')
+        manifest.write(folder, fp)
+        fp.close()
+        return fileName
+
+    def compare(self, leftLocation, rightLocation):
+        root = model.DirectoryDataItem('', leftLocation, rightLocation)
+        root.compare()
+        return root
+
+    def testCopyToManifest(self):
+        root = self.compare(self.left, self.manifestOf(self.right))
+        for name in ('diff', 'leftOnly'):
+            self.assertRaises(model.InvalidMethodInvocationError,
+                              root.getChild(name, False).copyTo, 'left', 'right')
+
+    def testCopyFromManifest(self):
+        root = self.compare(self.manifestOf(self.left), self.right)
+        for name in ('diff', 'leftOnly'):
+            self.assertRaises(model.InvalidMethodInvocationError,
+                              root.getChild(name, False).copyTo, 'left', 'right')
+        self.assertFalse(path.exists(path.join(self.right, 'leftOnly')))
+        self.assertEqual(open(path.join(self.right, 'diff'), 'rb').read(), 'right')
+
+class TypeClashTest(TreeTestCase):
+    """A file isn't copied over a folder of the same name, nor a folder
+    over a file."""
+
+    def setUp(self):
+        TreeTestCase.setUp(self)
+        makeFiles(self.left, {'x/f': 'left'})
+        makeFiles(self.right, {'x': 'right'})
+        self.rootDataItem = model.DirectoryDataItem('', self.left, self.right)
+        self.rootDataItem.compare()
+
+    def testFolderOverFile(self):
+        self.assertRaises(model.InvalidMethodInvocationError,
+                          self.rootDataItem.getChild('x', True).copyTo, 'left', 'right')
+        self.assertEqual(open(path.join(self.right, 'x'), 'rb').read(), 'right')
+
+    def testFileOverFolder(self):
+        self.assertRaises(model.InvalidMethodInvocationError,
+                          self.rootDataItem.getChild('x', False).copyTo, 'right', 'left')
+        self.assertFalse(path.exists(path.join(self.left, 'x', 'x')))
@@ -0,0 +1,67 @@
+#    -*- coding: utf-8 -*-
+#    Advanced directory compare tool in Python.
+#
+#    Copyright (C) 2008, 2009  Pan Xingzhi
+#    http://code.google.com/p/dircompare/
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import os.path as path
+
+from support import makeFiles, TreeTestCase
+import model
+
+# deeper than a few calls a level would allow
+DEPTH = 400
+
+class DeepTreeTest(TreeTestCase):
+
+    def setUp(self):
+        TreeTestCase.setUp(self)
+        self.bottom = ''
+        for i in range(DEPTH):
+            self.bottom = path.join(self.bottom, 'd')
+            for side in (self.left, self.right):
+                os.mkdir(path.join(side, self.bottom))
+        makeFiles(self.left, {path.join(self.bottom, 'f'): 'left'})
+        makeFiles(self.right, {path.join(self.bottom, 'f'): 'right'})
+        self.rootDataItem = model.DirectoryDataItem('', self.left, self.right)
+        self.rootDataItem.compare()
+
+    def bottomItem(self):
+        itm = self.rootDataItem
+        for name in self.bottom.split(os.sep):
+            itm = itm.getChild(name, True)
+        return itm.getChild('f', False)
+
+    def testFileCopied(self):
+        self.assertEqual(self.rootDataItem.status, model.STATUS_COMMON_DIFF)
+        self.bottomItem().copyTo('left', 'right')
+        self.assertEqual(self.rootDataItem.status, model.STATUS_COMMON_SAME)
+        self.assertEqual(self.rootDataItem.subtreeStats()['same'], DEPTH + 1)
+
+    def testRefreshed(self):
+        makeFiles(self.right, {path.join(self.bottom, 'f'): 'left'})
+        self.rootDataItem.refresh()
+        self.assertEqual(self.rootDataItem.status, model.STATUS_COMMON_SAME)
+
+    def testFolderCopiedAndDeleted(self):
+        top = self.rootDataItem.getChild('d', True)
+        top.copyTo('left', 'right')
+        self.assertEqual(self.rootDataItem.status, model.STATUS_COMMON_SAME)
+        top.delete('right')
+        self.assertEqual((self.rootDataItem.status, top.status),
+                         (model.STATUS_COMMON_DIFF, model.STATUS_LEFT_ONLY))
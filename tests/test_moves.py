@@ -0,0 +1,41 @@
+#    -*- coding: utf-8 -*-
+#    Advanced directory compare tool in Python.
+#
+#    Copyright (C) 2008, 2009  Pan Xingzhi
+#    http://code.google.com/p/dircompare/
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from support import makeFiles, TreeTestCase
+import model
+
+class MovesTest(TreeTestCase):
+
+    def testMarkedThroughCallAfter(self):
+        makeFiles(self.left, {'old': 'moved content'})
+        makeFiles(self.right, {'sub/new': 'moved content'})
+        root = model.DirectoryDataItem('', self.left, self.right)
+        calls = []
+        root.compare(detectMoves=True, callAfter=lambda func, *args: calls.append((func, args)))
+        old = root.getChild('old', False)
+        new = root.getChild('sub', True).getChild('new', False)
+        self.assertEqual((old.status, new.status),
+                         (model.STATUS_LEFT_ONLY, model.STATUS_RIGHT_ONLY))
+        self.assertEqual(len(calls), 1)
+        func, args = calls[0]
+        func(*args)
+        self.assertEqual((old.status, new.status),
+                         (model.STATUS_LEFT_MOVED, model.STATUS_RIGHT_MOVED))
+        self.assertEqual(old.counterpart, 'sub/new')
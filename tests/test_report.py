@@ -0,0 +1,39 @@
+#    -*- coding: utf-8 -*-
+#    Advanced directory compare tool in Python.
+#
+#    Copyright (C) 2008, 2009  Pan Xingzhi
+#    http://code.google.com/p/dircompare/
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import StringIO
+
+from support import makeFiles, TreeTestCase
+import model
+import report
+
+class MaxDepthTest(TreeTestCase):
+
+    def testLastLevel(self):
+        makeFiles(self.left, {'common/f': 'x', 'leftOnly/f': 'x', 'leftEmpty/': None})
+        makeFiles(self.right, {'common/f': 'x'})
+        out = StringIO.StringIO()
+        report.writeText(report.iterCompare(self.left, self.right,
+                                            filters=model.WalkFilter(maxDepth=1)), out)
+        self.assertEqual(out.getvalue().splitlines(),
+                         ['common pending  common/',
+                          'left only       leftEmpty/ (not listed)',
+                          'left only       leftOnly/ (not listed)',
+                          'common diff     ./ (2 left only, 1 not compared yet)'])
@@ -0,0 +1,44 @@
+#    -*- coding: utf-8 -*-
+#    Advanced directory compare tool in Python.
+#
+#    Copyright (C) 2008, 2009  Pan Xingzhi
+#    http://code.google.com/p/dircompare/
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import os.path as path
+
+from support import makeFiles, TreeTestCase
+import model
+import snapshot
+
+class SnapshotTest(TreeTestCase):
+
+    def testNamesNotUtf8(self):
+        # latin-1, not UTF-8
+        left = path.join(self.root, 'l\xe9ft')
+        os.rename(self.left, left)
+        makeFiles(left, {'caf\xe9': 'left', 'same': 'x'})
+        makeFiles(self.right, {'caf\xe9': 'right', 'same': 'x'})
+        ignore = ('*.\xe9', )
+        root = model.DirectoryDataItem('', left, self.right)
+        root.compare(ignore)
+        fileName = path.join(self.root, 'snapshot')
+        snapshot.save(root, fileName, model.CompareSession(left, self.right, ignore))
+        loaded, session = snapshot.load(fileName)
+        self.assertEqual((loaded.leftLocation, loaded.rightLocation), (left, self.right))
+        self.assertEqual(session.ignore, ignore)
+        self.assertEqual(loaded.getChild('caf\xe9', False).status, model.STATUS_COMMON_DIFF)
@@ -0,0 +1,71 @@
+#    -*- coding: utf-8 -*-
+#    Advanced directory compare tool in Python.
+#
+#    Copyright (C) 2008, 2009  Pan Xingzhi
+#    http://code.google.com/p/dircompare/
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import os.path as path
+import sys
+import StringIO
+
+from support import makeFiles, TreeTestCase
+import sync
+
+class CheckpointTest(TreeTestCase):
+
+    def sync(self, *args):
+        stderr, sys.stderr = sys.stderr, StringIO.StringIO()
+        try:
+            return sync.main(list(args))
+        finally:
+            sys.stderr = stderr
+
+    def testResumes(self):
+        makeFiles(self.left, {'a': 'a', 'b': 'b'})
+        planFile = path.join(self.root, 'plan')
+        self.assertEqual(self.sync('plan', '-o', planFile, self.left, self.right), 0)
+        plan = sync.loadPlan(planFile)
+        # as if the run had stopped after the first copy
+        sync.Checkpoint(sync.checkpointName(planFile), plan.id).record(0)
+        self.assertEqual(self.sync('run', planFile), 0)
+        self.assertEqual(os.listdir(self.right), ['b'])
+
+    def testNewPlanDropsCheckpoint(self):
+        makeFiles(self.left, {'a': 'a', 'b': 'b'})
+        planFile = path.join(self.root, 'plan')
+        self.sync('plan', '-o', planFile, self.left, self.right)
+        self.assertEqual(self.sync('run', planFile), 0)
+        makeFiles(self.left, {'c': 'c', 'd': 'd'})
+        self.sync('plan', '-o', planFile, self.left, self.right)
+        self.assertFalse(path.exists(sync.checkpointName(planFile)))
+        self.assertEqual(self.sync('run', planFile), 0)
+        self.assertEqual(sorted(os.listdir(self.right)), ['a', 'b', 'c', 'd'])
+
+    def testIgnoresCheckpointOfAnotherPlan(self):
+        makeFiles(self.left, {'a': 'a', 'b': 'b'})
+        planFile = path.join(self.root, 'plan')
+        self.sync('plan', '-o', planFile, self.left, self.right)
+        self.sync('run', planFile)
+        checkpoint = open(sync.checkpointName(planFile), 'rb').read()
+        makeFiles(self.left, {'c': 'c', 'd': 'd'})
+        os.remove(path.join(self.right, 'a'))
+        os.remove(path.join(self.right, 'b'))
+        self.sync('plan', '-o', planFile, self.left, self.right)
+        open(sync.checkpointName(planFile), 'wb').write(checkpoint)
+        self.assertEqual(self.sync('run', planFile), 0)
+        self.assertEqual(sorted(os.listdir(self.right)), ['a', 'b', 'c', 'd'])
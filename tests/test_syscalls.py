@@ -0,0 +1,52 @@
+#    -*- coding: utf-8 -*-
+#    Advanced directory compare tool in Python.
+#
+#    Copyright (C) 2008, 2009  Pan Xingzhi
+#    http://code.google.com/p/dircompare/
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os.path as path
+import sys
+import StringIO
+
+from support import TreeTestCase
+import configuration as conf
+import hashcache
+import benchmark
+
+class SyscallTest(TreeTestCase):
+    """Comparing lists each folder once and stats each entry once, see
+    benchmark.checkSyscalls."""
+
+    def setUp(self):
+        TreeTestCase.setUp(self)
+        # a cache whose folder doesn't exist yet, made on first use
+        conf.hashCache = path.join(self.root, 'cache', 'DirCompare.cache')
+
+    def tearDown(self):
+        hashcache.flush()
+        hashcache._cache = None
+        conf.hashCache = ''
+        TreeTestCase.tearDown(self)
+
+    def testOncePerEntry(self):
+        stdout, sys.stdout = sys.stdout, StringIO.StringIO()
+        try:
+            failures = benchmark.checkSyscalls()
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(failures, 0, output)
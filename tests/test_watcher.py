@@ -0,0 +1,60 @@
+#    -*- coding: utf-8 -*-
+#    Advanced directory compare tool in Python.
+#
+#    Copyright (C) 2008, 2009  Pan Xingzhi
+#    http://code.google.com/p/dircompare/
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import os.path as path
+import time
+
+from support import makeFiles, TreeTestCase
+import model
+import watcher
+
+class PollingWatcherTest(TreeTestCase):
+
+    def waitFor(self, condition, timeout=10):
+        end = time.time() + timeout
+        while not condition() and time.time() < end:
+            time.sleep(0.1)
+        return condition()
+
+    def testRefreshesChanges(self):
+        makeFiles(self.left, {'gone': 'gone', 'sub/changed': 'same'})
+        makeFiles(self.right, {'gone': 'gone', 'sub/changed': 'same'})
+        root = model.DirectoryDataItem('', self.left, self.right)
+        root.compare()
+        backend = watcher.PollingBackend(root, 0.1)
+        self.assertTrue(isinstance(backend, watcher.PollingBackend))
+        w = watcher.Watcher(root, delay=0.2, maxDelay=1, backend=backend)
+        w.start()
+        try:
+            makeFiles(self.left, {'new': 'new'})
+            makeFiles(self.right, {'sub/changed': 'changed'})
+            os.remove(path.join(self.left, 'gone'))
+            sub = root.getChild('sub', True)
+            def refreshed():
+                new = root.getChild('new', False)
+                return (new is not None and new.status == model.STATUS_LEFT_ONLY
+                        and root.getChild('gone', False).status == model.STATUS_RIGHT_ONLY
+                        and sub.getChild('changed', False).status == model.STATUS_COMMON_DIFF
+                        and sub.status == root.status == model.STATUS_COMMON_DIFF)
+            self.assertTrue(self.waitFor(refreshed))
+        finally:
+            w.stop()
+            w.join()